@@ -0,0 +1,434 @@
+"""
+Benchmarks the handlers and optimizers on a generated corpus of plain text and html and compares the results with a
+stored baseline. The corpus is generated with a fixed seed, so every run uses the same input.
+
+Usage:
+    python benchmarks/run.py                    # Run everything and compare with `benchmarks/baseline.json`
+    python benchmarks/run.py --quick            # Only sizes up to 100 KB
+    python benchmarks/run.py --filter handler   # Only cases containing "handler"
+    python benchmarks/run.py --save-baseline    # Store the results as the new baseline
+
+Exits with 1, if a case is slower or uses more memory than the baseline (plus `--tolerance`). If a single run of a
+case would take longer than `--max-time` (extrapolated from the smaller size), it is skipped, which counts as
+regression, if the baseline contains it.
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import *
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from django.conf import settings
+
+if not settings.configured:
+    # The incremental handler caches the optimized blocks
+    settings.configure(CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 100_000},
+        }
+    })
+
+from django_common_utils.libraries.handlers.handlers import ApplyHandler
+from django_common_utils.libraries.handlers.mixins import (
+    HTMLOptimizerHandler, RegexHandler, RegexSetHandler, TextOptimizerHandler, WhiteSpaceStripHandler
+)
+from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer, TextOptimizer
+from django_common_utils.libraries.handlers.optimizers.backends import HTML_BACKENDS
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+SEED = 394
+
+KB = 1024
+MB = 1024 * KB
+SIZES = {
+    "1KB": KB,
+    "10KB": 10 * KB,
+    "100KB": 100 * KB,
+    "1MB": MB,
+    "5MB": 5 * MB,
+}
+QUICK_SIZES = ("1KB", "10KB", "100KB")
+
+# Minimum time to spend on a case, the best run is reported
+MIN_TIME = 0.2
+MAX_REPEAT = 50
+# Seconds, bigger sizes of a case are skipped, if a single run would take longer (e.g. for quadratic cases)
+MAX_TIME = 30.0
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore "
+    "magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo"
+).split()
+# Separators with the usual mistakes the optimizers fix
+SEPARATORS = (" ", " ", " ", " ", "  ", ",", " ,", ", ", "!", " .", ":", "(", ")", " - ", "3.5", "%")
+
+
+# Corpus
+
+def create_sentence(rand: random.Random) -> str:
+    return "".join(
+        rand.choice(WORDS) + rand.choice(SEPARATORS)
+        for _ in range(rand.randint(5, 15))
+    ).capitalize() + ". "
+
+
+def repeat_blocks(size: int, create_block: Callable[[random.Random, int], str], start: str = "", end: str = "") -> str:
+    """Joins blocks until `size` is reached. Only whole blocks are used, so the html stays valid."""
+    rand = random.Random(SEED)
+    blocks = []
+    length = len(start) + len(end)
+    index = 0
+    
+    while length < size:
+        block = create_block(rand, index)
+        blocks.append(block)
+        length += len(block)
+        index += 1
+    
+    return start + "".join(blocks) + end
+
+
+def create_text(size: int) -> str:
+    return repeat_blocks(size, lambda rand, index: create_sentence(rand))
+
+
+def create_paragraphs(size: int) -> str:
+    return repeat_blocks(
+        size,
+        lambda rand, index: f"<p>{create_sentence(rand)}<b>{rand.choice(WORDS)}</b> "
+                            f"<a href=\"/page/{index}\">{create_sentence(rand)}</a>{create_sentence(rand)}</p>\n"
+    )
+
+
+def create_nested(size: int, depth: int = 100) -> str:
+    # The depth is limited, documents are made bigger by repeating the nested blocks
+    def create_block(rand: random.Random, index: int) -> str:
+        opening = "".join(
+            f"<div class=\"level-{level}\"><span>{create_sentence(rand)}</span>"
+            for level in range(depth)
+        )
+        return opening + "</div>" * depth + "\n"
+    
+    return repeat_blocks(size, create_block)
+
+
+def create_table(size: int, columns: int = 50) -> str:
+    def create_row(rand: random.Random, index: int) -> str:
+        cells = "".join(f"<td>{rand.choice(WORDS)} ,{rand.randint(0, 999)}  !</td>" for _ in range(columns))
+        return f"<tr>{cells}</tr>\n"
+    
+    return repeat_blocks(size, create_row, "<table>\n", "</table>")
+
+
+def create_images(size: int) -> str:
+    return repeat_blocks(
+        size,
+        lambda rand, index: f"<p><img src=\"/media/{index}.jpg\" alt=\"{rand.choice(WORDS)}\"></p>\n"
+                            f"<p>{create_sentence(rand)}<img src=\"/media/{index}-small.jpg\"></p>\n"
+    )
+
+
+TEXT_CORPUS = {
+    "prose": create_text,
+}
+HTML_CORPUS = {
+    "paragraphs": create_paragraphs,
+    "nested": create_nested,
+    "table": create_table,
+    "images": create_images,
+}
+
+
+# Cases
+# Each case returns a function, that is measured, and optionally a function creating its argument (not measured)
+
+Case = Callable[[str], Tuple[Callable[[Any], Any], Optional[Callable[[], Any]]]]
+
+
+def measure_value(func: Callable[[str], Any]) -> Case:
+    return lambda value: (func, lambda: value)
+
+
+def measure_stage(stage: Callable[[Any], Any]) -> Case:
+    # Stages change the tree, so each run gets a freshly parsed tree
+    return lambda value: (stage, lambda: TextHTMLOptimizer._parse(value))
+
+
+def measure_apply_handler(value: str) -> Tuple[Callable[[Any], Any], Optional[Callable[[], Any]]]:
+    handlers = {
+        "title": (WhiteSpaceStripHandler(), TextOptimizerHandler()),
+        "body": (HTMLOptimizerHandler(),),
+    }
+    
+    return (
+        lambda instance: ApplyHandler(instance, handlers).handle(),
+        lambda: SimpleNamespace(title="  A  title,with mistakes !", body=value)
+    )
+
+
+def measure_incremental_edit(value: str) -> Tuple[Callable[[Any], Any], Optional[Callable[[], Any]]]:
+    """Optimizes `value` once, each run then changes the text of one element in the middle."""
+    handler = HTMLOptimizerHandler(incremental=True)
+    handler.handle(value)
+    position = value.find("</", len(value) // 2)
+    edits = iter(range(MAX_REPEAT * 2 + 1))
+    
+    return handler.handle, lambda: f"{value[:position]} edit {next(edits)}{value[position:]}"
+
+
+text_optimizer = TextOptimizer.compile()
+# Typographic fixes and replaced terms, as they are stacked on a field
+SUBSTITUTIONS = {
+    r"\s+([,.!?:;])": r"\1",
+    r"([,!?:;])(?=\w)": r"\1 ",
+    r"\(\s+": "(",
+    r"\s+\)": ")",
+    r"(?P<amount>\d)\s*%": r"\g<amount> %",
+    r" - ": " \u2013 ",
+    r"\.{3}": "\u2026",
+    r"\blorem\b": "Lorem",
+    r"\bipsum\b": "Ipsum",
+    r"\bdolor\b": "pain",
+    r"\bconsectetur\b": "adipisci",
+    r"  +": " ",
+}
+substitution_chain = [
+    RegexHandler(pattern=pattern, replacement=replacement)
+    for pattern, replacement in SUBSTITUTIONS.items()
+]
+
+
+def handle_chain(value: str) -> str:
+    for handler in substitution_chain:
+        value = handler.handle(value)
+    return value
+
+
+TEXT_CASES: Dict[str, Case] = {
+    "TextOptimizer.compile().optimize": measure_value(text_optimizer.optimize),
+    "TextOptimizer.remove_redundant_space": measure_value(TextOptimizer.remove_redundant_space),
+    "TextOptimizer.space_after_text": measure_value(TextOptimizer.space_after_text),
+    "TextOptimizer.space_before_text": measure_value(TextOptimizer.space_before_text),
+    "RegexHandler": measure_value(RegexHandler(pattern=r"\s*,\s*", replacement=", ").handle),
+    "RegexHandler[12 chained]": measure_value(handle_chain),
+    "RegexSetHandler[12 patterns]": measure_value(RegexSetHandler(patterns=SUBSTITUTIONS).handle),
+    "WhiteSpaceStripHandler": measure_value(WhiteSpaceStripHandler().handle),
+}
+HTML_CASES: Dict[str, Case] = {
+    "TextHTMLOptimizer.parse": measure_value(TextHTMLOptimizer._parse),
+    "TextHTMLOptimizer.unwrap": measure_stage(TextHTMLOptimizer._unwrap),
+    "TextHTMLOptimizer.add_attributes": measure_stage(TextHTMLOptimizer._add_attributes_to_tags),
+    "TextHTMLOptimizer.change_text": measure_stage(
+        lambda soup: TextHTMLOptimizer._change_text(soup, text_optimizer.optimize)
+    ),
+    "TextHTMLOptimizer.serialize": measure_stage(str),
+    **{
+        f"TextHTMLOptimizer.optimize[{name}]": measure_value(
+            lambda value, name=name: TextHTMLOptimizer.optimize(value, backend=name)
+        )
+        for name, backend in HTML_BACKENDS.items()
+        if backend.is_available()
+    },
+    "HTMLOptimizerHandler": measure_value(HTMLOptimizerHandler().handle),
+    "HTMLOptimizerHandler[incremental]": measure_incremental_edit,
+    "ApplyHandler": measure_apply_handler,
+}
+
+
+def time_case(func: Callable[[Any], Any], setup: Callable[[], Any]) -> float:
+    """Returns the best time of at least one run and up to `MAX_REPEAT` runs, taking at least `MIN_TIME`."""
+    best = float("inf")
+    spent = 0.0
+    
+    for _ in range(MAX_REPEAT):
+        argument = setup()
+        gc.collect()
+        
+        start = time.perf_counter()
+        func(argument)
+        duration = time.perf_counter() - start
+        
+        best = min(best, duration)
+        spent += duration
+        
+        if spent >= MIN_TIME:
+            break
+    
+    return best
+
+
+def measure_memory(func: Callable[[Any], Any], setup: Callable[[], Any]) -> int:
+    """Returns the peak of the memory allocated while running `func` in bytes."""
+    argument = setup()
+    gc.collect()
+    
+    tracemalloc.start()
+    try:
+        func(argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def get_cases(
+        sizes: Iterable[str],
+        name_filter: Optional[str]
+) -> Generator[Tuple[str, Case, str, Callable], Any, None]:
+    for corpus, cases in ((TEXT_CORPUS, TEXT_CASES), (HTML_CORPUS, HTML_CASES)):
+        for case_name, case in cases.items():
+            for structure, create in corpus.items():
+                for size in sizes:
+                    key = f"{case_name}/{structure}/{size}"
+                    
+                    if name_filter is None or name_filter.lower() in key.lower():
+                        yield key, case, size, lambda create=create, size=size: create(SIZES[size])
+
+
+def run(
+        sizes: Iterable[str],
+        name_filter: Optional[str],
+        memory: bool,
+        max_time: float
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    corpus_cache = {}
+    # (case, structure) -> (size, duration) of the last measured size
+    previous = {}
+    
+    for key, case, size, create in get_cases(sizes, name_filter):
+        case_name, structure_key = key.split("/", 1)
+        structure = structure_key.split("/")[0]
+        
+        if (case_name, structure) in previous:
+            previous_size, previous_duration = previous[case_name, structure]
+            
+            # Expect at least linear scaling
+            if previous_duration is None or previous_duration * SIZES[size] / SIZES[previous_size] > max_time:
+                previous[case_name, structure] = (size, None)
+                result = results[key] = {"skipped": True}
+                print_result(key, result)
+                continue
+        
+        value = corpus_cache.get(structure_key)
+        
+        if value is None:
+            value = corpus_cache[structure_key] = create()
+        
+        func, setup = case(value)
+        duration = time_case(func, setup)
+        previous[case_name, structure] = (size, duration)
+        result = results[key] = {
+            "throughput": len(value) / MB / duration,
+        }
+        
+        if memory:
+            result["peak_memory"] = measure_memory(func, setup)
+        
+        print_result(key, result)
+    
+    return results
+
+
+def print_result(key: str, result: Dict[str, float]) -> None:
+    if result.get("skipped"):
+        print(f"{key:<70} skipped, would take longer than --max-time", flush=True)
+        return
+    
+    line = f"{key:<70} {result['throughput']:>10.2f} MB/s"
+    
+    if "peak_memory" in result:
+        line += f" {result['peak_memory'] / MB:>10.2f} MB"
+    
+    print(line, flush=True)
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """Returns the descriptions of all regressions."""
+    regressions = []
+    
+    for key, result in results.items():
+        expected = baseline.get(key)
+        
+        if expected is None or expected.get("skipped"):
+            continue
+        
+        if result.get("skipped"):
+            regressions.append(f"{key}: skipped, would take longer than --max-time")
+            continue
+        
+        if result["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: {result['throughput']:.2f} MB/s, baseline {expected['throughput']:.2f} MB/s "
+                f"({result['throughput'] / expected['throughput'] - 1:+.0%})"
+            )
+        if "peak_memory" in result and "peak_memory" in expected and \
+                result["peak_memory"] > expected["peak_memory"] * (1 + tolerance):
+            regressions.append(
+                f"{key}: {result['peak_memory'] / MB:.2f} MB peak memory, baseline {expected['peak_memory'] / MB:.2f} "
+                f"MB ({result['peak_memory'] / expected['peak_memory'] - 1:+.0%})"
+            )
+    
+    return regressions
+
+
+def main(arguments: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the handlers and optimizers.")
+    parser.add_argument("--quick", action="store_true", help=f"Only run the sizes {', '.join(QUICK_SIZES)}")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES.keys(), help="Sizes of the corpus to run")
+    parser.add_argument("--filter", dest="name_filter", help="Only run cases containing this string")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Don't measure the peak memory")
+    parser.add_argument(
+        "--max-time", type=float, default=MAX_TIME,
+        help=f"Bigger sizes of a case are skipped, if a run would take longer than this (default: {MAX_TIME} seconds)"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Path of the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="Allowed relative difference to the baseline, before a case counts as regression (default: 0.25)"
+    )
+    options = parser.parse_args(arguments)
+    
+    sizes = options.sizes or (QUICK_SIZES if options.quick else SIZES.keys())
+    results = run(sizes, options.name_filter, options.memory, options.max_time)
+    
+    if options.save_baseline:
+        baseline = json.loads(options.baseline.read_text()) if options.baseline.exists() else {"results": {}}
+        baseline["meta"] = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        }
+        # Results of cases that haven't been run are kept
+        baseline["results"].update(results)
+        options.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"\nStored {len(results)} results in {options.baseline}")
+        return 0
+    
+    if not options.baseline.exists():
+        print(f"\nNo baseline found at {options.baseline}, use --save-baseline to create one")
+        return 0
+    
+    regressions = compare(results, json.loads(options.baseline.read_text())["results"], options.tolerance)
+    
+    if regressions:
+        print(f"\n{len(regressions)} REGRESSION(S) compared to {options.baseline}:", file=sys.stderr)
+        for regression in regressions:
+            print(f"    {regression}", file=sys.stderr)
+        return 1
+    
+    print(f"\nNo regressions compared to {options.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Compares the scaling of the text node walker of `TextHTMLOptimizer._change_text` with the previous implementation,
+which called `find_all()` for every element to check whether it is a leaf.
+
+Usage: python benchmarks/text_walker.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bs4 import BeautifulSoup
+
+from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer, TextOptimizer
+
+SIZES = [100, 200, 400, 800, 1600]
+
+
+def legacy_change_text(soup: BeautifulSoup, func, *args, **kwargs) -> BeautifulSoup:
+    for element in soup.find_all():
+        if len(element.find_all()) > 0:
+            continue
+        
+        element.string = func(element.get_text(), *args, **kwargs)
+    
+    return soup
+
+
+def create_table(rows: int) -> str:
+    cells = "".join(f"<td>Cell,{column}  !</td>" for column in range(4))
+    return "<table>" + f"<tr>{cells}</tr>" * (rows // 4) + "</table>"
+
+
+def create_nested_list(items: int) -> str:
+    return "<ul><li>Item,one  !" * items + "</li></ul>" * items
+
+
+def measure(func, html: str) -> float:
+    return min(timeit.repeat(
+        lambda: func(BeautifulSoup(html, "html.parser"), TextOptimizer.space_after_text),
+        number=1,
+        repeat=3,
+    ))
+
+
+def main():
+    for name, create in (("wide table", create_table), ("nested list", create_nested_list)):
+        print(f"{name:<12} {'nodes':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+        
+        for size in SIZES:
+            html = create(size)
+            before = measure(legacy_change_text, html)
+            after = measure(TextHTMLOptimizer._change_text, html)
+            
+            print(f"{'':<12} {size:>8} {before:>12.4f} {after:>12.4f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
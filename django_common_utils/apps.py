@@ -1,8 +1,26 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 
 
 class Config(AppConfig):
     name = "django_common_utils"
     
     def ready(self):
-        from . import signals
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        
+        from .libraries.handlers.models import HandlerMixin, check_handler_models
+        from .libraries.handlers.plans import build_handler_plans
+        from .libraries.handlers.pushdown import register_sqlite_functions
+        from .signals import connect_handlers
+        
+        for model in apps.get_models():
+            if issubclass(model, HandlerMixin):
+                # Resolve the handlers at startup, so that invalid definitions are reported right away
+                build_handler_plans(model)
+                # Only models with handlers get receivers, other models don't pay for them
+                connect_handlers(model)
+        
+        checks.register(check_handler_models, checks.Tags.models)
+        
+        # Lets handlers run as `REGEXP_REPLACE` on SQLite, too
+        connection_created.connect(register_sqlite_functions, dispatch_uid="django_common_utils.sqlite_functions")
@@ -0,0 +1,265 @@
+import threading
+from collections import Counter
+from functools import partial
+from typing import *
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, router, transaction
+
+from .constants import BudgetPolicy, HandleOn
+from .executors import get_background_executor
+from .instrumentation import logger
+from .plans import get_handler_plan
+from .typings import *
+from ..utils.settings import get_setting
+
+__all__ = [
+    "handle_after_commit", "clear_pending_handlers", "submit_pending_handlers", "split_deferred_handlers",
+    "get_pending_handlers", "run_queued_handlers"
+]
+
+QUEUES = ("thread", "database")
+
+# (model, primary key, field) -> number of submitted handlers of the thread pool, that haven't finished yet
+_pending = Counter()
+_lock = threading.Lock()
+
+
+def get_queue() -> str:
+    queue = get_setting("COMMON_HANDLER_DEFER_QUEUE", "thread")
+    
+    if queue not in QUEUES:
+        raise ValueError(f'COMMON_HANDLER_DEFER_QUEUE must be "thread" or "database", not "{queue}"')
+    if queue == "database" and not apps.is_installed("django_common_utils.queue"):
+        raise ImproperlyConfigured(
+            'COMMON_HANDLER_DEFER_QUEUE "database" requires "django_common_utils.queue.apps.Config" in INSTALLED_APPS'
+        )
+    
+    return queue
+
+
+def get_model(label: str) -> type:
+    from ...signals import registry
+    
+    # Models created after the app is ready (e.g. in tests) are only known to `connect_handlers`
+    for model in registry:
+        if model._meta.label == label:
+            return model
+    
+    return apps.get_model(label)
+
+
+def split_deferred_handlers(handler_list: Sequence[HandlerInstance]) -> Tuple[tuple, tuple]:
+    """Splits a chain of handlers before its first deferred handler. The handlers after it depend on its result, so
+    they are deferred, too."""
+    for index, handler in enumerate(handler_list):
+        if handler.defer:
+            return tuple(handler_list[:index]), tuple(handler_list[index:])
+    
+    return tuple(handler_list), ()
+
+
+def apply_deferred_handlers(
+        model: type, pk: Any, field: str, handlers: Sequence[HandlerInstance], value: Any, using: str
+) -> None:
+    values = {field: value}
+    
+    for handler in handlers:
+        if handler.budget is None or handler.budget.policy == BudgetPolicy.DEFER:
+            # Handlers, that exceeded their budget in `save`, run without it here
+            values[field] = handler.handle(values[field])
+        else:
+            values[field] = handler.budget.handle(model, field, handler, values[field])
+        
+        if handler.get_companion_fields(field):
+            values.update(handler.get_companion_values(field, values[field]))
+    
+    if values != {field: value}:
+        # The row isn't updated, if it has been changed in the meantime
+        model._base_manager.using(using).filter(pk=pk, **{field: value}).update(**values)
+
+
+def handle_in_background(
+        model: type, pk: Any, field: str, handlers: Sequence[HandlerInstance], value: Any, using: str
+) -> None:
+    close_old_connections()
+    
+    try:
+        apply_deferred_handlers(model, pk, field, handlers, value, using)
+    except Exception:
+        logger.exception("Deferred handlers of %s.%s (primary key %s) failed.", model._meta.label, field, pk)
+    finally:
+        with _lock:
+            _pending[model, pk, field] -= 1
+            
+            if _pending[model, pk, field] <= 0:
+                del _pending[model, pk, field]
+        
+        close_old_connections()
+
+
+def submit_to_thread(model: type, pk: Any, field: str, handlers: Sequence[HandlerInstance], value: Any, using: str):
+    with _lock:
+        _pending[model, pk, field] += 1
+    
+    get_background_executor().submit(handle_in_background, model, pk, field, handlers, value, using)
+
+
+def get_plan_indexes(model: type, field: str, action: str, handlers: Sequence[HandlerInstance]) -> Optional[str]:
+    """Returns the positions of `handlers` in the plan of the field, separated by commas, or None, if a handler
+    isn't part of the plan (so that it can't be stored in the database)."""
+    plan = get_handler_plan(model, action).handlers.get(field, ())
+    indexes = []
+    
+    for handler in handlers:
+        index = next((index for index, planned in enumerate(plan) if planned is handler), None)
+        
+        if index is None:
+            return None
+        indexes.append(str(index))
+    
+    return ",".join(indexes)
+
+
+def handle_after_commit(
+        instance, field: str, handlers: Sequence[HandlerInstance], action: Optional[str] = None
+) -> None:
+    """
+    Runs `handlers` on the value of `field` outside of the request, once the instance has been saved and the
+    transaction has been committed, and writes the result back using `update()`. The value is only written, if the row
+    still contains the value the handlers started from.
+    
+    The handlers are remembered on the instance until `submit_pending_handlers` is called after saving it (by the
+    `post_save` receiver). `action` is the action the handlers belong to, by default it is derived from the primary key
+    like in `pre_save`. If handlers of the field are already pending, `handlers` are put in front of them: handlers
+    deferred by their budget precede the deferred handlers of the chain (see `split_deferred_handlers`), both start
+    from the saved value.
+    """
+    if action is None:
+        action = HandleOn.CREATION if instance.pk is None else HandleOn.SAVE
+    
+    pending = instance.__dict__.setdefault("_pending_handlers", [])
+    
+    for index, (pending_field, pending_action, pending_handlers) in enumerate(pending):
+        if pending_field == field:
+            pending[index] = (field, pending_action, tuple(handlers) + pending_handlers)
+            return
+    
+    pending.append((field, action, tuple(handlers)))
+
+
+def clear_pending_handlers(instance) -> None:
+    """Forgets the handlers passed to `handle_after_commit`, that a failed save may have left behind."""
+    instance.__dict__.pop("_pending_handlers", None)
+
+
+def submit_pending_handlers(instance) -> None:
+    """Queues the handlers passed to `handle_after_commit` after the commit. Depending on
+    `COMMON_HANDLER_DEFER_QUEUE` they run in a thread pool ("thread") or are stored in the database ("database") and
+    run by the `run_deferred_handlers` command."""
+    pending = instance.__dict__.pop("_pending_handlers", None)
+    
+    if not pending:
+        return
+    
+    model = instance.__class__
+    using = router.db_for_write(model, instance=instance)
+    queue = get_queue()
+    entries = []
+    
+    for field, action, handlers in pending:
+        indexes = get_plan_indexes(model, field, action, handlers) if queue == "database" else None
+        
+        if indexes is None:
+            transaction.on_commit(
+                partial(submit_to_thread, model, instance.pk, field, handlers, getattr(instance, field), using),
+                using=using
+            )
+        else:
+            entries.append((field, action, indexes))
+    
+    if entries:
+        transaction.on_commit(partial(enqueue, model, instance.pk, entries, using), using=using)
+
+
+def enqueue(model: type, pk: Any, entries: List[Tuple[str, str, str]], using: str) -> None:
+    from ...queue.models import QueuedHandler
+    
+    # Rows already waiting for a field are handled with their current value anyway
+    QueuedHandler.objects.bulk_create([
+        QueuedHandler(
+            model_label=model._meta.label, object_pk=str(pk), field=field, action=action, handlers=indexes,
+            database=using,
+        )
+        for field, action, indexes in entries
+    ], ignore_conflicts=True)
+
+
+def run_queued_handlers(limit: Optional[int] = None) -> int:
+    """Runs the handlers queued in the database and returns the number of processed entries. Each entry is claimed
+    by deleting it, so that many workers can run at once. Failures are logged, the entry isn't queued again."""
+    from ...queue.models import QueuedHandler
+    
+    processed = 0
+    
+    for entry in QueuedHandler.objects.order_by("pk")[:limit]:
+        if not QueuedHandler.objects.filter(pk=entry.pk).delete()[0]:
+            # Claimed by another worker
+            continue
+        
+        processed += 1
+        
+        try:
+            model = get_model(entry.model_label)
+            plan = get_handler_plan(model, entry.action).handlers.get(entry.field, ())
+            indexes = [int(index) for index in entry.handlers.split(",")]
+            
+            if any(index >= len(plan) for index in indexes):
+                logger.warning(
+                    "The handlers of %s.%s have changed, the queued handlers are skipped.", entry.model_label,
+                    entry.field
+                )
+                continue
+            
+            values = list(
+                model._base_manager.using(entry.database)
+                    .filter(pk=entry.object_pk)
+                    .values_list(entry.field, flat=True)
+            )
+            
+            if values:
+                apply_deferred_handlers(
+                    model, entry.object_pk, entry.field, [plan[index] for index in indexes], values[0], entry.database
+                )
+        except Exception:
+            logger.exception(
+                "Deferred handlers of %s.%s (primary key %s) failed.", entry.model_label, entry.field, entry.object_pk
+            )
+    
+    return processed
+
+
+def get_pending_handlers(model: Optional[type] = None) -> List[Tuple[type, Any, str]]:
+    """Returns the rows, whose deferred handlers haven't run yet, as (model, primary key, field). Handlers waiting
+    for the commit of their transaction aren't included."""
+    with _lock:
+        pending = list(_pending)
+    
+    if get_queue() == "database":
+        from ...queue.models import QueuedHandler
+        
+        queryset = QueuedHandler.objects.order_by("pk")
+        
+        if model is not None:
+            queryset = queryset.filter(model_label=model._meta.label)
+        
+        for label, pk, field in queryset.values_list("model_label", "object_pk", "field"):
+            entry_model = get_model(label)
+            pending.append((entry_model, entry_model._meta.pk.to_python(pk), field))
+    
+    return [
+        entry
+        for entry in pending
+        if model is None or entry[0] is model
+    ]
@@ -0,0 +1,189 @@
+import asyncio
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import *
+
+from .constants import BudgetPolicy
+from .instrumentation import get_model_name, get_size, logger
+from .typings import *
+
+__all__ = [
+    "HandlerBudget", "HandlerTimeout", "HandlerDeferred", "cpu_time_limit"
+]
+
+POLICIES = (BudgetPolicy.PASSTHROUGH, BudgetPolicy.TRUNCATE, BudgetPolicy.DEFER)
+
+
+class HandlerTimeout(Exception):
+    """Raised inside of a handler, when it exceeds the CPU time of its budget."""
+
+
+class HandlerDeferred(Exception):
+    """Raised by `HandlerBudget.handle`, if the value exceeded the budget and the defer policy applies. The caller
+    defers the handler and the following handlers of the field using `handle_after_commit` and keeps the value."""
+
+
+@contextmanager
+def cpu_time_limit(seconds: Optional[float]) -> Generator[bool, Any, None]:
+    """
+    Raises `HandlerTimeout` inside of the block, once the current thread has used `seconds` of CPU time. This also
+    interrupts long running regular expressions. Yields whether the block can be interrupted: it uses `SIGPROF`,
+    which only works in the main thread and only if no one else uses it (e.g. a profiler). In other threads (e.g.
+    threaded WSGI workers, ASGI or executors) nothing is interrupted, `HandlerBudget` checks the CPU time of the
+    thread afterwards instead.
+    
+    `ITIMER_PROF` counts the CPU time of the whole process, so if other threads have used a part of it, the timer is
+    started again with the rest of the time of this thread.
+    """
+    if seconds is None or not hasattr(signal, "setitimer") or \
+            threading.current_thread() is not threading.main_thread() or \
+            signal.getsignal(signal.SIGPROF) not in (signal.SIG_DFL, None) or signal.getitimer(signal.ITIMER_PROF)[0]:
+        yield False
+        return
+    
+    state = {"active": True}
+    start = time.thread_time()
+    
+    def interrupt(signum, frame):
+        if not state["active"]:
+            return
+        
+        remaining = seconds - (time.thread_time() - start)
+        
+        if remaining > 0.001:
+            signal.setitimer(signal.ITIMER_PROF, remaining)
+            return
+        raise HandlerTimeout()
+    
+    previous_handler = signal.signal(signal.SIGPROF, interrupt)
+    signal.setitimer(signal.ITIMER_PROF, seconds)
+    
+    try:
+        yield True
+    finally:
+        state["active"] = False
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous_handler)
+
+
+@dataclass
+class HandlerBudget:
+    """
+    Limits the input size (`max_length` characters) and the CPU time (`max_time` seconds) of a handler. If a value
+    exceeds the budget, `policy` is applied:
+        passthrough: The value is kept unchanged
+        truncate: The value is truncated to `max_length` characters and handled again
+        defer: The value is kept unchanged and handled in the background, once the transaction has been committed
+    
+    Overruns are logged with the model and the field on the logger "django_common_utils.handlers". The CPU time is the
+    one of the current thread. In `asave` the time is measured as wall time.
+    
+    `max_time` doesn't bound the latency: handlers can only be interrupted in the main thread (see `cpu_time_limit`).
+    In other threads (threaded WSGI, ASGI, `asave`, the background thread queue) they run to their end and the policy
+    is only applied afterwards, so for the defer policy the work is done twice. Only `max_length` is checked up front.
+    """
+    
+    max_length: Optional[int] = None
+    max_time: Optional[float] = None
+    policy: str = BudgetPolicy.PASSTHROUGH
+    
+    def __post_init__(self):
+        if self.policy not in POLICIES:
+            raise ValueError(f'Budget policy must be one of {", ".join(POLICIES)}, not "{self.policy}"')
+        if self.policy == BudgetPolicy.TRUNCATE and self.max_length is None:
+            raise ValueError("The truncate policy requires max_length")
+    
+    def _get_size_overrun(self, value) -> Optional[str]:
+        if self.max_length is not None and get_size(value) > self.max_length:
+            return f"{get_size(value)} characters, at most {self.max_length} allowed"
+        return None
+    
+    def _log(self, instance, field: str, handler: HandlerInstance, reason: str, action: str) -> None:
+        logger.warning(
+            "%s.%s: %s exceeded its budget (%s), %s.",
+            "?" if instance is None else get_model_name(instance), field, handler.__class__.__qualname__, reason,
+            action
+        )
+    
+    def _apply_policy(self, instance, field: str, handler: HandlerInstance, value, reason: str) -> Tuple[Any, bool]:
+        """Returns the new value and whether it has to be handled again. Raises `HandlerDeferred` for the defer
+        policy."""
+        if self.policy == BudgetPolicy.TRUNCATE and get_size(value) > self.max_length:
+            self._log(instance, field, handler, reason, f"the value is truncated to {self.max_length} characters")
+            return value[:self.max_length], True
+        
+        # Only saved model instances can be updated in the background
+        if self.policy == BudgetPolicy.DEFER and hasattr(instance, "_meta") and not isinstance(instance, type):
+            self._log(instance, field, handler, reason, "the value is handled after the commit")
+            raise HandlerDeferred()
+        
+        self._log(instance, field, handler, reason, "the value is passed through unchanged")
+        return value, False
+    
+    def _call(self, call: Callable[[Any], Any], value) -> Tuple[Any, Optional[str]]:
+        """Calls `call` within the CPU time. Returns the new value (or `value`, if the time was exceeded) and the
+        reason the budget was exceeded or None."""
+        start = time.thread_time()
+        
+        try:
+            with cpu_time_limit(self.max_time):
+                new_value = call(value)
+        except HandlerTimeout:
+            return value, f"took more than {self.max_time} seconds of CPU time"
+        
+        duration = time.thread_time() - start
+        
+        if self.max_time is not None and duration > self.max_time:
+            # The handler couldn't be interrupted (e.g. outside of the main thread), so the budget is applied now
+            return value, f"took {duration:.3f} seconds of CPU time"
+        
+        return new_value, None
+    
+    def handle(
+            self, instance, field: str, handler: HandlerInstance, value, call: Optional[Callable[[Any], Any]] = None
+    ):
+        """Calls `call` (by default `handler.handle`) with `value` within the budget. `instance` is the model
+        instance (or model) the value belongs to, it is used for logging and the defer policy."""
+        call = call or handler.handle
+        reason = self._get_size_overrun(value)
+        
+        if reason is None:
+            new_value, reason = self._call(call, value)
+            
+            if reason is None:
+                return new_value
+        
+        value, handle_again = self._apply_policy(instance, field, handler, value, reason)
+        
+        if handle_again:
+            new_value, reason = self._call(call, value)
+            
+            if reason is None:
+                return new_value
+        
+        return value
+    
+    async def ahandle(self, instance, field: str, handler: HandlerInstance, value, call=None):
+        """Like `handle`, but awaits `call` (by default `handler.ahandle`). The time is limited using
+        `asyncio.wait_for`, so the handler may still run in its executor after the timeout."""
+        call = call or handler.ahandle
+        reason = self._get_size_overrun(value)
+        
+        if reason is None:
+            try:
+                return await asyncio.wait_for(call(value), self.max_time)
+            except asyncio.TimeoutError:
+                reason = f"took more than {self.max_time} seconds"
+        
+        value, handle_again = self._apply_policy(instance, field, handler, value, reason)
+        
+        if handle_again:
+            try:
+                return await asyncio.wait_for(call(value), self.max_time)
+            except asyncio.TimeoutError:
+                pass
+        
+        return value
@@ -1,7 +1,9 @@
+from typing import *
+
 from ..utils import EnsureIterationDictType
 
 __all__ = [
-    "HandleOn", "TextOptimizerDefault", "HTMLOptimizerDefault",
+    "HandleOn", "BudgetPolicy", "TextOptimizerDefault", "HTMLOptimizerDefault",
     "AddAttributesDict", "UnwrapDict"
 ]
 
@@ -18,12 +20,21 @@ class HandleOn:
     DELETION = "DELETION"
 
 
+class BudgetPolicy:
+    """What happens to a value, if a handler exceeds its `HandlerBudget`"""
+    PASSTHROUGH = "passthrough"
+    TRUNCATE = "truncate"
+    DEFER = "defer"
+
+
 class TextOptimizerDefault:
     space_after: str = r".,!?:;)+*&§%|\/\\"
     space_before: str = r"\(+*&%#$|\/\\"
     no_space_before: str = "?!.,`':;-"
     no_space_after: str = "-#"
     ignore_for_digits: str = ".,"
+    # How many values are optimized at once by `optimize_many`
+    chunk_size: int = 1000
 
 
 class HTMLOptimizerDefault:
@@ -38,3 +49,13 @@ class HTMLOptimizerDefault:
             "rel": "noopener noreferrer"
         }
     }
+    # Text inside of these tags won't be changed
+    ignore_text_tags: Set[str] = {"pre", "code", "script", "style"}
+    # Options passed to `htmlmin.minify`. Whitespace in these `pre_tags` is kept (`script` and `style` are always kept)
+    minify_opts: Dict[str, Any] = {
+        "remove_comments": True,
+        "reduce_boolean_attributes": True,
+        "pre_tags": ("pre", "textarea", "code"),
+    }
+    # How many documents are optimized at once by `optimize_many`
+    chunk_size: int = 100
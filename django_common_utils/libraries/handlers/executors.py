@@ -0,0 +1,93 @@
+import os
+import pickle
+import threading
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import *
+
+from ..utils.settings import get_setting
+
+__all__ = [
+    "get_async_executor", "get_background_executor", "shutdown_async_executors"
+]
+
+_executors: Dict[str, Executor] = {}
+_lock = threading.Lock()
+# id(handler) -> (weak reference to the handler, whether it can be pickled)
+_is_picklable_handler: Dict[int, Tuple[weakref.ref, bool]] = {}
+
+
+def is_picklable(value) -> bool:
+    try:
+        pickle.dumps(value)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def is_picklable_handler(handler) -> bool:
+    """Cached version of `is_picklable` for handlers. Handlers are created once per model, so the pickling is only
+    tried on the first call instead of on each `ahandle`. Handlers are dataclasses, so they are keyed by identity."""
+    key = id(handler)
+    entry = _is_picklable_handler.get(key)
+    
+    if entry is not None and entry[0]() is handler:
+        return entry[1]
+    
+    result = is_picklable(handler)
+    
+    try:
+        reference = weakref.ref(handler, lambda _: _is_picklable_handler.pop(key, None))
+    except TypeError:
+        return result
+    
+    _is_picklable_handler[key] = (reference, result)
+    return result
+
+
+def get_async_executor(handler=None) -> Executor:
+    """
+    Returns the executor `ahandle` offloads the handlers to. The kind is configured using
+    `COMMON_HANDLER_ASYNC_EXECUTOR` ("thread" or "process") and the size using `COMMON_HANDLER_ASYNC_WORKERS`. Both
+    are bounded, so that many concurrent saves can't start an unbounded number of workers. Handlers that can't be
+    pickled always run in the thread pool.
+    """
+    kind = get_setting("COMMON_HANDLER_ASYNC_EXECUTOR", "thread")
+    
+    if kind not in ("thread", "process"):
+        raise ValueError(f'COMMON_HANDLER_ASYNC_EXECUTOR must be "thread" or "process", not "{kind}"')
+    if kind == "process" and handler is not None and not is_picklable_handler(handler):
+        kind = "thread"
+    
+    with _lock:
+        try:
+            return _executors[kind]
+        except KeyError:
+            max_workers = get_setting("COMMON_HANDLER_ASYNC_WORKERS", min(4, os.cpu_count() or 1))
+            executor_class = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+            executor = _executors[kind] = executor_class(max_workers=max_workers)
+            return executor
+
+
+def get_background_executor() -> Executor:
+    """Returns the thread pool deferred handlers run in. Its size is configured using
+    `COMMON_HANDLER_BACKGROUND_WORKERS`."""
+    with _lock:
+        try:
+            return _executors["background"]
+        except KeyError:
+            executor = _executors["background"] = ThreadPoolExecutor(
+                max_workers=get_setting("COMMON_HANDLER_BACKGROUND_WORKERS", 1),
+                thread_name_prefix="common_handlers",
+            )
+            return executor
+
+
+def shutdown_async_executors(wait: bool = True) -> None:
+    """Shuts the executors down. They are created again, when they are needed the next time."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    
+    for executor in executors:
+        executor.shutdown(wait=wait)
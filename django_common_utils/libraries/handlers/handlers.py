@@ -1,13 +1,121 @@
+import asyncio
+from concurrent.futures import Executor
 from dataclasses import dataclass
+from functools import partial
 from typing import *
 
+from .background import handle_after_commit, split_deferred_handlers
+from .budgets import HandlerDeferred
+from .executors import get_async_executor, is_picklable
+from .instrumentation import get_instrumentation
 from .typings import *
+from ..utils.settings import get_setting
 
 __all__ = [
-    "ApplyHandler"
+    "ApplyHandler", "handle_columns", "get_companion_fields"
 ]
 
 
+def get_companion_fields(handlers: Mapping[str, Iterable[HandlerInstance]]) -> List[str]:
+    """Returns the fields the handlers write besides their own field (e.g. a field for the minified html), without
+    duplicates."""
+    companion_fields = []
+    
+    for field, handler_list in handlers.items():
+        for handler in handler_list:
+            for companion_field in handler.get_companion_fields(field):
+                if companion_field != field and companion_field not in companion_fields:
+                    companion_fields.append(companion_field)
+    
+    return companion_fields
+
+
+def is_model_instance(instance) -> bool:
+    return hasattr(instance, "_meta") and not isinstance(instance, type)
+
+
+def defer_handlers(instances: Sequence[Any], field: str, handler_list: Iterable[HandlerInstance]) -> tuple:
+    """Passes the deferred handlers of `field` (see `split_deferred_handlers`) to `handle_after_commit` for each of
+    `instances` and returns the handlers to run now. Only model instances can be updated after the commit, for other
+    objects all handlers run now."""
+    handler_list = tuple(handler_list)
+    immediate, deferred = split_deferred_handlers(handler_list)
+    
+    if not deferred or not instances or not all(is_model_instance(instance) for instance in instances):
+        return handler_list
+    
+    for instance in instances:
+        handle_after_commit(instance, field, deferred)
+    
+    return immediate
+
+
+def handle_columns(
+        handlers: Dict[str, Tuple[HandlerInstance, ...]],
+        columns: Dict[str, list],
+        instances: Optional[list] = None,
+) -> Dict[str, list]:
+    """Runs the handlers of each field on all values of the field at once. This is a module level function, so that it
+    can be run in another process. `instances` are the instances the values belong to, they are needed for deferred
+    handlers, handlers with a budget and the instrumentation, which are only applied, if they are passed."""
+    handled = {}
+    # None, if instrumentation is disabled. Records of other processes wouldn't reach the sinks of this one
+    instrumentation = get_instrumentation() if instances is not None else None
+    
+    for field, handler_list in handlers.items():
+        handler_list = defer_handlers(instances or (), field, handler_list)
+        values = list(columns[field])
+        # Indexes of the values, whose remaining handlers have been deferred by their budget
+        deferred = set()
+        
+        for position, handler in enumerate(handler_list):
+            indexes = [index for index in range(len(values)) if index not in deferred]
+            
+            if handler.budget is None and instrumentation is None:
+                new_values = handler.handle_many([values[index] for index in indexes])
+            elif handler.budget is None:
+                new_values = instrumentation.handle_many(
+                    [instances[index] for index in indexes], field, handler, [values[index] for index in indexes]
+                )
+            else:
+                # Each value gets its own budget
+                new_values = []
+                
+                for index in list(indexes):
+                    try:
+                        new_values.append(handler.budget.handle(
+                            None if instances is None else instances[index], field, handler, values[index],
+                            None if instrumentation is None else
+                                partial(instrumentation.handle, instances[index], field, handler)
+                        ))
+                    except HandlerDeferred:
+                        # The following handlers depend on the result, so they are deferred, too
+                        handle_after_commit(instances[index], field, handler_list[position:])
+                        deferred.add(index)
+                        indexes.remove(index)
+            
+            for index, value in zip(indexes, new_values):
+                values[index] = value
+            
+            if handler.get_companion_fields(field):
+                for index in indexes:
+                    for companion_field, value in handler.get_companion_values(field, values[index]).items():
+                        if companion_field == field:
+                            values[index] = value
+                            continue
+                        if companion_field not in handled:
+                            # Deferred rows keep their value
+                            handled[companion_field] = [
+                                None if instances is None else getattr(instance, companion_field)
+                                for instance in instances or values
+                            ]
+                        handled[companion_field][index] = value
+        
+        handled[field] = values
+    
+    return handled
+
+
 @dataclass
 class ApplyHandler:
     instance: Any
@@ -15,14 +123,138 @@ class ApplyHandler:
     
     def handle(self) -> AppliedHandlersType:
         fields: ApplyHandlerDefinitionType = {}
+        # None, if instrumentation is disabled
+        instrumentation = get_instrumentation()
         
         for field, handler_list in self.handlers.items():
-            for handler in handler_list:
+            handler_list = defer_handlers([self.instance], field, handler_list)
+            
+            for position, handler in enumerate(handler_list):
                 # Get current value, either from the instance or from previously handled handlers
                 current_value = fields.get(field, getattr(self.instance, field))
                 # Get new value
-                new_value = handler.handle(current_value)
+                if handler.budget is not None:
+                    try:
+                        new_value = handler.budget.handle(
+                            self.instance, field, handler, current_value,
+                            None if instrumentation is None else
+                                partial(instrumentation.handle, self.instance, field, handler)
+                        )
+                    except HandlerDeferred:
+                        # The following handlers depend on the result, so they are deferred, too
+                        handle_after_commit(self.instance, field, handler_list[position:])
+                        break
+                elif instrumentation is None:
+                    new_value = handler.handle(current_value)
+                else:
+                    new_value = instrumentation.handle(self.instance, field, handler, current_value)
                 # Safe new value
                 fields[field] = new_value
+                # Values of other fields the handler writes (e.g. minified html)
+                if handler.get_companion_fields(field):
+                    fields.update(handler.get_companion_values(field, new_value))
         
         return fields
+    
+    async def _ahandle_field(self, field: str, handler_list: Iterable[HandlerInstance]) -> AppliedHandlersType:
+        fields = {field: getattr(self.instance, field)}
+        instrumentation = get_instrumentation()
+        handler_list = defer_handlers([self.instance], field, handler_list)
+        
+        for position, handler in enumerate(handler_list):
+            if handler.budget is not None:
+                try:
+                    fields[field] = await handler.budget.ahandle(
+                        self.instance, field, handler, fields[field],
+                        None if instrumentation is None else
+                            partial(instrumentation.ahandle, self.instance, field, handler)
+                    )
+                except HandlerDeferred:
+                    # The following handlers depend on the result, so they are deferred, too
+                    handle_after_commit(self.instance, field, handler_list[position:])
+                    break
+            elif instrumentation is None:
+                fields[field] = await handler.ahandle(fields[field])
+            else:
+                fields[field] = await instrumentation.ahandle(self.instance, field, handler, fields[field])
+            
+            if handler.get_companion_fields(field):
+                fields.update(await asyncio.get_running_loop().run_in_executor(
+                    get_async_executor(handler), handler.get_companion_values, field, fields[field]
+                ))
+        
+        return fields
+    
+    async def ahandle(self) -> AppliedHandlersType:
+        """Like `handle`, but uses `ahandle` of the handlers. The fields are handled concurrently, the handlers of a
+        field one after another."""
+        fields: AppliedHandlersType = {}
+        
+        for field_values in await asyncio.gather(*(
+                self._ahandle_field(field, handler_list)
+                for field, handler_list in self.handlers.items()
+        )):
+            fields.update(field_values)
+        
+        return fields
+    
+    @staticmethod
+    def map(
+            instances: Iterable[Any],
+            handlers: HandlerDefinitionType,
+            executor: Optional[Executor] = None,
+            chunk_size: Optional[int] = None,
+    ) -> List[AppliedHandlersType]:
+        """
+        Like `handle` for many instances, the results are returned in the same order. If `executor` is passed (e.g.
+        a `ProcessPoolExecutor`), the instances are split into chunks of `chunk_size` and the handlers run in the
+        executor. Handlers that can't be pickled are run in this process.
+        """
+        instances = list(instances)
+        chunk_size = chunk_size or get_setting("COMMON_HANDLER_CHUNK_SIZE", 500)
+        # Deferred handlers are passed to `handle_after_commit` here, as other processes can't do it
+        handlers = {
+            field: defer_handlers(instances, field, handler_list)
+            for field, handler_list in handlers.items()
+        }
+        
+        if executor is None:
+            local_handlers, remote_handlers = handlers, {}
+        else:
+            local_handlers, remote_handlers = {}, {}
+            
+            for field, handler_list in handlers.items():
+                if is_picklable(handler_list):
+                    remote_handlers[field] = handler_list
+                else:
+                    local_handlers[field] = handler_list
+        
+        results: List[AppliedHandlersType] = [{} for _ in instances]
+        
+        def get_columns(fields: Iterable[str], start: int) -> Dict[str, list]:
+            return {
+                field: [getattr(instance, field) for instance in instances[start:start + chunk_size]]
+                for field in fields
+            }
+        
+        def collect(start: int, columns: Dict[str, list]) -> None:
+            for field, values in columns.items():
+                for result, value in zip(results[start:start + chunk_size], values):
+                    result[field] = value
+        
+        futures = [
+            (start, executor.submit(handle_columns, remote_handlers, get_columns(remote_handlers, start)))
+            for start in range(0, len(instances), chunk_size)
+        ] if remote_handlers else []
+        
+        # The local handlers run while the executor is busy
+        if local_handlers:
+            for start in range(0, len(instances), chunk_size):
+                collect(start, handle_columns(
+                    local_handlers, get_columns(local_handlers, start), instances[start:start + chunk_size]
+                ))
+        
+        for start, future in futures:
+            collect(start, future.result())
+        
+        return results
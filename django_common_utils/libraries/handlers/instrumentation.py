@@ -0,0 +1,235 @@
+import logging
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import *
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from ..utils.settings import get_setting
+
+__all__ = [
+    "HandlerStats", "BaseSink", "MemorySink", "LoggingSink", "StatsdSink", "Instrumentation", "get_instrumentation",
+    "get_handler_stats", "reset_handler_stats"
+]
+
+logger = logging.getLogger("django_common_utils.handlers")
+
+
+def get_size(value) -> int:
+    return len(value) if isinstance(value, (str, bytes)) else 0
+
+
+def get_model_name(instance) -> str:
+    meta = getattr(instance, "_meta", None)
+    
+    return meta.label if meta is not None else instance.__class__.__qualname__
+
+
+@dataclass
+class HandlerStats:
+    calls: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    input_size: int = 0
+    output_size: int = 0
+    
+    @property
+    def average_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+class BaseSink(ABC):
+    """Receives a record for each handler call, if instrumentation is enabled. `duration` is in seconds, the sizes
+    are the lengths of the values (0 for values that aren't strings)."""
+    
+    @abstractmethod
+    def record(self, model: str, field: str, handler: str, duration: float, input_size: int, output_size: int) -> None:
+        raise NotImplementedError("Method is not implemented")
+
+
+class MemorySink(BaseSink):
+    """Aggregates the records per model, field and handler class in this process."""
+    
+    def __init__(self):
+        self.stats: Dict[Tuple[str, str, str], HandlerStats] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, model: str, field: str, handler: str, duration: float, input_size: int, output_size: int) -> None:
+        with self._lock:
+            stats = self.stats.get((model, field, handler))
+            
+            if stats is None:
+                stats = self.stats[model, field, handler] = HandlerStats()
+            
+            stats.calls += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.input_size += input_size
+            stats.output_size += output_size
+    
+    def reset(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+
+class LoggingSink(BaseSink):
+    """Logs each record on the logger "django_common_utils.handlers"."""
+    
+    def __init__(self, level: int = logging.DEBUG):
+        self.level = level
+    
+    def record(self, model: str, field: str, handler: str, duration: float, input_size: int, output_size: int) -> None:
+        logger.log(
+            self.level, "%s.%s: %s took %.3f ms (%d -> %d characters)",
+            model, field, handler, duration * 1000, input_size, output_size
+        )
+
+
+class StatsdSink(BaseSink):
+    """Sends the records to a statsd compatible server using UDP. Errors are ignored, so that a missing server
+    doesn't break saving."""
+    
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, prefix: Optional[str] = None):
+        self.address = (
+            host or get_setting("COMMON_HANDLER_STATSD_HOST", "localhost"),
+            port or get_setting("COMMON_HANDLER_STATSD_PORT", 8125),
+        )
+        self.prefix = prefix or get_setting("COMMON_HANDLER_STATSD_PREFIX", "django_common_utils.handlers")
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+    
+    def get_packet(
+            self, model: str, field: str, handler: str, duration: float, input_size: int, output_size: int
+    ) -> bytes:
+        name = f"{self.prefix}.{model}.{field}.{handler}"
+        
+        return "\n".join([
+            f"{name}.calls:1|c",
+            f"{name}.time:{duration * 1000:.3f}|ms",
+            f"{name}.input_size:{input_size}|c",
+            f"{name}.output_size:{output_size}|c",
+        ]).encode("utf-8")
+    
+    def record(self, model: str, field: str, handler: str, duration: float, input_size: int, output_size: int) -> None:
+        try:
+            self.socket.sendto(self.get_packet(model, field, handler, duration, input_size, output_size), self.address)
+        except OSError:
+            pass
+
+
+SINKS: Dict[str, Type[BaseSink]] = {
+    "memory": MemorySink,
+    "logging": LoggingSink,
+    "statsd": StatsdSink,
+}
+
+
+@dataclass
+class Instrumentation:
+    sinks: Tuple[BaseSink, ...] = ()
+    # Seconds, handler calls that take longer log a warning
+    slow_threshold: Optional[float] = None
+    
+    @classmethod
+    def from_settings(cls) -> Optional["Instrumentation"]:
+        """Creates the instrumentation from `COMMON_HANDLER_INSTRUMENTATION` (names of sinks or sink instances) and
+        `COMMON_HANDLER_SLOW_THRESHOLD`. Returns None, if neither is set."""
+        sinks = tuple(
+            SINKS[sink]() if isinstance(sink, str) else sink
+            for sink in get_setting("COMMON_HANDLER_INSTRUMENTATION", ())
+        )
+        slow_threshold = get_setting("COMMON_HANDLER_SLOW_THRESHOLD", None)
+        
+        if not sinks and slow_threshold is None:
+            return None
+        
+        return cls(sinks=sinks, slow_threshold=slow_threshold)
+    
+    def record(self, instance, field: str, handler, duration: float, value, new_value) -> None:
+        model = get_model_name(instance)
+        handler_name = handler.__class__.__qualname__
+        input_size = get_size(value)
+        output_size = get_size(new_value)
+        
+        for sink in self.sinks:
+            sink.record(model, field, handler_name, duration, input_size, output_size)
+        
+        if self.slow_threshold is not None and duration > self.slow_threshold:
+            logger.warning(
+                "Handler %s on %s.%s took %.3f seconds (%d characters).",
+                handler_name, model, field, duration, input_size
+            )
+    
+    def handle(self, instance, field: str, handler, value):
+        """Calls `handler.handle(value)` and records it."""
+        start = time.perf_counter()
+        new_value = handler.handle(value)
+        self.record(instance, field, handler, time.perf_counter() - start, value, new_value)
+        
+        return new_value
+    
+    def handle_many(self, instances: list, field: str, handler, values: list) -> list:
+        """Calls `handler.handle_many(values)` and records a call for each value, with an equal share of the time."""
+        start = time.perf_counter()
+        new_values = handler.handle_many(values)
+        duration = (time.perf_counter() - start) / len(values) if values else 0.0
+        
+        for instance, value, new_value in zip(instances, values, new_values):
+            self.record(instance, field, handler, duration, value, new_value)
+        
+        return new_values
+    
+    async def ahandle(self, instance, field: str, handler, value):
+        start = time.perf_counter()
+        new_value = await handler.ahandle(value)
+        self.record(instance, field, handler, time.perf_counter() - start, value, new_value)
+        
+        return new_value
+
+
+_instrumentation: Optional[Instrumentation] = None
+_is_configured = False
+
+
+def get_instrumentation() -> Optional[Instrumentation]:
+    """Returns the configured instrumentation or None, if it is disabled. It is created once and reset when the
+    settings change."""
+    global _instrumentation, _is_configured
+    
+    if not _is_configured:
+        _instrumentation = Instrumentation.from_settings()
+        _is_configured = True
+    
+    return _instrumentation
+
+
+@receiver(setting_changed)
+def reset_instrumentation_on_setting_change(*args, **kwargs) -> None:
+    global _instrumentation, _is_configured
+    
+    _instrumentation = None
+    _is_configured = False
+
+
+def get_handler_stats() -> Dict[Tuple[str, str, str], HandlerStats]:
+    """Returns the stats of the `MemorySink`s, keyed by (model, field, handler class)."""
+    instrumentation = get_instrumentation()
+    stats = {}
+    
+    for sink in instrumentation.sinks if instrumentation is not None else ():
+        if isinstance(sink, MemorySink):
+            stats.update(sink.stats)
+    
+    return stats
+
+
+def reset_handler_stats() -> None:
+    instrumentation = get_instrumentation()
+    
+    for sink in instrumentation.sinks if instrumentation is not None else ():
+        if isinstance(sink, MemorySink):
+            sink.reset()
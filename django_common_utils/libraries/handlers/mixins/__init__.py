@@ -1,3 +1,4 @@
 from .base import *
+from .cache import *
 from .html import *
 from .text import *
@@ -1,17 +1,45 @@
+import asyncio
 from abc import ABC, abstractmethod
+from collections import Counter
 from typing import *
 
 from ..constants import HandleOn
 
 __all__ = [
-    "BaseHandlerMixin"
+    "BaseHandlerMixin", "get_fast_path_stats", "reset_fast_path_stats"
 ]
 
+# (handler class name, "hits" / "misses") -> count, for all handlers of this process
+_fast_path_stats = Counter()
+
+
+def get_fast_path_stats() -> Dict[str, Dict[str, float]]:
+    """Returns how often the fast path of the handlers has been used, grouped by handler class"""
+    stats = {}
+    
+    for (name, kind), count in _fast_path_stats.items():
+        stats.setdefault(name, {"hits": 0, "misses": 0})[kind] = count
+    
+    for handler_stats in stats.values():
+        total = handler_stats["hits"] + handler_stats["misses"]
+        handler_stats["hit_rate"] = handler_stats["hits"] / total if total else 0.0
+    
+    return stats
+
+
+def reset_fast_path_stats() -> None:
+    _fast_path_stats.clear()
+
 
 class BaseHandlerMixin(ABC):
     """The BaseHandlerMixin for all handlers. All methods should be static, except your handler needs special
     passed parameters. """
     
+    # Set by `with_budget`
+    budget: ClassVar[Optional[Any]] = None
+    # Set by `deferred`
+    defer: ClassVar[bool] = False
+    
     @staticmethod
     @abstractmethod
     def HANDLE_ON() -> Union[Iterable[str], str]:
@@ -21,3 +49,76 @@ class BaseHandlerMixin(ABC):
     @abstractmethod
     def handle(value):
         raise NotImplementedError("Method is not implemented")
+    
+    def use_fast_path(self, value) -> bool:
+        """Cheap precheck, whether `value` can be handled without the full work, e.g. because it is already in the
+        form `handle` returns. Handlers, which have a fast path, check it in `handle`. Returns False by default."""
+        return False
+    
+    def _count_fast_path(self, hits: int, misses: int = 0) -> None:
+        name = self.__class__.__qualname__
+        _fast_path_stats[name, "hits"] += hits
+        _fast_path_stats[name, "misses"] += misses
+    
+    def _check_fast_path(self, value) -> bool:
+        use_fast_path = self.use_fast_path(value)
+        self._count_fast_path(int(use_fast_path), int(not use_fast_path))
+        
+        return use_fast_path
+    
+    async def ahandle(self, value):
+        """Async version of `handle`. By default `handle` runs in a bounded executor (see `get_async_executor`), so
+        that the event loop isn't blocked. Override it, if your handler doesn't need to run in an executor."""
+        from ..executors import get_async_executor
+        
+        loop = asyncio.get_running_loop()
+        
+        return await loop.run_in_executor(get_async_executor(self), self.handle, value)
+    
+    def handle_many(self, values: Iterable) -> list:
+        """Handles multiple values and returns the new values in the same order. Override it, if your handler can
+        handle multiple values faster than one by one."""
+        
+        return [self.handle(value) for value in values]
+    
+    def handle_deleted(self, values: list) -> list:
+        """Called once with the values of a field of all instances deleted in a transaction, after it has been
+        committed. Returns the values for the next deletion handler. By default `handle_many` is called."""
+        return self.handle_many(values)
+    
+    def as_expression(self, expression, connection):
+        """Returns an ORM expression, that computes the result of `handle` for the value of `expression` in the
+        database of `connection`, or None, if the handler can only run in Python (default). Used to handle many rows
+        using a single `update()`, see `push_down_handlers`."""
+        return None
+    
+    def get_companion_fields(self, field: str) -> Tuple[str, ...]:
+        """Returns the names of the fields, that `get_companion_values` returns values for, when handling `field`."""
+        return ()
+    
+    def get_companion_values(self, field: str, value) -> Dict[str, Any]:
+        """Returns values of other fields (or of `field` itself), that are derived from the handled `value` of `field`,
+        e.g. a minified copy. Called after `handle`, if `get_companion_fields` isn't empty."""
+        return {}
+    
+    def cached(self, **kwargs) -> "BaseHandlerMixin":
+        """Wraps this handler in a `CachedHandler`, which caches its outputs. See `CachedHandler` for the options."""
+        from .cache import CachedHandler
+        
+        return CachedHandler(self, **kwargs)
+    
+    def with_budget(self, **kwargs) -> "BaseHandlerMixin":
+        """Limits the input size and CPU time of this handler and returns it. See `HandlerBudget` for the options and
+        why the CPU time doesn't bound the latency outside of the main thread."""
+        from ..budgets import HandlerBudget
+        
+        self.budget = HandlerBudget(**kwargs)
+        
+        return self
+    
+    def deferred(self, defer: bool = True) -> "BaseHandlerMixin":
+        """Runs this handler and the following handlers of the field after the commit instead of in `save`, so that
+        they don't add to the latency of the request. Returns the handler. See `handle_after_commit`."""
+        self.defer = defer
+        
+        return self
@@ -0,0 +1,169 @@
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import *
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .base import BaseHandlerMixin
+from ...utils.settings import get_setting
+
+__all__ = [
+    "CachedHandler", "get_cache_stats", "reset_cache_stats"
+]
+
+# (handler class name, "hits" / "misses") -> count, for all `CachedHandler`s of this process
+_stats = Counter()
+
+
+def get_digest(value: str) -> str:
+    return hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def get_canonical_representation(value) -> str:
+    """Returns a representation, that is the same for equal values (e.g. dicts and sets are sorted)."""
+    if isinstance(value, dict):
+        items = sorted(
+            (get_canonical_representation(key), get_canonical_representation(item))
+            for key, item in value.items()
+        )
+        return "{" + ",".join(f"{key}:{item}" for key, item in items) + "}"
+    if isinstance(value, (set, frozenset)):
+        return "{" + ",".join(sorted(get_canonical_representation(item) for item in value)) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(get_canonical_representation(item) for item in value) + "]"
+    if isinstance(value, BaseHandlerMixin):
+        return get_handler_representation(value)
+    return repr(value)
+
+
+def get_handler_representation(handler: BaseHandlerMixin) -> str:
+    # `vars` contains the dataclass fields and attributes set in `__init__`. Private attributes (e.g. compiled
+    # patterns) are derived from them
+    configuration = {
+        key: value
+        for key, value in vars(handler).items()
+        if not key.startswith("_")
+    }
+    
+    return f"{handler.__class__.__module__}.{handler.__class__.__qualname__}" \
+           f"({get_canonical_representation(configuration)})"
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Returns the hits and misses of all cached handlers of this process, grouped by handler class"""
+    stats = {}
+    
+    for (name, kind), count in _stats.items():
+        stats.setdefault(name, {"hits": 0, "misses": 0})[kind] = count
+    
+    return stats
+
+
+def reset_cache_stats() -> None:
+    _stats.clear()
+
+
+@dataclass
+class CachedHandler(BaseHandlerMixin):
+    """
+    Caches the output of `handler` in the Django cache `cache_alias`. The key consists of the handler class, its
+    configuration and a digest of the value, so the same input is only handled once, even across processes.
+    
+    The size and eviction are configured using the cache (e.g. `MAX_ENTRIES` and `CULL_FREQUENCY` for locmem and
+    file based caches). Values longer than `max_length` are not cached.
+    """
+    
+    handler: BaseHandlerMixin = None
+    cache_alias: str = field(default_factory=lambda: get_setting("COMMON_HANDLER_CACHE_ALIAS", "default"))
+    timeout: Optional[int] = field(
+        default_factory=lambda: get_setting("COMMON_HANDLER_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+    )
+    max_length: int = field(default_factory=lambda: get_setting("COMMON_HANDLER_CACHE_MAX_LENGTH", 100_000))
+    hits: int = field(default=0, init=False, compare=False)
+    misses: int = field(default=0, init=False, compare=False)
+    
+    def __post_init__(self):
+        self.key_prefix = f"common_handler:{get_digest(get_handler_representation(self.handler))}:"
+        self._stats_name = self.handler.__class__.__qualname__
+    
+    def HANDLE_ON(self):
+        return self.handler.HANDLE_ON()
+    
+    def get_companion_fields(self, field: str) -> Tuple[str, ...]:
+        return self.handler.get_companion_fields(field)
+    
+    def get_companion_values(self, field: str, value) -> Dict[str, Any]:
+        return self.handler.get_companion_values(field, value)
+    
+    def handle_deleted(self, values: list) -> list:
+        # Deleted values aren't handled again, so they aren't cached
+        return self.handler.handle_deleted(values)
+    
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+    
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def _count(self, hits: int, misses: int) -> None:
+        self.hits += hits
+        self.misses += misses
+        _stats[self._stats_name, "hits"] += hits
+        _stats[self._stats_name, "misses"] += misses
+    
+    def _get_key(self, value: str) -> str:
+        return self.key_prefix + get_digest(value)
+    
+    def _is_cacheable(self, value) -> bool:
+        return isinstance(value, str) and len(value) <= self.max_length
+    
+    def handle(self, value):
+        if not self._is_cacheable(value):
+            return self.handler.handle(value)
+        
+        key = self._get_key(value)
+        result = self.cache.get(key)
+        
+        if result is not None:
+            self._count(1, 0)
+            return result
+        
+        self._count(0, 1)
+        result = self.handler.handle(value)
+        self.cache.set(key, result, self.timeout)
+        
+        return result
+    
+    def handle_many(self, values: Iterable) -> list:
+        values = list(values)
+        keys = {
+            index: self._get_key(value)
+            for index, value in enumerate(values)
+            if self._is_cacheable(value)
+        }
+        cached = self.cache.get_many(set(keys.values()))
+        
+        missing = [
+            index
+            for index in range(len(values))
+            if keys.get(index) not in cached
+        ]
+        results = [cached.get(keys.get(index)) for index in range(len(values))]
+        
+        # The wrapped handler may handle the missing values in a batch
+        for index, result in zip(missing, self.handler.handle_many(values[index] for index in missing)):
+            results[index] = result
+        
+        self.cache.set_many({
+            keys[index]: results[index]
+            for index in missing
+            if index in keys
+        }, self.timeout)
+        self._count(len(values) - len(missing), sum(1 for index in missing if index in keys))
+        
+        return results
@@ -1,14 +1,88 @@
+from collections import Counter
 from dataclasses import dataclass
 from typing import *
 
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
 from .base import BaseHandlerMixin
+from .cache import get_canonical_representation, get_digest, get_handler_representation
 from ..constants import AddAttributesDict, HandleOn, HTMLOptimizerDefault, TextOptimizerDefault, UnwrapDict
+from ..optimizers.backends import get_backend, LXMLBackend
+from ..optimizers.blocks import split_blocks
 from ..optimizers.html import TextHTMLOptimizer
+from ..optimizers.text import CompiledTextOptimizer, TextOptimizer
+from ...typings import Kwargs
+from ...utils.settings import get_setting
 
 __all__ = [
-    "HTMLOptimizerHandler"
+    "HTMLOptimizerHandler", "get_minified_html", "get_field_minified_html", "get_minify_stats", "reset_minify_stats"
 ]
 
+# (field name, "calls" / "bytes_before" / "bytes_after") -> count, for all minified values of this process
+_minify_stats = Counter()
+
+
+def get_minified_key(html: str, opts: Optional[Kwargs] = None) -> str:
+    opts = HTMLOptimizerDefault.minify_opts if opts is None else opts
+    return f"common_minified_html:{get_digest(get_canonical_representation(opts))}:{get_digest(html)}"
+
+
+def get_minified_html(html: str, opts: Optional[Kwargs] = None, cache_alias: Optional[str] = None) -> str:
+    """Returns the minified `html` from the cache. If it isn't cached yet (e.g. by a `HTMLOptimizerHandler` with
+    `minified_cache`), it is minified and cached."""
+    cache = caches[cache_alias or get_setting("COMMON_HANDLER_CACHE_ALIAS", "default")]
+    key = get_minified_key(html, opts)
+    minified = cache.get(key)
+    
+    if minified is None:
+        minified = TextHTMLOptimizer.minify_html(html, opts)
+        cache.set(key, minified, get_setting("COMMON_HANDLER_CACHE_TIMEOUT", DEFAULT_TIMEOUT))
+    
+    return minified
+
+
+def get_minified_handler(model: type, field: str) -> Optional["HTMLOptimizerHandler"]:
+    """Returns the handler of `field`, that stores the minified html in a cache, or None."""
+    from ..constants import HandleOn
+    from ..plans import get_handler_plan
+    
+    for handler in reversed(get_handler_plan(model, HandleOn.SAVE).handlers.get(field, ())):
+        handler = getattr(handler, "handler", handler)  # `CachedHandler`
+        
+        if isinstance(handler, HTMLOptimizerHandler) and handler.minify and handler.minified_cache is not None:
+            return handler
+    
+    return None
+
+
+def get_field_minified_html(instance, field: str) -> str:
+    """Returns the minified html of `field` of `instance`. If the handler of the field stores the minified html in a
+    cache, its cache and `minify_opts` are used, so the html written on save is read."""
+    html = "" if getattr(instance, field) is None else str(getattr(instance, field))
+    handler = get_minified_handler(instance.__class__, field)
+    
+    if handler is None:
+        return get_minified_html(html)
+    return get_minified_html(html, handler.minify_opts, handler.minified_cache)
+
+
+def get_minify_stats() -> Dict[str, Dict[str, int]]:
+    """Returns how many bytes (utf-8) minifying has saved, grouped by the field the minified html is stored in"""
+    stats = {}
+    
+    for (field, kind), count in _minify_stats.items():
+        stats.setdefault(field, {"calls": 0, "bytes_before": 0, "bytes_after": 0})[kind] = count
+    
+    for field_stats in stats.values():
+        field_stats["bytes_saved"] = field_stats["bytes_before"] - field_stats["bytes_after"]
+    
+    return stats
+
+
+def reset_minify_stats() -> None:
+    _minify_stats.clear()
+
 
 @dataclass
 class HTMLOptimizerHandler(BaseHandlerMixin):
@@ -22,32 +96,176 @@ class HTMLOptimizerHandler(BaseHandlerMixin):
             self,
             unwrap: Optional[UnwrapDict] = None,
             add_attributes: Optional[AddAttributesDict] = None,
-            *args, **kwargs
+            backend: Optional[str] = None,
+            *args,
+            minify: bool = False,
+            minify_opts: Optional[Kwargs] = None,
+            minified_field: Optional[str] = None,
+            minified_cache: Optional[str] = None,
+            incremental: bool = False,
+            **kwargs
     ):
+        """
+        If `minify` is True, the optimized html is minified as last stage. The minified html is stored in the field
+        itself, in `minified_field` (the field keeps the unminified html) or only in the cache `minified_cache`, from
+        where it can be read using `get_minified_html`.
+        
+        If `incremental` is True, long html is optimized in blocks of top-level elements and the optimized blocks are
+        cached, so that only changed blocks are optimized again.
+        """
         super().__init__(*args, **kwargs)
+        # Name of the parser backend, if None the setting `COMMON_HTML_OPTIMIZER_BACKEND` is used
+        self.backend = backend
         self.unwrap = unwrap if unwrap is not None else HTMLOptimizerDefault.unwrap
         self.add_attributes = add_attributes if add_attributes is not None else HTMLOptimizerDefault.add_attributes
+        self.minify = minify
+        self.minify_opts = minify_opts
+        self.minified_field = minified_field
+        self.minified_cache = minified_cache
+        self.incremental = incremental
     
     @staticmethod
     def HANDLE_ON():
         return {HandleOn.CREATION, HandleOn.SAVE}
     
-    def handle(self, value: str):
-        return TextHTMLOptimizer.html_remove_redundant_space(
-            TextHTMLOptimizer.html_space_after_text(
-                TextHTMLOptimizer.html_space_before_text(
-                    TextHTMLOptimizer.html_add_attributes_to_tags(
-                        TextHTMLOptimizer.html_unwrap(
-                            "" if value is None else str(value),
-                            unwrap=self.unwrap
-                        ),
-                        add_attributes=self.add_attributes
-                    ),
-                    space_before=self.space_before
-                ),
+    def get_companion_fields(self, field: str) -> Tuple[str, ...]:
+        if not self.minify:
+            return ()
+        if self.minified_field is not None:
+            return self.minified_field,
+        # If the minified html is only cached, the field keeps its value, `get_companion_values` writes the cache
+        return field,
+    
+    def get_companion_values(self, field: str, value: str) -> Dict[str, Any]:
+        if not self.minify:
+            return {}
+        
+        minified = TextHTMLOptimizer.minify_html(value, self.minify_opts)
+        target_field = self.minified_field or field
+        
+        _minify_stats[target_field, "calls"] += 1
+        _minify_stats[target_field, "bytes_before"] += len(value.encode("utf-8"))
+        _minify_stats[target_field, "bytes_after"] += len(minified.encode("utf-8"))
+        
+        if self.minified_cache is not None:
+            caches[self.minified_cache].set(
+                get_minified_key(value, self.minify_opts),
+                minified,
+                get_setting("COMMON_HANDLER_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+            )
+        
+        if self.minified_field is None and self.minified_cache is not None:
+            return {field: value}
+        
+        return {
+            companion_field: minified
+            for companion_field in self.get_companion_fields(field)
+        }
+    
+    def get_text_optimizer(self) -> CompiledTextOptimizer:
+        # The same optimizer `TextHTMLOptimizer.optimize` runs on the text nodes
+        return TextOptimizer.compile(
+            space_before=self.space_before,
+            space_after=self.space_after,
+            ignore_for_digits=self.ignore_for_digits,
+            no_space_after=self.no_space_after,
+            no_space_before=self.no_space_before,
+            insert_spaces_first=True,
+        )
+    
+    def use_fast_path(self, value) -> bool:
+        """Values without markup don't need to be parsed, only their text is optimized. Whitespace only values are
+        excluded, as the parser collapses them."""
+        return type(value) is str and not ("<" in value or "&" in value or ">" in value) and \
+            (value == "" or not value.isspace())
+    
+    def get_blocks(self, value) -> Optional[List[str]]:
+        """Returns the blocks `value` is optimized in incrementally or None, if it is optimized as a whole."""
+        if not self.incremental or type(value) is not str or \
+                len(value) < get_setting("COMMON_HTML_INCREMENTAL_MIN_LENGTH", 65536):
+            return None
+        # libxml2 repairs the html depending on the surrounding elements
+        if isinstance(get_backend(self.backend), LXMLBackend):
+            return None
+        
+        blocks = split_blocks(value, get_setting("COMMON_HTML_INCREMENTAL_BLOCK_SIZE", 16384))
+        
+        return blocks if blocks is not None and len(blocks) > 1 else None
+    
+    def optimize_blocks(self, blocks: List[str]) -> str:
+        """Optimizes the blocks, that are not cached yet, and joins them. The result equals the one of a full pass."""
+        cache = caches[get_setting("COMMON_HANDLER_CACHE_ALIAS", "default")]
+        key_prefix = f"common_html_block:{get_digest(get_handler_representation(self))}:"
+        keys = [key_prefix + get_digest(block) for block in blocks]
+        optimized = cache.get_many(set(keys))
+        missing = {
+            key: block
+            for key, block in zip(keys, blocks)
+            if key not in optimized
+        }
+        
+        if missing:
+            new_blocks = dict(zip(missing, TextHTMLOptimizer.optimize_many(
+                missing.values(),
+                unwrap=self.unwrap,
+                add_attributes=self.add_attributes,
+                space_before=self.space_before,
                 space_after=self.space_after,
-                ignore_for_digits=self.ignore_for_digits
-            ),
+                ignore_for_digits=self.ignore_for_digits,
+                no_space_after=self.no_space_after,
+                no_space_before=self.no_space_before,
+                backend=self.backend,
+            )))
+            cache.set_many(new_blocks, get_setting("COMMON_HANDLER_CACHE_TIMEOUT", DEFAULT_TIMEOUT))
+            optimized.update(new_blocks)
+        
+        return "".join(optimized[key] for key in keys)
+    
+    def handle(self, value: str):
+        if self._check_fast_path(value):
+            return self.get_text_optimizer().optimize(value)
+        if (blocks := self.get_blocks(value)) is not None:
+            return self.optimize_blocks(blocks)
+        
+        return TextHTMLOptimizer.optimize(
+            "" if value is None else str(value),
+            unwrap=self.unwrap,
+            add_attributes=self.add_attributes,
+            space_before=self.space_before,
+            space_after=self.space_after,
+            ignore_for_digits=self.ignore_for_digits,
+            no_space_after=self.no_space_after,
+            no_space_before=self.no_space_before,
+            backend=self.backend,
+        )
+    
+    def handle_many(self, values: Iterable[str]) -> List[str]:
+        values = list(values)
+        results = list(values)
+        indexes = []
+        text_optimizer = self.get_text_optimizer()
+        
+        for index, value in enumerate(values):
+            if self._check_fast_path(value):
+                results[index] = text_optimizer.optimize(value)
+            elif (blocks := self.get_blocks(value)) is not None:
+                results[index] = self.optimize_blocks(blocks)
+            else:
+                indexes.append(index)
+        
+        optimized = TextHTMLOptimizer.optimize_many(
+            ("" if values[index] is None else str(values[index]) for index in indexes),
+            unwrap=self.unwrap,
+            add_attributes=self.add_attributes,
+            space_before=self.space_before,
+            space_after=self.space_after,
+            ignore_for_digits=self.ignore_for_digits,
             no_space_after=self.no_space_after,
             no_space_before=self.no_space_before,
+            backend=self.backend,
         )
+        
+        for index, value in zip(indexes, optimized):
+            results[index] = value
+        
+        return results
@@ -1,14 +1,18 @@
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import *
+
+from django.db.models import TextField, Value
+from django.db.models.functions import Coalesce, Trim
 
 from .base import BaseHandlerMixin
 from ..constants import HandleOn, TextOptimizerDefault
 
 __all__ = [
-    "RegexHandler", "WhiteSpaceStripHandler", "TextOptimizerHandler"
+    "RegexHandler", "RegexSetHandler", "WhiteSpaceStripHandler", "TextOptimizerHandler"
 ]
 
-from ..optimizers.text import TextOptimizer
+from ..optimizers.text import CompiledTextOptimizer, TextOptimizer
 
 
 @dataclass
@@ -20,8 +24,281 @@ class RegexHandler(BaseHandlerMixin):
     def HANDLE_ON():
         return {HandleOn.CREATION, HandleOn.SAVE}
     
+    def get_compiled_pattern(self) -> Pattern:
+        """Compiles the pattern once. It is compiled again, if `pattern` has been changed."""
+        compiled = self.__dict__.get("_compiled_pattern")
+        
+        if compiled is None or compiled.pattern != self.pattern:
+            compiled = self.__dict__["_compiled_pattern"] = re.compile(self.pattern)
+        
+        return compiled
+    
     def handle(self, value: str) -> str:
-        return re.sub(self.pattern, self.replacement, "" if value is None else str(value))
+        return self.get_compiled_pattern().sub(self.replacement, "" if value is None else str(value))
+    
+    def as_expression(self, expression, connection):
+        from ..pushdown import get_regexp_replace
+        
+        return get_regexp_replace(
+            Coalesce(expression, Value(""), output_field=TextField()), self.pattern, self.replacement, connection
+        )
+    
+    def handle_many(self, values: Iterable[str]) -> List[str]:
+        pattern = self.get_compiled_pattern()
+        
+        return [
+            pattern.sub(self.replacement, "" if value is None else str(value))
+            for value in values
+        ]
+
+
+# Escapes in patterns and replacements, e.g. \1 or \g<1>
+ESCAPE_PATTERN = re.compile(r"\\(g<[^>]*>|0[0-7]{0,2}|[0-7]{3}|[1-9][0-9]?|.)", re.DOTALL)
+EMPTY_PATTERN = re.compile("")
+CATEGORY_CLASSES = {
+    "CATEGORY_DIGIT": r"\d",
+    "CATEGORY_NOT_DIGIT": r"\D",
+    "CATEGORY_SPACE": r"\s",
+    "CATEGORY_NOT_SPACE": r"\S",
+    "CATEGORY_WORD": r"\w",
+    "CATEGORY_NOT_WORD": r"\W",
+}
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None
+
+
+def split_template(replacement: str, offset: int, group_index: Dict[str, int]) -> List[Union[str, int]]:
+    """
+    Splits a replacement template into literal strings and the indexes of the referenced groups. Numbered references
+    are shifted by `offset`, named ones are looked up in `group_index`.
+    """
+    parts = []
+    start = 0
+    
+    for match in ESCAPE_PATTERN.finditer(replacement):
+        escape = match.group(1)
+        
+        if escape[0] in "123456789":
+            group = int(escape) + offset
+        elif escape.startswith("g<"):
+            name = escape[2:-1]
+            group = int(name) + offset if name.isdigit() else group_index[name]
+        else:
+            continue
+        
+        # The literal parts may still contain escapes like \n
+        parts.append(EMPTY_PATTERN.sub(replacement[start:match.start()], "", count=1))
+        parts.append(group)
+        start = match.end()
+    
+    parts.append(EMPTY_PATTERN.sub(replacement[start:], "", count=1))
+    
+    return [part for part in parts if part != ""]
+
+
+def get_first_characters(nodes) -> Tuple[Optional[List[str]], bool]:
+    """
+    Returns the character class items, one of which each match of the parsed pattern `nodes` starts with, and whether
+    the pattern can match the empty string. The items are None, if this can't be determined.
+    """
+    items = []
+    
+    for op, av in nodes:
+        name = str(op)
+        
+        if name in ("AT", "ASSERT", "ASSERT_NOT"):
+            # Zero-width, the match starts with what follows
+            continue
+        
+        if name == "LITERAL":
+            items.append(re.escape(chr(av)))
+            return items, False
+        elif name == "IN":
+            for item_op, item_av in av:
+                item_name = str(item_op)
+                
+                if item_name == "LITERAL":
+                    items.append(re.escape(chr(item_av)))
+                elif item_name == "RANGE":
+                    items.append(f"{re.escape(chr(item_av[0]))}-{re.escape(chr(item_av[1]))}")
+                elif item_name == "CATEGORY" and str(item_av) in CATEGORY_CLASSES:
+                    items.append(CATEGORY_CLASSES[str(item_av)])
+                else:
+                    # E.g. negated classes
+                    return None, False
+            return items, False
+        elif name == "BRANCH":
+            nullable = False
+            
+            for branch in av[1]:
+                branch_items, branch_nullable = get_first_characters(branch)
+                
+                if branch_items is None:
+                    return None, False
+                items.extend(branch_items)
+                nullable = nullable or branch_nullable
+        elif name == "SUBPATTERN":
+            _, add_flags, _, subpattern = av
+            
+            if add_flags & re.IGNORECASE:
+                return None, False
+            
+            subpattern_items, nullable = get_first_characters(subpattern)
+            
+            if subpattern_items is None:
+                return None, False
+            items.extend(subpattern_items)
+        elif name == "ATOMIC_GROUP":
+            subpattern_items, nullable = get_first_characters(av)
+            
+            if subpattern_items is None:
+                return None, False
+            items.extend(subpattern_items)
+        elif name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            minimum, _, subpattern = av
+            subpattern_items, nullable = get_first_characters(subpattern)
+            
+            if subpattern_items is None:
+                return None, False
+            items.extend(subpattern_items)
+            nullable = nullable or minimum == 0
+        else:
+            # E.g. any character or backreferences
+            return None, False
+        
+        if not nullable:
+            return items, False
+    
+    return items, True
+
+
+def get_prefilter(patterns: Iterable[str], flags: int) -> str:
+    """
+    Returns a lookahead, that only lets the scan try the alternation at characters a pattern can start with, or an
+    empty string, if any pattern can start with any character (or the empty string).
+    """
+    if sre_parse is None or flags & re.IGNORECASE:
+        return ""
+    
+    items = []
+    
+    for pattern in patterns:
+        try:
+            parsed = sre_parse.parse(pattern, flags)
+        except Exception:
+            return ""
+        
+        if parsed.state.flags & re.IGNORECASE:
+            return ""
+        
+        try:
+            pattern_items, nullable = get_first_characters(parsed)
+        except Exception:
+            # The internal format of the parser may change
+            return ""
+        
+        if pattern_items is None or nullable:
+            return ""
+        items.extend(pattern_items)
+    
+    return f"(?=[{''.join(dict.fromkeys(items))}])" if items else ""
+
+
+@dataclass
+class RegexSetHandler(BaseHandlerMixin):
+    """
+    Applies many substitutions in a single scan. `patterns` maps the patterns to their replacements, replacements may
+    contain group references like `re.sub`. The patterns are compiled once into a single alternation, which is only
+    tried at characters one of the patterns can start with.
+    
+    The value is scanned from left to right. The leftmost match is replaced, if patterns match at the same position,
+    the first one in `patterns` wins. The scan continues after the replaced text, so (unlike a chain of `RegexHandler`s)
+    replaced text is never matched again. Numbered backreferences inside of the patterns aren't supported, use named
+    groups instead.
+    """
+    
+    patterns: Dict[str, str] = field(default_factory=dict)
+    flags: int = 0
+    
+    def __post_init__(self):
+        alternatives = []
+        # Index of the group of each alternative -> replacement
+        templates: Dict[int, Tuple[str, int]] = {}
+        self._replacements: Dict[int, Union[str, List[Union[str, int]]]] = {}
+        group = 1
+        
+        for pattern, replacement in self.patterns.items():
+            compiled = re.compile(pattern, self.flags)
+            
+            if any(escape[0] in "123456789" for escape in ESCAPE_PATTERN.findall(pattern)):
+                raise ValueError(f'Pattern "{pattern}" contains a numbered backreference, use a named group instead')
+            # Raises errors of the template, e.g. unknown groups
+            compiled.sub(replacement, "")
+            
+            alternatives.append(f"({pattern})")
+            
+            if "\\" in replacement:
+                templates[group] = (replacement, group)
+            else:
+                self._replacements[group] = replacement
+            
+            group += compiled.groups + 1
+        
+        if not alternatives:
+            self._compiled_pattern = None
+            return
+        
+        try:
+            self._compiled_pattern = re.compile(
+                get_prefilter(self.patterns, self.flags) + f"(?:{'|'.join(alternatives)})",
+                self.flags
+            )
+        except re.error as error:
+            # E.g. global flags like "(?i)" in one of the patterns
+            raise ValueError(f"The patterns can't be combined ({error}), pass global flags using `flags`") from error
+        
+        # Templates are split once, instead of being parsed by `match.expand` on each match
+        for group, (replacement, offset) in templates.items():
+            parts = split_template(replacement, offset, self._compiled_pattern.groupindex)
+            
+            self._replacements[group] = parts[0] if len(parts) == 1 and isinstance(parts[0], str) else parts
+    
+    @staticmethod
+    def HANDLE_ON():
+        return {HandleOn.CREATION, HandleOn.SAVE}
+    
+    def _replace(self, match: Match) -> str:
+        # The group of the alternative encloses its inner groups, so it is the last one closed
+        replacement = self._replacements[match.lastindex]
+        
+        if type(replacement) is str:
+            return replacement
+        
+        return "".join([
+            part if type(part) is str else match.group(part) or ""
+            for part in replacement
+        ])
+    
+    def handle(self, value: str) -> str:
+        value = "" if value is None else str(value)
+        
+        if self._compiled_pattern is None:
+            return value
+        
+        return self._compiled_pattern.sub(self._replace, value)
+    
+    def handle_many(self, values: Iterable[str]) -> List[str]:
+        return [self.handle(value) for value in values]
+
+
+# Whitespace other than a space, which would be replaced
+NON_SPACE_WHITESPACE_PATTERN = re.compile(r"[^\S ]")
 
 
 @dataclass
@@ -29,8 +306,42 @@ class WhiteSpaceStripHandler(RegexHandler):
     pattern: str = r"\s+"
     replacement: str = " "
     
+    def use_fast_path(self, value) -> bool:
+        # `in` and a single character class are faster than any combined pattern
+        return (
+            type(value) is str and self.pattern == r"\s+" and self.replacement == " "
+            and not (value[:1].isspace() or value[-1:].isspace())
+            and "  " not in value and NON_SPACE_WHITESPACE_PATTERN.search(value) is None
+        )
+    
     def handle(self, value: str) -> str:
+        if self._check_fast_path(value):
+            return value
+        
         return super().handle("" if value is None else str(value)).lstrip().rstrip()
+    
+    def as_expression(self, expression, connection):
+        # `TRIM` only removes spaces, which is enough once all whitespace has been replaced with spaces
+        if self.pattern != r"\s+" or self.replacement != " ":
+            return None
+        
+        expression = super().as_expression(expression, connection)
+        
+        return None if expression is None else Trim(expression, output_field=TextField())
+    
+    def handle_many(self, values: Iterable[str]) -> List[str]:
+        values = list(values)
+        results = list(values)
+        indexes = [
+            index
+            for index, value in enumerate(values)
+            if not self._check_fast_path(value)
+        ]
+        
+        for index, value in zip(indexes, super().handle_many(values[index] for index in indexes)):
+            results[index] = value.lstrip().rstrip()
+        
+        return results
 
 
 @dataclass
@@ -45,16 +356,39 @@ class TextOptimizerHandler(BaseHandlerMixin):
     def HANDLE_ON():
         return {HandleOn.CREATION, HandleOn.SAVE}
     
+    def get_optimizer(self) -> CompiledTextOptimizer:
+        return TextOptimizer.compile(
+            space_before=self.space_before,
+            space_after=self.space_after,
+            ignore_for_digits=self.ignore_for_digits,
+            no_space_after=self.no_space_after,
+            no_space_before=self.no_space_before,
+        )
+    
     def handle(self, value: str) -> str:
-        return TextOptimizer.space_before_text(
-            TextOptimizer.space_after_text(
-                TextOptimizer.remove_redundant_space(
-                    "" if value is None else str(value),
-                    no_space_after=self.no_space_after,
-                    no_space_before=self.no_space_before
-                ),
-                space_after=self.space_after,
-                ignore_for_digits=self.ignore_for_digits,
-            ),
-            self.space_before
+        value = "" if value is None else str(value)
+        result = self.get_optimizer().optimize(value)
+        # The optimizer finds already optimized values in its single scan and returns them as they are
+        self._count_fast_path(int(result is value), int(result is not value))
+        
+        return result
+    
+    def handle_many(self, values: Iterable[str]) -> List[str]:
+        values = ["" if value is None else str(value) for value in values]
+        optimized = TextOptimizer.optimize_many(
+            values,
+            space_before=self.space_before,
+            space_after=self.space_after,
+            ignore_for_digits=self.ignore_for_digits,
+            no_space_after=self.no_space_after,
+            no_space_before=self.no_space_before,
         )
+        # Batches are joined, so unchanged values are copies. Return the values themselves instead
+        results = [
+            value if result == value else result
+            for value, result in zip(values, optimized)
+        ]
+        hits = sum(1 for value, result in zip(values, results) if result is value)
+        self._count_fast_path(hits, len(values) - hits)
+        
+        return results
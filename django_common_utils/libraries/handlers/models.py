@@ -1,67 +1,339 @@
-import collections
-import logging
 from abc import abstractmethod
+from typing import *
 
-from django.core.exceptions import FieldDoesNotExist
-from django.db.models.options import Options
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core import checks
+from django.db.models import Model
 
-from .handlers import ApplyHandler
-from .mixins.base import BaseHandlerMixin
+from .background import clear_pending_handlers, handle_after_commit, split_deferred_handlers
+from .constants import HandleOn
+from .handlers import ApplyHandler, get_companion_fields, handle_columns
+from .plans import get_handler_plan
+from .suspend import get_suspended_handlers
 from .typings import *
 from .typings import ApplyHandlerDefinitionType
-from ..utils import iteration
 
 __all__ = [
-    "HandlerMixin"
+    "HandlerMixin", "check_handler_models"
 ]
 
 
-def is_valid_handler(value) -> bool:
-    return issubclass(value.__class__, BaseHandlerMixin)
+def load_deferred_fields(instances: List["HandlerMixin"], fields: Iterable[str]) -> None:
+    """Loads the `fields`, that haven't been loaded (see `QuerySet.defer`) on saved `instances`, using a single query
+    instead of one query per instance and field."""
+    if not instances:
+        return
+    
+    meta = instances[0]._meta
+    attnames = [meta.get_field(field).attname for field in fields]
+    missing = [
+        instance
+        for instance in instances
+        if instance.pk is not None and any(attname not in instance.__dict__ for attname in attnames)
+    ]
+    
+    if not missing:
+        return
+    
+    rows = {
+        row[0]: row[1:]
+        for row in instances[0].__class__._base_manager
+            .using(missing[0]._state.db)
+            .filter(pk__in=[instance.pk for instance in missing])
+            .values_list("pk", *attnames)
+    }
+    
+    for instance in missing:
+        if instance.pk not in rows:
+            continue
+        
+        snapshot = instance.__dict__.setdefault("_handler_snapshot", {})
+        
+        for attname, value in zip(attnames, rows[instance.pk]):
+            if attname not in instance.__dict__:
+                instance.__dict__[attname] = snapshot[attname] = value
 
 
 class HandlerMixin:
+    """Inherit from this mixin before `models.Model`, otherwise changed fields can't be tracked (see
+    `check_handler_models`)."""
+    
+    # Set by `save(force_handlers=True)`
+    _force_handlers: bool = False
+    # Set by `asave`, once the handlers have been applied asynchronously
+    _handlers_applied: bool = False
+    
     @staticmethod
     @abstractmethod
     def handlers() -> HandlerDefinitionType:
         return {}  # No handlers
     
-    def _get_true_handlers(self, action: str) -> ApplyHandlerDefinitionType:
-        """Gets all valid handlers and fields."""
-        true_handlers = collections.defaultdict(list)
-        
-        meta: Options = self._meta
-        
-        field: str
-        handler: HandlerInstance
-        for field, handler in iteration.ensure_dict(
-                self.__class__.handlers(),  # Ensures that handlers are static
-                str,  # Field names are strings
-                lambda instance: is_valid_handler(instance)  # Use function to determine validness of handlers
-        ):
-            # Check field
-            try:
-                meta.get_field(field)
-            except FieldDoesNotExist:
-                logging.warning(f'Field "{field}" does not exist on instance {self}, skipping it.')
-                continue
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values, so that handlers only run on changed fields
+        instance._handler_snapshot = dict(zip(field_names, values))
+        
+        return instance
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        
+        # Deferred fields are loaded this way once they are accessed
+        if fields is None:
+            self._take_snapshot()
+        else:
+            fields = set(fields)
+            self._take_snapshot([
+                field.name
+                for field in self._meta.concrete_fields
+                if field.name in fields or field.attname in fields
+            ])
+    
+    def save(self, *args, force_handlers: bool = False, **kwargs):
+        """Pass `force_handlers=True` to run the handlers on all fields, even if they haven't changed."""
+        self._force_handlers = force_handlers
+        
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = self.get_fields_to_update(kwargs["update_fields"])
+        
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self._force_handlers = False
+        
+        self._take_snapshot(kwargs.get("update_fields"))
+    
+    async def asave(self, *args, force_handlers: bool = False, **kwargs):
+        """Applies the handlers using `ahandle` before saving, so that they don't block the event loop or the thread,
+        in which the sync part of `asave` runs."""
+        action = HandleOn.CREATION if self.pk is None else HandleOn.SAVE
+        
+        if get_suspended_handlers(self.__class__) is not None:
+            # The row is collected after saving it
+            return await super().asave(*args, **kwargs)
+        
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = self.get_fields_to_update(kwargs["update_fields"])
+        
+        await self._aapply_handlers(action, force=force_handlers, update_fields=kwargs.get("update_fields"))
+        self._handlers_applied = True
+        
+        try:
+            await super().asave(*args, **kwargs)
+        finally:
+            self._handlers_applied = False
+    
+    @classmethod
+    def handle_deleted(cls, instances: List["HandlerMixin"]) -> None:
+        """Called once with all instances deleted in a transaction (e.g. by `QuerySet.delete()`), after it has been
+        committed. Runs the deletion handlers of each field on the values of all instances at once. Override it to
+        clean up in a batch."""
+        for field, handler_list in get_handler_plan(cls, HandleOn.DELETION).handlers.items():
+            values = [getattr(instance, field) for instance in instances]
             
-            # Check handler
-            # Check if actual handler
-            if not is_valid_handler(handler):
-                logging.warning(f'Handler {handler} is not a valid handler, skipping it.')
-                continue
-            # Check HANDLE_ON
-            if action not in handler.HANDLE_ON():
-                continue
+            for handler in handler_list:
+                values = handler.handle_deleted(values)
+    
+    def _take_snapshot(self, update_fields: Optional[Iterable[str]] = None) -> None:
+        """Remembers the current values as the values of the database."""
+        snapshot = self.__dict__.setdefault("_handler_snapshot", {})
+        
+        if update_fields is None:
+            fields = self._meta.concrete_fields
+        else:
+            fields = [self._meta.get_field(name) for name in update_fields]
+        
+        for field in fields:
+            if field.attname in self.__dict__:
+                snapshot[field.attname] = self.__dict__[field.attname]
+    
+    def _is_field_dirty(self, field_name: str) -> bool:
+        snapshot = self.__dict__.get("_handler_snapshot")
+        attname = self._meta.get_field(field_name).attname
+        
+        if attname not in self.__dict__:
+            # Deferred fields, that have neither been loaded nor assigned, haven't changed
+            return False
+        if snapshot is None or attname not in snapshot:
+            return True
+        
+        return getattr(self, attname) != snapshot[attname]
+    
+    def get_dirty_fields(self) -> List[str]:
+        """Returns the names of the fields, that have been changed since the instance has been loaded or saved. Can
+        be passed to `save(update_fields=...)`. In-place changes of mutable values (e.g. dicts) aren't detected."""
+        snapshot = self.__dict__.get("_handler_snapshot", {})
+        
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            # Deferred fields that haven't been loaded can't be changed
+            if not field.primary_key and field.attname in self.__dict__ and (
+                    field.attname not in snapshot or self.__dict__[field.attname] != snapshot[field.attname]
+            )
+        ]
+    
+    @classmethod
+    def get_fields_to_update(cls, fields: Iterable[str]) -> List[str]:
+        """Returns `fields` and the fields, that the handlers of them write additionally (e.g. minified html).
+        Used to extend `update_fields`."""
+        fields = list(fields)
+        handlers = get_handler_plan(cls, HandleOn.SAVE).handlers
+        companion_fields = get_companion_fields({
+            field: handlers[field]
+            for field in fields
+            if field in handlers
+        })
+        
+        return fields + [field for field in companion_fields if field not in fields]
+    
+    def _get_true_handlers(self, action: str) -> ApplyHandlerDefinitionType:
+        """Gets all valid handlers and fields. They are only resolved once per model and action."""
+        return get_handler_plan(self.__class__, action).handlers
+    
+    def _get_handlers_to_apply(
+            self, action: str, force: bool = False, update_fields: Optional[Iterable[str]] = None
+    ) -> ApplyHandlerDefinitionType:
+        """Returns the handlers of `action`. On save only the handlers of changed fields are returned, unless `force`
+        is True. If `update_fields` is passed, the handlers of other fields are skipped, as they wouldn't be saved.
+        Deferred fields, that are handled, are loaded using a single query."""
+        handlers = get_handler_plan(self.__class__, action).handlers
+        clear_pending_handlers(self)
+        
+        if handlers and update_fields is not None:
+            handlers = {
+                field: handler_list
+                for field, handler_list in handlers.items()
+                if field in update_fields
+            }
+        if handlers and action == HandleOn.SAVE and not (force or self._force_handlers):
+            handlers = {
+                field: handler_list
+                for field, handler_list in handlers.items()
+                if self._is_field_dirty(field)
+            }
+        
+        load_deferred_fields([self], handlers)
+        
+        return handlers
+    
+    def _defer_handlers(self, handlers: ApplyHandlerDefinitionType, action: str) -> ApplyHandlerDefinitionType:
+        """Remembers the deferred handlers to run them after the commit and returns the other handlers."""
+        immediate_handlers = {}
+        
+        for field, handler_list in handlers.items():
+            immediate, deferred = split_deferred_handlers(handler_list)
             
-            true_handlers[field].append(handler)
+            if immediate:
+                immediate_handlers[field] = immediate
+            if deferred:
+                handle_after_commit(self, field, deferred, action)
         
-        return dict(true_handlers)
+        return immediate_handlers
     
-    def _apply_handlers(self, action: str) -> None:
-        """Applies all specified handlers onto this instance. Fields wil be overwritten!"""
-        applier = ApplyHandler(instance=self, handlers=self._get_true_handlers(action))
+    def _apply_handlers(
+            self, action: str, force: bool = False, update_fields: Optional[Iterable[str]] = None
+    ) -> None:
+        """Applies all specified handlers onto this instance. Fields wil be overwritten!
+        On save only the handlers of changed fields are run, unless `force` is True."""
+        if self._handlers_applied:
+            # Already applied by `asave`
+            return
+        
+        handlers = self._defer_handlers(self._get_handlers_to_apply(action, force, update_fields), action)
+        
+        if not handlers:
+            return
+        
+        applier = ApplyHandler(instance=self, handlers=handlers)
         
         for field, value in applier.handle().items():
             setattr(self, field, value)
+    
+    async def _aapply_handlers(
+            self, action: str, force: bool = False, update_fields: Optional[Iterable[str]] = None
+    ) -> None:
+        """Like `_apply_handlers`, but uses `ahandle` of the handlers. Different fields are handled concurrently."""
+        handlers = self._defer_handlers(
+            await sync_to_async(self._get_handlers_to_apply)(action, force, update_fields), action
+        )
+        
+        if not handlers:
+            return
+        
+        applier = ApplyHandler(instance=self, handlers=handlers)
+        
+        for field, value in (await applier.ahandle()).items():
+            setattr(self, field, value)
+    
+    @classmethod
+    def _apply_handlers_many(
+            cls, instances: List["HandlerMixin"], action: str, force: bool = False,
+            fields: Optional[Iterable[str]] = None
+    ) -> None:
+        """Like `_apply_handlers` for many instances. Each handler handles the values of all instances at once. If
+        `fields` is passed, only their handlers are run."""
+        plan = get_handler_plan(cls, action)
+        
+        if not plan:
+            return
+        
+        for instance in instances:
+            clear_pending_handlers(instance)
+        
+        for field, handler_list in plan.handlers.items():
+            if fields is not None and field not in fields:
+                continue
+            
+            if action == HandleOn.SAVE and not force:
+                targets = [
+                    instance
+                    for instance in instances
+                    if instance._force_handlers or instance._is_field_dirty(field)
+                ]
+            else:
+                targets = instances
+            
+            if not targets:
+                continue
+            
+            load_deferred_fields(targets, [field])
+            handler_list, deferred = split_deferred_handlers(handler_list)
+            
+            if deferred:
+                for instance in targets:
+                    handle_after_commit(instance, field, deferred, action)
+            if not handler_list:
+                continue
+            
+            columns = handle_columns(
+                {field: handler_list},
+                {field: [getattr(instance, field) for instance in targets]},
+                targets
+            )
+            
+            for column_field, values in columns.items():
+                for instance, value in zip(targets, values):
+                    setattr(instance, column_field, value)
+
+
+def check_handler_models(app_configs=None, **kwargs) -> List[checks.CheckMessage]:
+    """Reports models, that inherit from `models.Model` before `HandlerMixin`. Its `save`, `asave`, `from_db` and
+    `refresh_from_db` would never be called."""
+    if app_configs is None:
+        models = apps.get_models()
+    else:
+        models = [model for app_config in app_configs for model in app_config.get_models()]
+    
+    return [
+        checks.Error(
+            f"{model.__name__} inherits from models.Model before HandlerMixin.",
+            hint="Put HandlerMixin before models.Model (or any model) in the bases.",
+            obj=model,
+            id="django_common_utils.E001",
+        )
+        for model in models
+        if issubclass(model, HandlerMixin) and model.__mro__.index(Model) < model.__mro__.index(HandlerMixin)
+    ]
@@ -1,2 +1,4 @@
+from .backends import *
+from .blocks import *
 from .html import *
 from .text import *
@@ -0,0 +1,681 @@
+import logging
+import re
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from html.parser import HTMLParser
+from types import FunctionType
+from typing import *
+
+from bs4 import BeautifulSoup, Tag
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EntitySubstitution, UnicodeDammit
+from bs4.element import PreformattedString
+
+from ..constants import AddAttributesDict, HTMLOptimizerDefault, UnwrapDict
+from ...utils import iteration
+from ...utils.settings import get_setting
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+__all__ = [
+    "BaseHTMLBackend", "BeautifulSoupBackend", "StreamingBackend", "LXMLBackend", "HTML_BACKENDS", "get_backend"
+]
+
+TextChangerType = Optional[Callable[[str], str]]
+
+# These values are taken from BeautifulSoup, so that all backends serialize the same way `str(soup)` does
+VOID_ELEMENTS = frozenset(HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+PRESERVE_WHITESPACE_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS)
+CDATA_LIST_ATTRIBUTES = dict(HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES)
+CDATA_CONTAINING_TAGS = frozenset({"script", "style"})
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+NON_WHITESPACE = re.compile(r"\S+")
+DECIMAL_REFERENCE = re.compile("^([0-9]+)(.*)")
+HEX_REFERENCE = re.compile("^([0-9a-f]+)(.*)")
+# libxml2 turns every "\r" into "\n", so they are replaced by this noncharacter while parsing
+CARRIAGE_RETURN_PLACEHOLDER = "\ufdd0"
+# Whitespace, comments, doctypes and processing instructions before the first element or text
+PROLOG = re.compile(r"(?:[\x20\x0a\x09\x0c\x0d]+|<!--.*?-->|<!doctype[^>]*>|<\?[^>]*>)*", re.DOTALL | re.IGNORECASE)
+IMPLIED_TAGS = {
+    name: re.compile(rf"<{name}[\s/>]", re.IGNORECASE)
+    for name in ("html", "head", "body")
+}
+
+
+def escape(value: str) -> str:
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def quote_attribute(value: str) -> str:
+    value = escape(value)
+    
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', "&quot;") + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+
+class BaseHTMLBackend(ABC):
+    """A backend parses the html, runs the stages of the `TextHTMLOptimizer` and serializes the result."""
+    
+    name: str = ""
+    
+    @staticmethod
+    def is_available() -> bool:
+        return True
+    
+    @abstractmethod
+    def optimize(
+            self,
+            html: str,
+            unwrap: UnwrapDict,
+            add_attributes: AddAttributesDict,
+            change_text: TextChangerType = None
+    ) -> str:
+        """
+        Runs the stages in this ordering: unwrap -> add attributes -> change text
+        
+        :param html: The html
+        :param unwrap: Tags that should be unwrapped, see `HTMLOptimizerDefault.unwrap`
+        :param add_attributes: Attributes that should be added, see `HTMLOptimizerDefault.add_attributes`
+        :param change_text: Function that is called with the text of every text node, returns the new text
+        :return: The optimized html
+        """
+        raise NotImplementedError("Method is not implemented")
+    
+    def optimize_many(
+            self,
+            htmls: Iterable[str],
+            unwrap: UnwrapDict,
+            add_attributes: AddAttributesDict,
+            change_text: TextChangerType = None
+    ) -> Generator[str, Any, None]:
+        for html in htmls:
+            yield self.optimize(html, unwrap, add_attributes, change_text)
+
+
+def unwrap_elements(elements: List[Tag]) -> None:
+    """
+    Replaces each of `elements` with its contents, like calling `Tag.unwrap` on each of them. `Tag.unwrap` looks the
+    element up in its parent and inserts each child separately, which is quadratic for parents with many unwrapped
+    children. Instead the contents of each parent are rebuilt once here.
+    """
+    unwrapped = {id(element) for element in elements}
+    parents = {}
+    
+    for element in elements:
+        parent = element.parent
+        
+        # Nested elements are unwrapped into the closest parent that stays
+        while id(parent) in unwrapped:
+            parent = parent.parent
+        
+        parents[id(parent)] = parent
+    
+    for parent in parents.values():
+        contents = []
+        stack = [iter(parent.contents)]
+        
+        while stack:
+            for child in stack[-1]:
+                if id(child) in unwrapped:
+                    stack.append(iter(child.contents))
+                    break
+                
+                contents.append(child)
+            else:
+                stack.pop()
+        
+        previous = None
+        
+        for child in contents:
+            child.parent = parent
+            child.previous_sibling = previous
+            
+            if previous is not None:
+                previous.next_sibling = child
+            previous = child
+        
+        if previous is not None:
+            previous.next_sibling = None
+        parent.contents[:] = contents
+    
+    for element in elements:
+        # The children stay in the same order, so only the element itself is removed from the chain of elements
+        if element.previous_element is not None:
+            element.previous_element.next_element = element.next_element
+        if element.next_element is not None:
+            element.next_element.previous_element = element.previous_element
+        
+        element.parent = element.previous_element = element.next_element = None
+        element.previous_sibling = element.next_sibling = None
+        element.contents = []
+
+
+class BeautifulSoupBackend(BaseHTMLBackend):
+    """Builds a BeautifulSoup tree using the pure-Python `html.parser`. This is the default and the fallback."""
+    
+    name = "html.parser"
+    
+    @staticmethod
+    def parse(html: str) -> BeautifulSoup:
+        return BeautifulSoup(html, "html.parser")
+    
+    @staticmethod
+    def unwrap(soup: BeautifulSoup, unwrap: Optional[UnwrapDict] = None) -> BeautifulSoup:
+        if unwrap is None:
+            unwrap = HTMLOptimizerDefault.unwrap
+        
+        for unwrap, trigger in iteration.ensure_dict(unwrap, str, str):
+            unwrap_elements([
+                element
+                for element in soup.find_all(unwrap)
+                if element.find_all(trigger, recursive=False)
+            ])
+        
+        return soup
+    
+    @staticmethod
+    def add_attributes_to_tags(
+            soup: BeautifulSoup,
+            add_attributes: Optional[AddAttributesDict] = None
+    ) -> BeautifulSoup:
+        if add_attributes is None:
+            add_attributes = HTMLOptimizerDefault.add_attributes
+        
+        for tag, attributes in iteration.ensure_dict(add_attributes, str, dict):
+            for element in soup.find_all(tag):
+                for key, value in iteration.ensure_dict(attributes, str, str):
+                    element[key] = value
+        
+        return soup
+    
+    @staticmethod
+    def change_text(soup: BeautifulSoup, func: FunctionType, *args, **kwargs) -> BeautifulSoup:
+        """
+        Calls `func` on every text node and replaces the node in place. Each node is visited exactly once, the
+        contents of tags in `HTMLOptimizerDefault.ignore_text_tags` (and comments, doctypes etc.) are left untouched.
+        """
+        ignore_tags = HTMLOptimizerDefault.ignore_text_tags
+        tags = [soup]
+        
+        while tags:
+            tag = tags.pop()
+            
+            for index, child in enumerate(tag.contents):
+                if isinstance(child, Tag):
+                    if child.name not in ignore_tags:
+                        tags.append(child)
+                elif not isinstance(child, PreformattedString):
+                    new_text = func(str(child), *args, **kwargs)
+                    
+                    if new_text != child:
+                        # PERFORMANCE: Passing the index avoids a linear lookup of the child in its parent
+                        child.extract(_self_index=index)
+                        tag.insert(index, new_text)
+        
+        return soup
+    
+    def optimize(self, html, unwrap, add_attributes, change_text=None):
+        soup = self.parse(html)
+        
+        self.unwrap(soup, unwrap=unwrap)
+        self.add_attributes_to_tags(soup, add_attributes=add_attributes)
+        
+        if change_text is not None:
+            self.change_text(soup, change_text)
+        
+        return str(soup)
+
+
+class _Element:
+    __slots__ = ("name", "start", "start_index", "buffer", "visible", "unwrapped_at", "has_contents")
+    
+    def __init__(self, name: str, start: str):
+        self.name = name
+        self.start = start
+        self.start_index: Optional[int] = None
+        # Only set for elements that may be unwrapped
+        self.buffer: Optional[List[str]] = None
+        # The names of the visible children for each unwrap stage
+        self.visible: Optional[List[Set[str]]] = None
+        self.unwrapped_at: Optional[int] = None
+        self.has_contents = False
+
+
+class _HTMLStreamWriter:
+    """
+    Receives parser events and writes the optimized html without building a tree. Mirrors the tree building of
+    BeautifulSoup (`html.parser`), so that the output is the same as `str(soup)`.
+    
+    Only elements that may be unwrapped are buffered until they are closed, because only then it is known whether
+    they contain a triggering child. For every unwrap stage the names of the (effective) children are kept, so that
+    the sequential unwrap stages of the tree backend can be reproduced.
+    """
+    
+    def __init__(
+            self,
+            unwrap: List[Tuple[str, str]],
+            add_attributes: Dict[str, List[Tuple[str, str]]],
+            change_text: TextChangerType = None,
+    ):
+        self.unwrap = unwrap
+        self.unwrap_tags = {tag for tag, _ in unwrap}
+        self.add_attributes = add_attributes
+        self.change_text = change_text
+        self.ignore_tags = HTMLOptimizerDefault.ignore_text_tags
+        
+        self.output: List[str] = []
+        self.buffer = self.output
+        self.buffers = [self.output]
+        self.stack: List[_Element] = []
+        self.open_tags = Counter()
+        self.preserve_depth = 0
+        self.ignore_depth = 0
+        self.data: List[str] = []
+        self.already_closed: List[str] = []
+    
+    def _append(self, value: str) -> None:
+        if self.stack:
+            self.stack[-1].has_contents = True
+        self.buffer.append(value)
+    
+    def _end_data(self, prefix: Optional[str] = None, suffix: str = "") -> None:
+        if not self.data:
+            return
+        
+        text = "".join(self.data)
+        self.data = []
+        
+        # Whitespace-only strings are reduced to a single space or newline, just like BeautifulSoup does
+        if not self.preserve_depth and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        
+        if prefix is not None:
+            self._append(prefix + text + suffix)
+            return
+        
+        if self.change_text is not None and not self.ignore_depth:
+            text = self.change_text(text)
+        if not self.stack or self.stack[-1].name not in CDATA_CONTAINING_TAGS:
+            text = escape(text)
+        
+        self._append(text)
+    
+    def _format_start(self, name: str, attrs: Iterable[Tuple[str, Optional[str]]]) -> str:
+        attributes = {}
+        
+        for key, value in attrs:
+            attributes[key] = "" if value is None else value
+        
+        # Multi-valued attributes such as `class` are split and joined by BeautifulSoup
+        for key in CDATA_LIST_ATTRIBUTES.get("*", ()):
+            if key in attributes:
+                attributes[key] = " ".join(NON_WHITESPACE.findall(attributes[key]))
+        for key in CDATA_LIST_ATTRIBUTES.get(name, ()):
+            if key in attributes:
+                attributes[key] = " ".join(NON_WHITESPACE.findall(attributes[key]))
+        
+        for key, value in self.add_attributes.get(name, ()):
+            attributes[key] = value
+        
+        return "<" + name + "".join(
+            f" {key}={quote_attribute(value)}"
+            for key, value in sorted(attributes.items())
+        ) + ">"
+    
+    def _pop(self) -> None:
+        element = self.stack.pop()
+        name = element.name
+        
+        self.open_tags[name] -= 1
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth -= 1
+        if name in self.ignore_tags:
+            self.ignore_depth -= 1
+        
+        if name in VOID_ELEMENTS and not element.has_contents:
+            start = element.start[:-1] + "/>"
+            end = ""
+        else:
+            start = element.start
+            end = f"</{name}>"
+        
+        if element.buffer is not None:
+            self.buffers.pop()
+            self.buffer = self.buffers[-1]
+            
+            for stage, (_, trigger) in enumerate(self.unwrap):
+                if self.unwrap[stage][0] == name and trigger in element.visible[stage]:
+                    element.unwrapped_at = stage
+                    break
+            
+            if element.unwrapped_at is None:
+                self.buffer.append(start)
+                self.buffer.extend(element.buffer)
+                self.buffer.append(end)
+            else:
+                self.buffer.extend(element.buffer)
+        else:
+            self.buffer[element.start_index] = start
+            if end:
+                self.buffer.append(end)
+        
+        # Tell the parent which children it has in each unwrap stage
+        if self.stack and (parent := self.stack[-1]).visible is not None:
+            unwrapped_at = element.unwrapped_at
+            
+            for stage, visible in enumerate(parent.visible):
+                if unwrapped_at is None or unwrapped_at >= stage:
+                    visible.add(name)
+                else:
+                    visible.update(element.visible[stage])
+    
+    def _pop_to(self, name: str) -> None:
+        if not self.open_tags[name]:
+            return
+        
+        while self.stack:
+            popped_name = self.stack[-1].name
+            self._pop()
+            
+            if popped_name == name:
+                break
+    
+    def start(self, name: str, attrs: Iterable[Tuple[str, Optional[str]]], handle_empty_element: bool = True) -> None:
+        self._end_data()
+        
+        element = _Element(name, self._format_start(name, attrs))
+        
+        if self.stack:
+            self.stack[-1].has_contents = True
+        
+        if name in self.unwrap_tags:
+            element.buffer = []
+            element.visible = [set() for _ in self.unwrap]
+            self.buffers.append(element.buffer)
+        else:
+            element.start_index = len(self.buffer)
+            self.buffer.append(element.start)
+        
+        self.stack.append(element)
+        self.open_tags[name] += 1
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+        if name in self.ignore_tags:
+            self.ignore_depth += 1
+        
+        self.buffer = self.buffers[-1]
+        
+        if handle_empty_element and name in VOID_ELEMENTS:
+            self.end(name, check_already_closed=False)
+            self.already_closed.append(name)
+    
+    def end(self, name: str, check_already_closed: bool = True) -> None:
+        if check_already_closed and name in self.already_closed:
+            self.already_closed.remove(name)
+            return
+        
+        self._end_data()
+        self._pop_to(name)
+    
+    def text(self, data: str) -> None:
+        self.data.append(data)
+    
+    def special(self, prefix: str, data: str, suffix: str) -> None:
+        """Comments, doctypes, declarations and processing instructions"""
+        self._end_data()
+        self.data.append(data)
+        self._end_data(prefix, suffix)
+    
+    def close(self) -> str:
+        self._end_data()
+        
+        while self.stack:
+            self._pop()
+        
+        return "".join(self.output)
+
+
+def normalize_options(
+        unwrap: Optional[UnwrapDict] = None,
+        add_attributes: Optional[AddAttributesDict] = None
+) -> Tuple[List[Tuple[str, str]], Dict[str, List[Tuple[str, str]]]]:
+    """Flattens the options into pairs, so that the writer doesn't have to resolve them for every tag"""
+    if unwrap is None:
+        unwrap = HTMLOptimizerDefault.unwrap
+    if add_attributes is None:
+        add_attributes = HTMLOptimizerDefault.add_attributes
+    
+    attributes = defaultdict(list)
+    
+    for tag, tag_attributes in iteration.ensure_dict(add_attributes, str, dict):
+        attributes[tag].extend(iteration.ensure_dict(tag_attributes, str, str))
+    
+    return list(iteration.ensure_dict(unwrap, str, str)), dict(attributes)
+
+
+class _StreamingHTMLParser(HTMLParser):
+    def __init__(self, writer: _HTMLStreamWriter):
+        super().__init__(convert_charrefs=False)
+        self.writer = writer
+    
+    def handle_starttag(self, tag, attrs):
+        self.writer.start(tag, attrs)
+    
+    def handle_startendtag(self, tag, attrs):
+        self.writer.start(tag, attrs, handle_empty_element=False)
+        self.writer.end(tag, check_already_closed=False)
+    
+    def handle_endtag(self, tag):
+        self.writer.end(tag)
+    
+    def handle_data(self, data):
+        self.writer.text(data)
+    
+    def handle_charref(self, name):
+        base, pattern = 10, DECIMAL_REFERENCE
+        if name.startswith(("x", "X")):
+            name = name[1:]
+            base, pattern = 16, HEX_REFERENCE
+        
+        extra_data = ""
+        try:
+            number = int(name, base)
+        except ValueError:
+            number = None
+            if (match := pattern.search(name)) is not None:
+                number = int(match.group(1), base)
+                extra_data = match.group(2)
+            else:
+                extra_data = name
+        
+        if number is not None:
+            self.writer.text(UnicodeDammit.numeric_character_reference(number)[0])
+        self.writer.text(extra_data)
+    
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.writer.text(f"&{name}" if character is None else character)
+    
+    def handle_comment(self, data):
+        self.writer.special("<!--", data, "-->")
+    
+    def handle_decl(self, decl):
+        self.writer.special("<!DOCTYPE ", decl[len("DOCTYPE "):], ">\n")
+    
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self.writer.special("<![CDATA[", data[len("CDATA["):], "]]>")
+        else:
+            self.writer.special("<?", data, "?>")
+    
+    def handle_pi(self, data):
+        self.writer.special("<?", data, ">")
+
+
+class StreamingBackend(BaseHTMLBackend):
+    """
+    Uses the tokenizer of the standard library and writes the output while parsing. No tree is built, only elements
+    that may be unwrapped are buffered.
+    
+    Unwrapping tags whose text is left untouched (see `HTMLOptimizerDefault.ignore_text_tags`) or which contain raw
+    text (script, style) is not supported, these documents are handled by the `BeautifulSoupBackend`.
+    """
+    
+    name = "stream"
+    
+    @staticmethod
+    def supports(unwrap: List[Tuple[str, str]]) -> bool:
+        unsupported = HTMLOptimizerDefault.ignore_text_tags | CDATA_CONTAINING_TAGS
+        return not any(tag in unsupported for tag, _ in unwrap)
+    
+    def _feed(self, html: str, writer: _HTMLStreamWriter) -> str:
+        parser = _StreamingHTMLParser(writer)
+        parser.feed(html)
+        parser.close()
+        
+        return writer.close()
+    
+    def optimize(self, html, unwrap, add_attributes, change_text=None):
+        unwrap_pairs, attributes = normalize_options(unwrap, add_attributes)
+        
+        if not self.supports(unwrap_pairs):
+            return get_backend(BeautifulSoupBackend.name).optimize(html, unwrap, add_attributes, change_text)
+        
+        return self._feed(html, _HTMLStreamWriter(unwrap_pairs, attributes, change_text))
+    
+    def optimize_many(self, htmls, unwrap, add_attributes, change_text=None):
+        unwrap_pairs, attributes = normalize_options(unwrap, add_attributes)
+        
+        if not self.supports(unwrap_pairs):
+            yield from get_backend(BeautifulSoupBackend.name).optimize_many(htmls, unwrap, add_attributes, change_text)
+            return
+        
+        # The options are only resolved once for all documents
+        for html in htmls:
+            yield self._feed(html, _HTMLStreamWriter(unwrap_pairs, attributes, change_text))
+
+
+def restore_carriage_returns(value: str) -> str:
+    return value.replace(CARRIAGE_RETURN_PLACEHOLDER, "\r")
+
+
+class _LXMLTarget:
+    def __init__(self, writer: _HTMLStreamWriter, implied_tags: Set[str]):
+        self.writer = writer
+        self.implied_tags = implied_tags
+    
+    def start(self, tag, attrib):
+        if tag not in self.implied_tags:
+            self.writer.start(tag, [
+                (key, restore_carriage_returns(value))
+                for key, value in attrib.items()
+            ])
+    
+    def end(self, tag):
+        if tag not in self.implied_tags:
+            self.writer.end(tag)
+    
+    def data(self, data):
+        self.writer.text(restore_carriage_returns(data))
+    
+    def comment(self, text):
+        self.writer.special("<!--", restore_carriage_returns(text), "-->")
+    
+    def doctype(self, name, public_id, system_url):
+        declaration = name
+        if public_id:
+            declaration += f' PUBLIC "{public_id}"'
+        if system_url:
+            declaration += f' "{system_url}"'
+        
+        self.writer.special("<!DOCTYPE ", restore_carriage_returns(declaration), ">\n")
+    
+    def pi(self, target, data=None):
+        self.writer.special("<?", restore_carriage_returns(f"{target} {data}" if data else target), ">")
+    
+    def close(self):
+        return self.writer.close()
+
+
+class LXMLBackend(StreamingBackend):
+    """
+    Uses the C parser of lxml (libxml2) and feeds its events into the same writer as the `StreamingBackend`. The
+    tags libxml2 implies (html, head, body) are dropped, unless they are part of the html.
+    
+    libxml2 repairs invalid html (e.g. unclosed paragraphs) on its own, so the output only equals the one of the
+    other backends for well-formed html. Carriage returns and the whitespace before the first element or text are
+    kept, even though libxml2 would normalize or drop them. Falls back to the `BeautifulSoupBackend` if lxml is not
+    installed.
+    """
+    
+    name = "lxml"
+    
+    @staticmethod
+    def is_available() -> bool:
+        return etree is not None
+    
+    def _feed(self, html: str, writer: _HTMLStreamWriter) -> str:
+        # The placeholder for "\r" must not be part of the html
+        if CARRIAGE_RETURN_PLACEHOLDER in html:
+            return super()._feed(html, writer)
+        
+        # libxml2 drops the whitespace before the first element or text (also between comments), so this part is
+        # parsed by the streaming parser. libxml2 refuses empty documents, too.
+        prolog = PROLOG.match(html).group()
+        content = html[len(prolog):]
+        
+        if prolog:
+            prolog_parser = _StreamingHTMLParser(writer)
+            prolog_parser.feed(prolog)
+            prolog_parser.close()
+        if not content:
+            return writer.close()
+        
+        implied_tags = {
+            name
+            for name, pattern in IMPLIED_TAGS.items()
+            if not pattern.search(html)
+        }
+        parser = etree.HTMLParser(target=_LXMLTarget(writer, implied_tags))
+        parser.feed(content.replace("\r", CARRIAGE_RETURN_PLACEHOLDER))
+        
+        return parser.close()
+
+
+HTML_BACKENDS: Dict[str, Type[BaseHTMLBackend]] = {
+    backend.name: backend
+    for backend in (BeautifulSoupBackend, StreamingBackend, LXMLBackend)
+}
+
+_instances: Dict[str, BaseHTMLBackend] = {}
+
+
+def get_backend(backend: Union[str, BaseHTMLBackend, None] = None) -> BaseHTMLBackend:
+    """
+    Returns the backend. If `backend` is None, the setting `COMMON_HTML_OPTIMIZER_BACKEND` is used. Backends that are
+    not available (e.g. lxml is not installed) fall back to the `BeautifulSoupBackend`.
+    """
+    if isinstance(backend, BaseHTMLBackend):
+        return backend
+    
+    name = backend or get_setting("COMMON_HTML_OPTIMIZER_BACKEND", BeautifulSoupBackend.name)
+    
+    if name not in _instances:
+        try:
+            backend_class = HTML_BACKENDS[name]
+        except KeyError:
+            raise ValueError(f'Html optimizer backend "{name}" does not exist.')
+        
+        if not backend_class.is_available():
+            logging.warning(f'Html optimizer backend "{name}" is not available, using "{BeautifulSoupBackend.name}".')
+            backend_class = BeautifulSoupBackend
+        
+        _instances[name] = backend_class()
+    
+    return _instances[name]
@@ -0,0 +1,97 @@
+import re
+import zlib
+from typing import *
+
+from .backends import VOID_ELEMENTS
+
+__all__ = [
+    "split_blocks"
+]
+
+TAG = re.compile(
+    r"""<(?:
+        !--.*?-->
+        |/(?P<end_name>[a-zA-Z][^\s/>]*)\s*>
+        |(?P<name>[a-zA-Z][^\s/>]*)
+            (?:\s+[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*
+            \s*(?P<self_closing>/)?>
+    )""",
+    re.DOTALL | re.VERBOSE
+)
+# `html.parser` treats the rest of the document as text after a "&#" without a valid character reference
+INVALID_CHARREF = re.compile(r"&#(?![0-9]|[xX][0-9a-fA-F])")
+# The contents of these elements are not parsed by `html.parser`
+RAW_TEXT_END_TAGS = {
+    name: re.compile(rf"</{name}(?P<end>\s*>)?", re.IGNORECASE)
+    for name in ("script", "style")
+}
+
+
+def is_block_end(node: str, block_size: int) -> bool:
+    # Each node ends a block with a probability of `len(node) / block_size`. This only depends on the node itself, so
+    # changing a node only changes its own block, the following blocks stay the same.
+    return zlib.crc32(node.encode("utf-8", "surrogatepass")) * block_size < len(node) << 32
+
+
+def split_blocks(html: str, block_size: int = 0) -> Optional[List[str]]:
+    """
+    Splits `html` into its top-level elements. Text between the elements belongs to the following element, trailing
+    text forms the last block. Joining the blocks results in `html` again. If `block_size` is set, consecutive
+    elements are joined to blocks of about this length.
+    
+    Every block is parsed to the same nodes on its own as inside of the whole document, so the optimized blocks can be
+    joined to the optimized document. To guarantee this, None is returned for html that the parser would have to
+    repair (e.g. unclosed or mismatched tags or invalid character references) or that isn't understood here (e.g. a "<"
+    in the text or doctypes).
+    """
+    if INVALID_CHARREF.search(html):
+        return None
+    
+    blocks = []
+    stack = []
+    block_start = node_start = 0
+    position = html.find("<")
+    
+    while position != -1:
+        match = TAG.match(html, position)
+        
+        if match is None:
+            return None
+        
+        end = match.end()
+        name = match.group("name")
+        end_name = match.group("end_name")
+        
+        if name is not None:
+            name = name.lower()
+            
+            if name in RAW_TEXT_END_TAGS:
+                raw_end = RAW_TEXT_END_TAGS[name].search(html, end)
+                
+                if match.group("self_closing") or raw_end is None or raw_end.group("end") is None:
+                    return None
+                
+                end = raw_end.end()
+            elif name not in VOID_ELEMENTS and not match.group("self_closing"):
+                stack.append(name)
+        elif end_name is not None:
+            # `html.parser` would close the elements in between or ignore the end tag
+            if not stack or stack[-1] != end_name.lower():
+                return None
+            
+            stack.pop()
+        
+        if not stack:
+            if not block_size or is_block_end(html[node_start:end], block_size):
+                blocks.append(html[block_start:end])
+                block_start = end
+            node_start = end
+        
+        position = html.find("<", end)
+    
+    if stack:
+        return None
+    if block_start < len(html):
+        blocks.append(html[block_start:])
+    
+    return blocks
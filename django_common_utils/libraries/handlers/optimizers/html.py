@@ -1,11 +1,10 @@
-from types import FunctionType
 from typing import *
 
 import htmlmin
-from bs4 import BeautifulSoup, Tag
 
+from .backends import BaseHTMLBackend, BeautifulSoupBackend, get_backend
 from .text import TextOptimizer
-from ..constants import AddAttributesDict, HTMLOptimizerDefault, UnwrapDict
+from ..constants import AddAttributesDict, HTMLOptimizerDefault, TextOptimizerDefault, UnwrapDict
 from ...typings import Kwargs
 from ...utils import iteration
 
@@ -24,42 +23,106 @@ class TextHTMLOptimizer:
     
     @staticmethod
     def minify_html(html: str, opts: Optional[Kwargs] = None) -> str:
+        """Minifies `html` using `htmlmin`. Whitespace inside of whitespace sensitive tags (e.g. `pre`) is kept."""
         if opts is None:
             opts = HTMLOptimizerDefault.minify_opts
         
         return htmlmin.minify(html, **opts)
     
-    @staticmethod
-    def _change_text(soup: BeautifulSoup, func: FunctionType, *args, **kwargs) -> BeautifulSoup:
-        for element in soup.find_all():  # type: Tag
-            if len(element.find_all()) > 0:
-                continue
-            
-            new_text = func(element.get_text(), *args, **kwargs)
-            element.string = new_text
+    # The tree stages live in the `BeautifulSoupBackend`
+    _parse = staticmethod(BeautifulSoupBackend.parse)
+    _unwrap = staticmethod(BeautifulSoupBackend.unwrap)
+    _add_attributes_to_tags = staticmethod(BeautifulSoupBackend.add_attributes_to_tags)
+    _change_text = staticmethod(BeautifulSoupBackend.change_text)
+    
+    @classmethod
+    def optimize(
+            cls,
+            html: str,
+            unwrap: Optional[UnwrapDict] = None,
+            add_attributes: Optional[AddAttributesDict] = None,
+            space_before: str = TextOptimizerDefault.space_before,
+            space_after: str = TextOptimizerDefault.space_after,
+            ignore_for_digits: str = TextOptimizerDefault.ignore_for_digits,
+            no_space_after: str = TextOptimizerDefault.no_space_after,
+            no_space_before: str = TextOptimizerDefault.no_space_before,
+            backend: Union[str, BaseHTMLBackend, None] = None,
+    ) -> str:
+        """
+        Runs all stages as a pipeline. The html is parsed once, every stage works on the same tree and the result
+        is serialized once. The stages are run in this ordering:
+            unwrap -> add attributes -> space before -> space after -> remove redundant space
+        
+        `backend` is the name of the parser backend (see `HTML_BACKENDS`), defaults to the setting
+        `COMMON_HTML_OPTIMIZER_BACKEND`.
+        """
+        optimizer = TextOptimizer.compile(
+            space_before=space_before,
+            space_after=space_after,
+            ignore_for_digits=ignore_for_digits,
+            no_space_after=no_space_after,
+            no_space_before=no_space_before,
+            insert_spaces_first=True,
+        )
+        
+        # All text stages are run within a single walk over the text nodes
+        return get_backend(backend).optimize(
+            html,
+            unwrap=unwrap,
+            add_attributes=add_attributes,
+            change_text=optimizer.optimize
+        )
+    
+    @classmethod
+    def optimize_many(
+            cls,
+            htmls: Iterable[str],
+            unwrap: Optional[UnwrapDict] = None,
+            add_attributes: Optional[AddAttributesDict] = None,
+            space_before: str = TextOptimizerDefault.space_before,
+            space_after: str = TextOptimizerDefault.space_after,
+            ignore_for_digits: str = TextOptimizerDefault.ignore_for_digits,
+            no_space_after: str = TextOptimizerDefault.no_space_after,
+            no_space_before: str = TextOptimizerDefault.no_space_before,
+            backend: Union[str, BaseHTMLBackend, None] = None,
+            chunk_size: int = HTMLOptimizerDefault.chunk_size,
+    ) -> Generator[str, Any, None]:
+        """
+        Like `optimize` for each html, the results are yielded in order. The backend and the text optimizer are
+        only resolved once and the documents are optimized in chunks of `chunk_size`.
+        """
+        html_backend = get_backend(backend)
+        optimizer = TextOptimizer.compile(
+            space_before=space_before,
+            space_after=space_after,
+            ignore_for_digits=ignore_for_digits,
+            no_space_after=no_space_after,
+            no_space_before=no_space_before,
+            insert_spaces_first=True,
+        )
         
-        return soup
+        for chunk in iteration.chunked(htmls, chunk_size):
+            yield from html_backend.optimize_many(
+                chunk,
+                unwrap=unwrap,
+                add_attributes=add_attributes,
+                change_text=optimizer.optimize
+            )
     
     @classmethod
     def html_remove_redundant_space(cls, html: str, *args, **kwargs) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        cls._change_text(soup, TextOptimizer.remove_redundant_space, *args, **kwargs)
-        return str(soup)
+        return str(cls._change_text(cls._parse(html), TextOptimizer.remove_redundant_space, *args, **kwargs))
     
     @classmethod
     def html_space_after_text(cls, html: str, *args, **kwargs) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        cls._change_text(soup, TextOptimizer.space_after_text, *args, **kwargs)
-        return str(soup)
+        return str(cls._change_text(cls._parse(html), TextOptimizer.space_after_text, *args, **kwargs))
     
     @classmethod
     def html_space_before_text(cls, html: str, *args, **kwargs) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        cls._change_text(soup, TextOptimizer.space_before_text, *args, **kwargs)
-        return str(soup)
+        return str(cls._change_text(cls._parse(html), TextOptimizer.space_before_text, *args, **kwargs))
     
-    @staticmethod
-    def html_unwrap(html: str, unwrap: Optional[UnwrapDict] = None) -> str:
+    @classmethod
+    def html_unwrap(cls, html: str, unwrap: Optional[UnwrapDict] = None) -> str:
         """
         Unwraps html tags.
         Example:
@@ -70,30 +133,10 @@ class TextHTMLOptimizer:
             output: <img src="image.jpg" />
         """
         
-        if unwrap is None:
-            unwrap = HTMLOptimizerDefault.unwrap
-        
-        soup = BeautifulSoup(html, "html.parser")
-        
-        for unwrap, trigger in iteration.ensure_dict(unwrap, str, str):
-            for element in soup.find_all(unwrap):
-                if element.find_all(trigger, recursive=False):
-                    element.unwrap()
-        
-        return str(soup)
+        return str(cls._unwrap(cls._parse(html), unwrap=unwrap))
     
-    @staticmethod
-    def html_add_attributes_to_tags(html: str, add_attributes: Optional[AddAttributesDict] = None) -> str:
+    @classmethod
+    def html_add_attributes_to_tags(cls, html: str, add_attributes: Optional[AddAttributesDict] = None) -> str:
         """Adds attributes to html tags"""
         
-        if add_attributes is None:
-            add_attributes = HTMLOptimizerDefault.add_attributes
-        
-        soup = BeautifulSoup(html, "html.parser")
-        
-        for tag, attributes in iteration.ensure_dict(add_attributes, str, dict):
-            for element in soup.find_all(tag):
-                for key, value in iteration.ensure_dict(attributes, str, str):
-                    element[key] = value
-        
-        return str(soup)
+        return str(cls._add_attributes_to_tags(cls._parse(html), add_attributes=add_attributes))
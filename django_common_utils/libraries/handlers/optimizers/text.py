@@ -1,11 +1,60 @@
 import re
+import sys
+from functools import lru_cache
+from typing import *
 
 from ..constants import TextOptimizerDefault
+from ...utils import iteration
 
 __all__ = [
-    "TextOptimizer"
+    "TextOptimizer", "CompiledTextOptimizer"
 ]
 
+# Values of a batch are joined using this character, it is treated like the start and end of a value
+BATCH_SEPARATOR = "\x00"
+# Characters, that change their meaning at the start or the end of a character set, once it is merged with others
+SET_EDGE_CHARACTERS = frozenset("-]&~|[")
+OCTAL_DIGITS = frozenset("01234567")
+
+
+@lru_cache(maxsize=None)
+def get_whitespace_characters() -> str:
+    return "".join(filter(str.isspace, map(chr, range(sys.maxunicode + 1))))
+
+
+def escape_set_edges(value: str) -> str:
+    """Escapes the first and the last character of the character set `value`, if they would change their meaning in a
+    character class merged with other sets (e.g. a leading "-" would become a range). Ranges inside of the set are
+    kept."""
+    if value[:1] in SET_EDGE_CHARACTERS:
+        value = "\\" + value
+    elif value[:1] in OCTAL_DIGITS:
+        # Otherwise it would continue an octal escape at the end of the previous set (e.g. "\1" and "1")
+        value = f"\\x{ord(value[0]):02x}" + value[1:]
+    
+    head = value[:-1]
+    # An odd number of backslashes means that the last character is already escaped
+    if value[-1:] in SET_EDGE_CHARACTERS and (len(head) - len(head.rstrip("\\"))) % 2 == 0:
+        value = head + "\\" + value[-1]
+    
+    return value
+
+
+def closes_early(value: str) -> bool:
+    """Whether the character set `value` contains an unescaped "]" after its first character, which would end the
+    character class there."""
+    index = 0
+    
+    while index < len(value):
+        if value[index] == "\\":
+            index += 2
+            continue
+        if value[index] == "]" and index > 0:
+            return True
+        index += 1
+    
+    return False
+
 
 class TextOptimizer:
     """
@@ -46,3 +95,198 @@ class TextOptimizer:
         return re.sub(
             rf"(?<=[^\s])(?=[{space_before}])", " ", text
         )
+    
+    @staticmethod
+    def optimize_many(
+            values: Iterable[str],
+            space_before: str = TextOptimizerDefault.space_before,
+            space_after: str = TextOptimizerDefault.space_after,
+            ignore_for_digits: str = TextOptimizerDefault.ignore_for_digits,
+            no_space_after: str = TextOptimizerDefault.no_space_after,
+            no_space_before: str = TextOptimizerDefault.no_space_before,
+            chunk_size: int = TextOptimizerDefault.chunk_size,
+    ) -> Generator[str, Any, None]:
+        """
+        Runs remove redundant space -> space after -> space before on each value and yields the results in order.
+        The optimizer is only compiled once and the values are optimized in chunks of `chunk_size`.
+        """
+        optimizer = TextOptimizer.compile(
+            space_before=space_before,
+            space_after=space_after,
+            ignore_for_digits=ignore_for_digits,
+            no_space_after=no_space_after,
+            no_space_before=no_space_before,
+        )
+        
+        for chunk in iteration.chunked(values, chunk_size):
+            yield from optimizer.optimize_batch(chunk)
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def compile(
+            space_before: str = TextOptimizerDefault.space_before,
+            space_after: str = TextOptimizerDefault.space_after,
+            ignore_for_digits: str = TextOptimizerDefault.ignore_for_digits,
+            no_space_after: str = TextOptimizerDefault.no_space_after,
+            no_space_before: str = TextOptimizerDefault.no_space_before,
+            insert_spaces_first: bool = False,
+    ) -> "CompiledTextOptimizer":
+        """Returns a `CompiledTextOptimizer`. Optimizers are cached, so each set of parameters is only compiled once."""
+        return CompiledTextOptimizer(
+            space_before=space_before,
+            space_after=space_after,
+            ignore_for_digits=ignore_for_digits,
+            no_space_after=no_space_after,
+            no_space_before=no_space_before,
+            insert_spaces_first=insert_spaces_first,
+        )
+
+
+class CompiledTextOptimizer:
+    """
+    Applies all rules of the `TextOptimizer` in a single scan. The output is the same as running the methods after
+    each other:
+        insert_spaces_first=False: remove redundant space -> space after -> space before (`TextOptimizerHandler`)
+        insert_spaces_first=True: space before -> space after -> remove redundant space (`TextHTMLOptimizer`)
+    
+    If one of the character sets contains whitespace, is negated or ends before its last character (an unescaped "]"),
+    the methods are simply run after each other.
+    """
+    
+    def __init__(
+            self,
+            space_before: str = TextOptimizerDefault.space_before,
+            space_after: str = TextOptimizerDefault.space_after,
+            ignore_for_digits: str = TextOptimizerDefault.ignore_for_digits,
+            no_space_after: str = TextOptimizerDefault.no_space_after,
+            no_space_before: str = TextOptimizerDefault.no_space_before,
+            insert_spaces_first: bool = False,
+    ):
+        self.space_before = space_before
+        self.space_after = space_after
+        self.ignore_for_digits = ignore_for_digits
+        self.no_space_after = no_space_after
+        self.no_space_before = no_space_before
+        self.insert_spaces_first = insert_spaces_first
+        
+        self._is_space_after = re.compile(rf"[{space_after}]").match
+        self._is_space_before = re.compile(rf"[{space_before}]").match
+        self._is_ignored_for_digits = re.compile(rf"[\d{ignore_for_digits}]").match
+        self._is_digit = re.compile(r"\d").match
+        self._pattern = self._build_pattern()
+        self._batch_pattern = self._build_pattern(BATCH_SEPARATOR)
+    
+    def _build_pattern(self, separator: str = "") -> Optional[Pattern]:
+        """`separator` is treated like the start or the end of the text"""
+        characters = (self.space_after, self.space_before, self.no_space_after, self.no_space_before)
+        
+        # The sets are merged into other character classes below, which only works for sets without whitespace, that
+        # form a single character class
+        if any(
+                value.startswith("^") or closes_early(value) or
+                re.search(rf"[{value}]", get_whitespace_characters() + separator)
+                for value in characters
+        ) or closes_early(rf"\d{self.ignore_for_digits}"):
+            return None
+        
+        space_after, space_before, no_space_after, no_space_before = map(escape_set_edges, characters)
+        
+        # Every match consumes a whitespace run or a single character, which needs a space before or after it.
+        # A space between two characters belongs to the first one, if it is in `space_after`.
+        space_before_character = rf"(?<=[^\s{separator}{space_after}][{space_before}])"
+        space_after_character = (
+            rf"(?<=[{space_after}])(?=[^\s{separator}])"
+            rf"(?:(?<![\d{self.ignore_for_digits}](?=\d))|(?=[{space_before}]))"
+        )
+        
+        if self.insert_spaces_first:
+            # Inserted spaces are removed again by `remove_redundant_space`
+            space_before_character += rf"(?<![{no_space_after}].)(?<![{no_space_before}])"
+            space_after_character += rf"(?<![{no_space_after}])(?![{no_space_before}])"
+        
+        # Starting with a single character class lets `re` skip all other characters quickly
+        return re.compile(
+            rf"[\s{space_after}{space_before}](?:"
+            rf"(?<=\s)(?:(?P<remove>(?<=[{no_space_after}]\s)\s*|\s*(?=[{no_space_before}]))|(?P<collapse>\s+))"
+            rf"|{space_before_character}(?P<before>)(?:{space_after_character}(?P<around>))?"
+            rf"|{space_after_character}(?P<after>)"
+            rf")"
+        )
+    
+    def _should_insert(self, before: str, after: str) -> bool:
+        """Whether `space_after_text` or `space_before_text` would insert a space between these characters."""
+        if self._is_space_after(before) and not (self._is_ignored_for_digits(before) and self._is_digit(after)):
+            return True
+        return bool(self._is_space_before(after))
+    
+    def _replace(self, match: Match) -> str:
+        group = match.lastgroup
+        
+        if group == "after":
+            return match.group() + " "
+        if group == "before":
+            return " " + match.group()
+        if group == "around":
+            return " " + match.group() + " "
+        if group == "collapse":
+            return " "
+        
+        if self.insert_spaces_first:
+            return ""
+        
+        # The characters around the removed space are now next to each other, spaces are inserted afterwards
+        text = match.string
+        start, end = match.span()
+        
+        if start == 0 or end == len(text):
+            return ""
+        
+        before, after = text[start - 1], text[end]
+        
+        if match.re is self._batch_pattern and BATCH_SEPARATOR in (before, after):
+            return ""
+        if self._should_insert(before, after):
+            return " "
+        return ""
+    
+    def _optimize_sequentially(self, text: str) -> str:
+        if self.insert_spaces_first:
+            return TextOptimizer.remove_redundant_space(
+                TextOptimizer.space_after_text(
+                    TextOptimizer.space_before_text(text, space_before=self.space_before),
+                    space_after=self.space_after,
+                    ignore_for_digits=self.ignore_for_digits
+                ),
+                no_space_after=self.no_space_after,
+                no_space_before=self.no_space_before
+            )
+        
+        return TextOptimizer.space_before_text(
+            TextOptimizer.space_after_text(
+                TextOptimizer.remove_redundant_space(
+                    text,
+                    no_space_after=self.no_space_after,
+                    no_space_before=self.no_space_before
+                ),
+                space_after=self.space_after,
+                ignore_for_digits=self.ignore_for_digits
+            ),
+            space_before=self.space_before
+        )
+    
+    def optimize(self, text: str) -> str:
+        """Returns `text` itself, if nothing has changed."""
+        if self._pattern is None:
+            result = self._optimize_sequentially(text)
+        else:
+            # `sub` returns `text` itself, if nothing matches, so already optimized text is only scanned once
+            result = self._pattern.sub(self._replace, text)
+        
+        return text if result == text else result
+    
+    def optimize_batch(self, values: List[str]) -> List[str]:
+        """Optimizes all values at once by joining them, so the pattern only runs once for the whole batch."""
+        if self._batch_pattern is None or any(BATCH_SEPARATOR in value for value in values):
+            return [self.optimize(value) for value in values]
+        
+        return self._batch_pattern.sub(self._replace, BATCH_SEPARATOR.join(values)).split(BATCH_SEPARATOR)
@@ -0,0 +1,110 @@
+import collections
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import *
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.signals import setting_changed
+from django.db.models.options import Options
+from django.dispatch import receiver
+
+from .constants import HandleOn
+from .mixins.base import BaseHandlerMixin
+from .typings import *
+from ..utils import iteration
+
+__all__ = [
+    "HandlerPlan", "get_handler_plan", "build_handler_plans", "clear_handler_plans"
+]
+
+ACTIONS = (HandleOn.CREATION, HandleOn.SAVE, HandleOn.DELETION)
+
+_plans: Dict[Tuple[type, str], "HandlerPlan"] = {}
+
+
+def is_valid_handler(value) -> bool:
+    return issubclass(value.__class__, BaseHandlerMixin)
+
+
+@dataclass(frozen=True)
+class HandlerPlan:
+    """The resolved handlers of a model for an action. `handlers` maps each field to its chain of handlers."""
+    
+    model: type
+    action: str
+    handlers: Mapping[str, Tuple[HandlerInstance, ...]]
+    
+    def __bool__(self):
+        return bool(self.handlers)
+    
+    @classmethod
+    def build(cls, model: type, action: str) -> "HandlerPlan":
+        """Resolves the handlers of `model`. Invalid fields and handlers are skipped with a warning."""
+        true_handlers = collections.defaultdict(list)
+        
+        meta: Options = model._meta
+        
+        field: str
+        handler: HandlerInstance
+        for field, handler in iteration.ensure_dict(
+                model.handlers(),  # Ensures that handlers are static
+                str,  # Field names are strings
+                lambda instance: is_valid_handler(instance)  # Use function to determine validness of handlers
+        ):
+            # Check field
+            try:
+                meta.get_field(field)
+            except FieldDoesNotExist:
+                logging.warning(f'Field "{field}" does not exist on model {model.__name__}, skipping it.')
+                continue
+            
+            # Check handler
+            # Check if actual handler
+            if not is_valid_handler(handler):
+                logging.warning(f'Handler {handler} is not a valid handler, skipping it.')
+                continue
+            # Check HANDLE_ON
+            if action not in handler.HANDLE_ON():
+                continue
+            
+            true_handlers[field].append(handler)
+        
+        return cls(
+            model=model,
+            action=action,
+            handlers=MappingProxyType({
+                field: tuple(handlers)
+                for field, handlers in true_handlers.items()
+            })
+        )
+
+
+def get_handler_plan(model: type, action: str) -> HandlerPlan:
+    """Returns the plan of `model` for `action`. Plans are built once and cached until `clear_handler_plans`."""
+    try:
+        return _plans[model, action]
+    except KeyError:
+        plan = _plans[model, action] = HandlerPlan.build(model, action)
+        return plan
+
+
+def build_handler_plans(model: type) -> None:
+    """Builds the plans of `model` for all actions, so that warnings are shown right away."""
+    for action in ACTIONS:
+        get_handler_plan(model, action)
+
+
+def clear_handler_plans(model: Optional[type] = None) -> None:
+    """Removes the cached plans of `model` or of all models. Use it, if `handlers` return something different."""
+    if model is None:
+        _plans.clear()
+        return
+    
+    for action in ACTIONS:
+        _plans.pop((model, action), None)
+
+
+@receiver(setting_changed)
+def clear_handler_plans_on_setting_change(*args, **kwargs) -> None:
+    clear_handler_plans()
@@ -0,0 +1,97 @@
+import functools
+import re
+from typing import *
+
+from django.db import models
+from django.db.models import F, Func, Value
+
+from .typings import *
+
+__all__ = [
+    "RegexpReplace", "get_regexp_replace", "get_handler_expression", "push_down_handlers",
+    "register_sqlite_functions"
+]
+
+class RegexpReplace(Func):
+    """Replaces all matches of `pattern` in `expression` with `replacement` in the database."""
+    
+    function = "REGEXP_REPLACE"
+    output_field = models.TextField()
+
+
+@functools.lru_cache(maxsize=256)
+def compile_pattern(pattern: str) -> Pattern:
+    return re.compile(pattern)
+
+
+def regexp_replace(value: Optional[str], pattern: str, replacement: str) -> Optional[str]:
+    if value is None:
+        return None
+    
+    return compile_pattern(pattern).sub(replacement, value)
+
+
+def register_sqlite_functions(sender, connection, **kwargs) -> None:
+    """Registers `REGEXP_REPLACE` on SQLite connections. It uses `re`, so the results equal the ones of the
+    handlers. Connected to `connection_created`."""
+    if connection.vendor == "sqlite":
+        connection.connection.create_function("REGEXP_REPLACE", 3, regexp_replace, deterministic=True)
+
+
+def get_regexp_replace(expression, pattern: str, replacement: str, connection) -> Optional[Func]:
+    """
+    Returns `RegexpReplace` for `connection`, or None, if the database can't replace like `re.sub`. Only SQLite is
+    supported, where the function registered by `register_sqlite_functions` uses `re`. The regex dialects of other
+    databases differ from `re` in ways that can't be detected reliably from the pattern (e.g. whether "." matches
+    a newline, Unicode classes or "$"), so their values are handled in Python.
+    """
+    if connection.vendor != "sqlite":
+        return None
+    
+    return RegexpReplace(expression, Value(pattern), Value(replacement))
+
+
+def get_handler_expression(field: str, handler_list: Iterable[HandlerInstance], connection) -> Optional[Func]:
+    """Returns an expression, that computes the result of the chain of handlers of `field` in the database, or None,
+    if a handler can only run in Python."""
+    expression = F(field)
+    
+    for handler in handler_list:
+        if handler.get_companion_fields(field):
+            return None
+        
+        expression = handler.as_expression(expression, connection)
+        
+        if expression is None:
+            return None
+    
+    return expression
+
+
+def push_down_handlers(
+        queryset: models.QuerySet, handlers: Mapping[str, Iterable[HandlerInstance]], dry_run: bool = False
+) -> Tuple[Dict[str, int], Dict[str, tuple]]:
+    """
+    Runs the handlers of the fields, that can be expressed in SQL, using one `update()` per field on the rows of
+    `queryset`, whose value would change. Returns the number of changed rows per field and the handlers of the other
+    fields, which have to run in Python. If `dry_run` is set, the rows are only counted.
+    """
+    from django.db import connections
+    
+    connection = connections[queryset.db]
+    changed = {}
+    remaining = {}
+    
+    for field, handler_list in handlers.items():
+        handler_list = tuple(handler_list)
+        expression = get_handler_expression(field, handler_list, connection)
+        
+        if expression is None:
+            remaining[field] = handler_list
+            continue
+        
+        # Rows with NULL are changed, too (the handlers return an empty string)
+        rows = queryset.exclude(**{field: expression})
+        changed[field] = rows.count() if dry_run else rows.update(**{field: expression})
+    
+    return changed, remaining
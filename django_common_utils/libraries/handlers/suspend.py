@@ -0,0 +1,144 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import *
+
+from django.db.models.signals import post_save
+
+from .background import submit_pending_handlers
+from .constants import HandleOn
+from .plans import get_handler_plan
+from .pushdown import push_down_handlers
+from ..utils import iteration
+from ..utils.settings import get_setting
+
+__all__ = [
+    "SuspendedHandlers", "suspend_handlers", "get_suspended_handlers"
+]
+
+# Each thread and each task has its own context, so suspending the handlers doesn't affect other requests
+_suspended: ContextVar[Optional["SuspendedHandlers"]] = ContextVar("suspended_handlers", default=None)
+# Number of active `suspend_handlers` blocks in all threads, `post_save` is only connected while there are any
+_active = 0
+_lock = threading.Lock()
+
+
+@dataclass
+class SuspendedHandlers:
+    """The rows saved while the handlers of `models` (None for all models) were suspended."""
+    
+    models: Optional[Tuple[type, ...]] = None
+    # Model -> action -> primary keys
+    pks: Dict[type, Dict[str, Dict[Any, None]]] = field(default_factory=dict)
+    
+    def is_suspended(self, model: type) -> bool:
+        return self.models is None or issubclass(model, self.models)
+    
+    def add(self, model: type, action: str, pks: Iterable[Any]) -> None:
+        collected = self.pks.setdefault(model, {})
+        
+        for pk in pks:
+            if pk is None:
+                continue
+            # Rows created in the block get the handlers of the creation, even if they are saved again
+            if action == HandleOn.SAVE and pk in collected.get(HandleOn.CREATION, ()):
+                continue
+            
+            collected.setdefault(action, {})[pk] = None
+    
+    def get_pks(self, model: type, action: str = HandleOn.SAVE) -> List[Any]:
+        return list(self.pks.get(model, {}).get(action, ()))
+    
+    def apply(self, chunk_size: Optional[int] = None) -> None:
+        """Runs the handlers on all collected rows. Handlers, that can be expressed in SQL, run as `update()`, the
+        other ones in batches of `chunk_size` rows. Only changed rows are written."""
+        chunk_size = chunk_size or get_setting("COMMON_HANDLER_CHUNK_SIZE", 500)
+        pks, self.pks = self.pks, {}
+        
+        for model, actions in pks.items():
+            for action, action_pks in actions.items():
+                handlers = get_handler_plan(model, action).handlers
+                
+                if not handlers:
+                    continue
+                
+                for chunk in iteration.chunked(action_pks, chunk_size):
+                    apply_handlers(model, action, handlers, chunk)
+
+
+def apply_handlers(model: type, action: str, handlers: Mapping[str, tuple], pks: List[Any]) -> None:
+    queryset = model._base_manager.filter(pk__in=pks)
+    _, handlers = push_down_handlers(queryset, handlers)
+    
+    if not handlers:
+        return
+    
+    fields = model.get_fields_to_update(handlers)
+    instances = list(queryset.only("pk", *fields))
+    model._apply_handlers_many(instances, action, force=True, fields=handlers)
+    changed_instances = [instance for instance in instances if instance.get_dirty_fields()]
+    
+    if changed_instances:
+        # The base manager doesn't run the handlers again
+        model._base_manager.bulk_update(changed_instances, fields)
+    
+    for instance in instances:
+        instance._take_snapshot(fields)
+        submit_pending_handlers(instance)
+
+
+def get_suspended_handlers(model: Optional[type] = None) -> Optional[SuspendedHandlers]:
+    """Returns the active suspension of the current thread or task, if it includes `model`."""
+    suspended = _suspended.get()
+    
+    if suspended is None or model is not None and not suspended.is_suspended(model):
+        return None
+    
+    return suspended
+
+
+def collect_saved(sender, instance, created: bool, **kwargs) -> None:
+    from ...signals import registry
+    
+    suspended = get_suspended_handlers(sender)
+    
+    # Only models, whose handlers are connected to `pre_save`, have been skipped
+    if suspended is not None and "pre_save" in registry.get(sender, ()):
+        suspended.add(sender, HandleOn.CREATION if created else HandleOn.SAVE, (instance.pk,))
+
+
+@contextmanager
+def suspend_handlers(
+        models: Optional[Iterable[type]] = None, apply_on_exit: bool = True
+) -> Generator[SuspendedHandlers, Any, None]:
+    """
+    Doesn't run the handlers of `models` (default: all models) when saving rows in the block, e.g. while importing
+    data or loading fixtures. The primary keys of the saved rows are collected instead and the handlers are applied
+    in batches on exit, unless `apply_on_exit` is False or the block raised an exception. Call `apply()` on the yielded
+    object to apply them later.
+    
+    The suspension only affects the current thread or task. Deletion handlers aren't suspended.
+    """
+    global _active
+    
+    suspended = SuspendedHandlers(None if models is None else tuple(models))
+    token = _suspended.set(suspended)
+    
+    with _lock:
+        if not _active:
+            post_save.connect(collect_saved, dispatch_uid="django_common_utils.handlers.suspend")
+        _active += 1
+    
+    try:
+        yield suspended
+    finally:
+        _suspended.reset(token)
+        
+        with _lock:
+            _active -= 1
+            if not _active:
+                post_save.disconnect(dispatch_uid="django_common_utils.handlers.suspend")
+    
+    if apply_on_exit:
+        suspended.apply()
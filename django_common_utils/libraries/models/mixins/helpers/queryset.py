@@ -1,5 +1,12 @@
+from typing import *
+
 from django.db import models
 
+from ....handlers.background import submit_pending_handlers
+from ....handlers.constants import HandleOn
+from ....handlers.models import HandlerMixin
+from ....handlers.suspend import get_suspended_handlers
+
 
 __all__ = [
     "CustomQuerySetManager", "CustomQuerySet"
@@ -34,3 +41,59 @@ class CustomQuerySet(models.QuerySet):
             return getattr(super().__class__, attr, *args)
         except AttributeError:
             return getattr(self.model.QuerySet, attr, *args)
+    
+    def _apply_handlers_many(self, objs: list, fields: Optional[List[str]] = None) -> None:
+        """Applies the handlers like `handler_save` would do for each object when saving it. If `fields` is passed,
+        only their handlers are run."""
+        if not issubclass(self.model, HandlerMixin) or get_suspended_handlers(self.model) is not None:
+            return
+        
+        created = [obj for obj in objs if obj.pk is None]
+        saved = [obj for obj in objs if obj.pk is not None]
+        
+        if created:
+            self.model._apply_handlers_many(created, HandleOn.CREATION, fields=fields)
+        if saved:
+            self.model._apply_handlers_many(saved, HandleOn.SAVE, fields=fields)
+    
+    def bulk_create(self, objs: Iterable[models.Model], *args, **kwargs) -> List[models.Model]:
+        """Applies the handlers to all objects before creating them in a single statement"""
+        objs = list(objs)
+        
+        self._apply_handlers_many(objs)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        suspended = get_suspended_handlers(self.model) if issubclass(self.model, HandlerMixin) else None
+        
+        if suspended is not None:
+            # Rows, whose primary key isn't returned by the database, can't be collected
+            suspended.add(self.model, HandleOn.CREATION, (obj.pk for obj in objs))
+        
+        if issubclass(self.model, HandlerMixin):
+            for obj in objs:
+                obj._take_snapshot()
+                submit_pending_handlers(obj)
+        
+        return objs
+    
+    def bulk_update(self, objs: Iterable[models.Model], fields: Iterable[str], *args, **kwargs) -> int:
+        """Applies the handlers to all objects before updating them in a single statement"""
+        objs = list(objs)
+        fields = list(fields)
+        
+        if issubclass(self.model, HandlerMixin):
+            fields = self.model.get_fields_to_update(fields)
+        
+        # Other fields aren't updated
+        self._apply_handlers_many(objs, fields)
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        suspended = get_suspended_handlers(self.model) if issubclass(self.model, HandlerMixin) else None
+        
+        if suspended is not None:
+            suspended.add(self.model, HandleOn.SAVE, (obj.pk for obj in objs))
+        
+        if issubclass(self.model, HandlerMixin):
+            for obj in objs:
+                obj._take_snapshot(fields)
+                submit_pending_handlers(obj)
+        
+        return rows
@@ -13,7 +13,7 @@ __all__ = [
 ]
 
 
-class TitleMixin(models.Model, HandlerMixin):
+class TitleMixin(HandlerMixin, models.Model):
     """Adds a `title` field"""
 
     class Meta:
@@ -59,18 +59,28 @@ class SlugMixin(models.Model):
     )  # type: str
     
     def save(self, *args, **kwargs):
-        used_slugs = set(
-            self.__class__
-                .objects
-                .all()
-                .values_list("slug", flat=True)
-        )
+        deferred_fields = self.get_deferred_fields()
         
-        if self.slug is None or self.slug == "":
+        # A slug, that hasn't been loaded, has been saved already
+        if "slug" not in deferred_fields and (self.slug is None or self.slug == ""):
+            targeted_field = self.__class__._COMMON_SLUG_TARGETED_FIELD()
+            
+            if self._meta.get_field(targeted_field).attname in deferred_fields:
+                self.refresh_from_db(fields=[targeted_field])
+            
+            base_slug = self.slugify(getattr(self, targeted_field))
+            # All candidates start with the slug of the field. The own row may keep its old slug
+            used_slugs = set(
+                self.__class__
+                    .objects
+                    .filter(slug__startswith=base_slug)
+                    .exclude(pk=self.pk)
+                    .values_list("slug", flat=True)
+            )
             counter: Optional[int] = None
             
             while True:
-                use_slug = self.slugify(getattr(self, self.__class__._COMMON_SLUG_TARGETED_FIELD()))
+                use_slug = base_slug
                 
                 if type(counter) is int:
                     # Appending counter and increasing it
@@ -84,6 +94,9 @@ class SlugMixin(models.Model):
                     break
             
             self.slug = use_slug
+            
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = [*kwargs["update_fields"], "slug"]
         
         return super().save(*args, **kwargs)
     
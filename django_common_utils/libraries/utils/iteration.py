@@ -1,7 +1,8 @@
+import itertools
 from typing import *
 
 __all__ = [
-    "ensure_iteration", "ensure_dict"
+    "ensure_iteration", "ensure_dict", "chunked"
 ]
 
 
@@ -13,11 +14,14 @@ def islambda(x, /) -> bool:
 
 def ensure_iteration(value, targeted_type) -> Generator[Any, Any, None]:
     """Iterates over `value` if it is not type of `targeted_value`. Otherwise `value` will be yield directly.
-    Basically takes care if there are values in a iterable or if the value is passed solo."""
+    Basically takes care if there are values in a iterable or if the value is passed solo. If `targeted_type` is a
+    lambda, `value` is yielded, if it returns True, and the items of lists, tuples and sets are yielded as they are."""
     
     if islambda(targeted_type):
         if targeted_type(value):
             yield value
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            yield from value
     elif type(value) is targeted_type:
         yield value
     else:
@@ -33,3 +37,11 @@ def ensure_dict(value: dict, key_type, value_type) -> Generator[Tuple[Any, Any],
             for value in ensure_iteration(value_unknown, value_type):
                 yield key, value
 
+
+def chunked(values: Iterable, size: int) -> Generator[list, Any, None]:
+    """Yields lists with up to `size` values of `values`. Works with generators, too."""
+    
+    iterator = iter(values)
+    
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
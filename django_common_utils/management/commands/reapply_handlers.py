@@ -0,0 +1,211 @@
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import *
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from ...libraries.handlers.background import submit_pending_handlers
+from ...libraries.handlers.constants import HandleOn
+from ...libraries.handlers.handlers import ApplyHandler, get_companion_fields
+from ...libraries.handlers.models import HandlerMixin
+from ...libraries.handlers.plans import get_handler_plan
+from ...libraries.handlers.pushdown import get_handler_expression, push_down_handlers
+from ...libraries.utils import iteration
+
+
+class Command(BaseCommand):
+    help = "Runs the handlers of a model again on all existing rows and saves the rows that changed."
+    
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The model as <app_label>.<ModelName>")
+        parser.add_argument(
+            "--fields", nargs="+", default=None,
+            help="Only run the handlers of these fields (default: all fields with handlers)"
+        )
+        parser.add_argument("--chunk-size", type=int, default=500, help="Rows that are loaded and saved at once")
+        parser.add_argument(
+            "--action", default=HandleOn.SAVE, choices=[HandleOn.CREATION, HandleOn.SAVE],
+            help="Whose handlers to run"
+        )
+        parser.add_argument(
+            "--processes", type=int, default=0,
+            help="Run the handlers in this many processes (default: in this process)"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only count the changes, nothing is saved")
+        parser.add_argument(
+            "--checkpoint", default=None,
+            help="File to store the progress in (default: .reapply_handlers.<app_label>.<model_name>.json)"
+        )
+        parser.add_argument("--resume", action="store_true", help="Continue after the last row of the checkpoint")
+        parser.add_argument(
+            "--no-pushdown", action="store_true",
+            help="Run all handlers in Python, even if they can run in the database"
+        )
+    
+    def get_handlers(self, model: type, action: str, fields: Optional[List[str]]) -> Dict[str, tuple]:
+        handlers = dict(get_handler_plan(model, action).handlers)
+        
+        if fields is None:
+            return handlers
+        
+        unknown = set(fields) - set(handlers)
+        if unknown:
+            raise CommandError(f"These fields have no handlers: {', '.join(sorted(unknown))}")
+        
+        return {
+            field: handlers[field]
+            for field in fields
+        }
+    
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as error:
+            raise CommandError(str(error))
+        
+        self.reapply(
+            model,
+            fields=options["fields"],
+            chunk_size=options["chunk_size"],
+            action=options["action"],
+            processes=options["processes"],
+            dry_run=options["dry_run"],
+            checkpoint=options["checkpoint"],
+            resume=options["resume"],
+            pushdown=not options["no_pushdown"],
+            verbosity=options["verbosity"],
+        )
+    
+    def reapply(
+            self,
+            model: type,
+            fields: Optional[List[str]] = None,
+            chunk_size: int = 500,
+            action: str = HandleOn.SAVE,
+            processes: int = 0,
+            dry_run: bool = False,
+            checkpoint: Optional[str] = None,
+            resume: bool = False,
+            pushdown: bool = True,
+            verbosity: int = 1,
+    ) -> None:
+        if not issubclass(model, HandlerMixin):
+            raise CommandError(f"{model.__name__} doesn't use handlers.")
+        
+        handlers = self.get_handlers(model, action, fields)
+        
+        if not handlers:
+            self.stdout.write(f"{model.__name__} has no handlers for {action}.")
+            return
+        
+        # Handlers that can be expressed in SQL update the rows of each chunk using a single query per field
+        pushed_down_handlers = {}
+        if pushdown:
+            connection = connections[router.db_for_write(model)]
+            pushed_down_handlers = {
+                field: handler_list
+                for field, handler_list in handlers.items()
+                if get_handler_expression(field, handler_list, connection) is not None
+            }
+            handlers = {
+                field: handler_list
+                for field, handler_list in handlers.items()
+                if field not in pushed_down_handlers
+            }
+        
+        # Companion fields (e.g. for minified html) are written, too
+        fields = list(handlers) + [
+            field
+            for field in get_companion_fields(handlers)
+            if field not in handlers
+        ]
+        checkpoint = Path(
+            checkpoint or f".reapply_handlers.{model._meta.app_label}.{model._meta.model_name}.json"
+        )
+        
+        state = {"last_pk": None, "processed": 0, "changed": 0}
+        if resume and checkpoint.exists():
+            state.update(json.loads(checkpoint.read_text()))
+            self.stdout.write(f"Resuming after primary key {state['last_pk']}.")
+        
+        # The base manager doesn't run the handlers again when updating
+        queryset = model._base_manager.order_by("pk").only("pk", *fields)
+        if state["last_pk"] is not None:
+            queryset = queryset.filter(pk__gt=state["last_pk"])
+        
+        executor = ProcessPoolExecutor(processes) if processes and handlers else None
+        started_at = time.monotonic()
+        processed = changed = 0
+        changed_in_database = {field: 0 for field in pushed_down_handlers}
+        
+        try:
+            for instances in iteration.chunked(queryset.iterator(chunk_size=chunk_size), chunk_size):
+                if pushed_down_handlers:
+                    rows = model._base_manager.filter(pk__gte=instances[0].pk, pk__lte=instances[-1].pk)
+                    
+                    for field, count in push_down_handlers(rows, pushed_down_handlers, dry_run=dry_run)[0].items():
+                        changed_in_database[field] += count
+                
+                if handlers:
+                    # Each worker gets a part of the chunk, as the next chunk is only loaded afterwards
+                    results = ApplyHandler.map(
+                        instances, handlers, executor=executor,
+                        chunk_size=math.ceil(len(instances) / processes) if executor is not None else chunk_size
+                    )
+                else:
+                    results = [{} for _ in instances]
+                changed_instances = []
+                
+                for instance, values in zip(instances, results):
+                    changed_values = {
+                        field: value
+                        for field, value in values.items()
+                        if getattr(instance, field) != value
+                    }
+                    
+                    if changed_values:
+                        for field, value in changed_values.items():
+                            setattr(instance, field, value)
+                        changed_instances.append(instance)
+                
+                if changed_instances and not dry_run:
+                    model._base_manager.bulk_update(changed_instances, fields)
+                
+                if not dry_run:
+                    # Handlers that exceeded their budget with the defer policy
+                    for instance in instances:
+                        submit_pending_handlers(instance)
+                
+                processed += len(instances)
+                changed += len(changed_instances)
+                state["last_pk"] = instances[-1].pk
+                state["processed"] += len(instances)
+                state["changed"] += len(changed_instances)
+                
+                if not dry_run:
+                    checkpoint.write_text(json.dumps(state, default=str))
+                
+                if verbosity >= 2:
+                    self.stdout.write(f"{state['processed']} rows processed, {state['changed']} changed.")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        
+        duration = time.monotonic() - started_at
+        rows_per_second = processed / duration if duration else 0
+        
+        if not dry_run and checkpoint.exists():
+            checkpoint.unlink()
+        
+        for field, count in changed_in_database.items():
+            self.stdout.write(f"{field}: {count} rows {'would change' if dry_run else 'changed'} in the database.")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} rows processed, {changed} {'would change' if dry_run else 'changed'} "
+            f"({rows_per_second:.0f} rows/s)."
+        ))
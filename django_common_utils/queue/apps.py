@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class Config(AppConfig):
+    """Stores deferred handlers in the database, if `COMMON_HANDLER_DEFER_QUEUE` is "database". Only projects using
+    this queue need to install it (and its table)."""
+    
+    name = "django_common_utils.queue"
+    label = "django_common_utils_queue"
+    default_auto_field = "django.db.models.BigAutoField"
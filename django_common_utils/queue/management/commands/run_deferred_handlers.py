@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ....libraries.handlers.background import run_queued_handlers
+
+
+class Command(BaseCommand):
+    help = 'Runs the deferred handlers queued in the database (if COMMON_HANDLER_DEFER_QUEUE is "database").'
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None, help="Run at most this many queued handlers")
+        parser.add_argument(
+            "--watch", action="store_true",
+            help="Keep running and poll the queue, until the command is interrupted"
+        )
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to wait between polls of --watch")
+    
+    def handle(self, *args, **options):
+        processed = 0
+        
+        while True:
+            limit = None if options["limit"] is None else options["limit"] - processed
+            count = run_queued_handlers(limit)
+            processed += count
+            
+            if options["verbosity"] >= 2 and count:
+                self.stdout.write(f"{processed} queued handlers processed.")
+            
+            if not options["watch"] or limit is not None and limit <= count:
+                break
+            if not count:
+                time.sleep(options["interval"])
+        
+        self.stdout.write(self.style.SUCCESS(f"{processed} queued handlers processed."))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedHandler',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=255)),
+                ('object_pk', models.CharField(max_length=255)),
+                ('field', models.CharField(max_length=255)),
+                ('action', models.CharField(max_length=16)),
+                ('handlers', models.CharField(max_length=255)),
+                ('database', models.CharField(default='default', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model_label', 'object_pk', 'field'), name='django_common_utils_queue_unique_handler')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import models
+
+__all__ = [
+    "QueuedHandler"
+]
+
+
+class QueuedHandler(models.Model):
+    """Deferred handlers waiting to be run by the `run_deferred_handlers` command, if `COMMON_HANDLER_DEFER_QUEUE` is
+    "database". Use `get_pending_handlers` to query them."""
+    
+    model_label = models.CharField(max_length=255)
+    object_pk = models.CharField(max_length=255)
+    field = models.CharField(max_length=255)
+    action = models.CharField(max_length=16)
+    # Positions of the handlers in the plan of the field, separated by commas
+    handlers = models.CharField(max_length=255)
+    database = models.CharField(max_length=255, default="default")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_label", "object_pk", "field"], name="django_common_utils_queue_unique_handler"
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.model_label}.{self.field} ({self.object_pk})"
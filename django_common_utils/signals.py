@@ -1,21 +1,128 @@
-from django.db.models.signals import post_delete, pre_save
-from django.dispatch import receiver
+import threading
+from typing import *
 
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .libraries.handlers.background import submit_pending_handlers
 from .libraries.handlers.constants import HandleOn
-from .libraries.handlers.models import HandlerMixin
+from .libraries.handlers.plans import get_handler_plan
+from .libraries.handlers.suspend import get_suspended_handlers
+
+__all__ = [
+    "registry", "connect_handlers", "disconnect_handlers"
+]
+
+# Model -> names of the signals, that are connected for it
+registry: Dict[type, Tuple[str, ...]] = {}
+# Database alias -> {savepoints: `DeletedInstances`} of the current transaction, per thread
+_deleted = threading.local()
+
+
+class DeletedInstances:
+    """Collects the instances deleted in a transaction. Their deletion handlers run once for all of them, after the
+    transaction has been committed."""
+    
+    def __init__(self, using: str, key: tuple, run_on_commit: list):
+        self.using = using
+        self.key = key
+        # The list of the connection, that `flush` has been registered in
+        self.run_on_commit = run_on_commit
+        self.instances: Dict[type, list] = {}
+    
+    def add(self, model: type, instance) -> None:
+        self.instances.setdefault(model, []).append(instance)
+    
+    def flush(self) -> None:
+        pending = _deleted.__dict__.get(self.using, {})
+        
+        if pending.get(self.key) is self:
+            del pending[self.key]
+        
+        for model, instances in self.instances.items():
+            model.handle_deleted(instances)
+
+
+def get_deleted_instances(using: str) -> DeletedInstances:
+    """Returns the instances deleted in the current transaction on `using`. The first time a transaction is seen,
+    `flush` is registered using `on_commit`. Callbacks registered in a savepoint are discarded, if it is rolled back,
+    so the instances are collected per savepoint."""
+    connection = connections[using]
+    key = tuple(savepoint for savepoint in connection.savepoint_ids if savepoint is not None)
+    pending = _deleted.__dict__.setdefault(using, {})
+    deleted = pending.get(key)
+    
+    # Django replaces `run_on_commit`, whenever it discards or runs the callbacks (e.g. on a rollback). The atomic
+    # blocks can't be used to tell transactions apart, as `@transaction.atomic` reuses them on every call.
+    if deleted is not None and deleted.run_on_commit is connection.run_on_commit:
+        return deleted
+    
+    # Instances of transactions or savepoints, that have been rolled back, are never flushed
+    for stale_key in [
+        stale_key
+        for stale_key, stale in pending.items()
+        if stale.run_on_commit is not connection.run_on_commit
+    ]:
+        del pending[stale_key]
+    
+    deleted = pending[key] = DeletedInstances(using, key, connection.run_on_commit)
+    transaction.on_commit(deleted.flush, using=using)
+    
+    return deleted
+
+
+def handler_save(sender, instance, *args, raw: bool = False, update_fields=None, **kwargs) -> None:
+    # Fixtures contain handled values. In `suspend_handlers` the rows are collected after saving them
+    if raw or get_suspended_handlers(sender) is not None:
+        return
+    
+    if instance.pk is None:  # Instance is created
+        instance._apply_handlers(HandleOn.CREATION, update_fields=update_fields)
+    else:
+        instance._apply_handlers(HandleOn.SAVE, update_fields=update_fields)
+
+
+def handler_saved(sender, instance, *args, raw: bool = False, **kwargs) -> None:
+    # Handlers that were deferred while saving (see `handle_after_commit`). A receiver works independent of the order
+    # of the bases of the model, `HandlerMixin.save` only runs if the mixin is listed before `models.Model`.
+    if not raw:
+        submit_pending_handlers(instance)
+
+
+def handler_delete(sender, instance, using, *args, **kwargs) -> None:
+    # Deletions always run in a transaction, except of single instances, that can be deleted using a single query
+    if not connections[using].in_atomic_block:
+        sender.handle_deleted([instance])
+        return
+    
+    get_deleted_instances(using).add(sender, instance)
+
+
+def _get_dispatch_uid(model: type, signal_name: str) -> str:
+    return f"django_common_utils.handlers.{signal_name}.{model.__module__}.{model.__qualname__}"
 
 
-@receiver(pre_save)
-def handler_save(sender, instance, *args, **kwargs) -> None:
-    if issubclass(sender, HandlerMixin):
-        if instance.pk is None:  # Instance is created
-            instance._apply_handlers(HandleOn.CREATION)
-        else:
-            instance._apply_handlers(HandleOn.SAVE)
+def connect_handlers(model: type) -> Tuple[str, ...]:
+    """Connects the receivers for `model`, but only for the signals it has handlers for. Models created after the
+    app is ready (e.g. in tests) need to be connected manually."""
+    signals = []
+    
+    if get_handler_plan(model, HandleOn.CREATION) or get_handler_plan(model, HandleOn.SAVE):
+        pre_save.connect(handler_save, sender=model, dispatch_uid=_get_dispatch_uid(model, "pre_save"))
+        post_save.connect(handler_saved, sender=model, dispatch_uid=_get_dispatch_uid(model, "post_save"))
+        signals += ["pre_save", "post_save"]
+    if get_handler_plan(model, HandleOn.DELETION):
+        post_delete.connect(handler_delete, sender=model, dispatch_uid=_get_dispatch_uid(model, "post_delete"))
+        signals.append("post_delete")
+    
+    if signals:
+        registry[model] = tuple(signals)
+    
+    return tuple(signals)
 
 
-# noinspection PyProtectedMember
-@receiver(post_delete)
-def handler_delete(sender, instance, *args, **kwargs) -> None:
-    if issubclass(sender, HandlerMixin):
-        instance._apply_handlers(HandleOn.DELETION)
+def disconnect_handlers(model: type) -> None:
+    pre_save.disconnect(sender=model, dispatch_uid=_get_dispatch_uid(model, "pre_save"))
+    post_save.disconnect(sender=model, dispatch_uid=_get_dispatch_uid(model, "post_save"))
+    post_delete.disconnect(sender=model, dispatch_uid=_get_dispatch_uid(model, "post_delete"))
+    registry.pop(model, None)
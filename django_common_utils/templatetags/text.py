@@ -2,6 +2,7 @@ from typing import *
 
 from django.template.defaulttags import register
 
+from ..libraries.handlers.mixins.html import get_field_minified_html, get_minified_html
 from ..libraries.typings import ModelInstance
 from ..libraries.utils.text import (
     create_short, listify, textify,
@@ -52,3 +53,12 @@ def func_create_short_filter(string: str, prefix: str) -> str:
 @register.simple_tag(name="create_short")
 def func_create_short_simple_tag(*args, **kwargs) -> str:
     return create_short(*args, **kwargs)
+
+
+@register.filter(name="minified", is_safe=True)
+def func_minified(html: Union[str, ModelInstance], field: Optional[str] = None) -> str:
+    """Minifies the html. The result is cached, so it's cheap for html that doesn't change. Use
+    `{{ instance|minified:"field" }}` to read the html its handler has cached on save."""
+    if field is not None:
+        return get_field_minified_html(html, str(field))
+    return get_minified_html(str(html))
@@ -1,12 +1,16 @@
+from contextlib import contextmanager
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.template import Context, Template
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import isolate_apps
 from typing import *
 
 from django_common_utils.libraries.utils import generate_image
 from django_common_utils.libraries.utils.model import model_verbose
 from django_common_utils.libraries.utils.common import combine_fields
+from django_common_utils.libraries.utils.iteration import ensure_iteration
 
 
 class LibrariesTest(TestCase):
@@ -49,6 +53,16 @@ class LibrariesTest(TestCase):
         assert model_verbose(User) == model_verbose("auth.User") == model_verbose(User.objects.all()) == \
                model_verbose(settings.AUTH_USER_MODEL)
         
+    def test_iteration(self):
+        is_text = lambda value: isinstance(value, str)
+        
+        self.assertEqual(list(ensure_iteration("a", is_text)), ["a"])
+        self.assertEqual(list(ensure_iteration(("a", "b"), is_text)), ["a", "b"])
+        self.assertEqual(list(ensure_iteration(["a", 1], is_text)), ["a", 1])
+        self.assertEqual(list(ensure_iteration(1, is_text)), [])
+        self.assertEqual(list(ensure_iteration([1, 2], int)), [1, 2])
+        self.assertEqual(list(ensure_iteration(1, int)), [1])
+        
     def test_templatetags(self):
         first_html = """
             {% load exceptions math %}
@@ -93,3 +107,1367 @@ class LibrariesTest(TestCase):
         self.assertEqual(self.render_template(first_html), expected_first_html)
         self.assertRaises(ZeroDivisionError, lambda: self.render_template(second_html))
  
+
+
+class HandlersTest(TestCase):
+    html_samples = [
+        "",
+        "Plain text,without markup  !",
+        '<p><img src="image.jpg"></p><p>Hello,world  !</p>',
+        '<div><p>First  ( test )</p><p><table><tr><td>1,5 and 2.5</td></tr></table></p></div>',
+        '<p>A <a href="/link">link</a> ,and <b>bold</b> text.</p><a href="/x">Another,link</a>',
+        '<ul><li>One ;two</li><li>Three  -  four</li></ul><br><img src="a.png" alt="">',
+    ]
+    
+    def test_html_optimizer_pipeline(self):
+        from django_common_utils.libraries.handlers.constants import HTMLOptimizerDefault, TextOptimizerDefault
+        from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer
+        
+        for html in self.html_samples:
+            chained = TextHTMLOptimizer.html_remove_redundant_space(
+                TextHTMLOptimizer.html_space_after_text(
+                    TextHTMLOptimizer.html_space_before_text(
+                        TextHTMLOptimizer.html_add_attributes_to_tags(
+                            TextHTMLOptimizer.html_unwrap(html, unwrap=HTMLOptimizerDefault.unwrap),
+                            add_attributes=HTMLOptimizerDefault.add_attributes
+                        ),
+                        space_before=TextOptimizerDefault.space_before
+                    ),
+                    space_after=TextOptimizerDefault.space_after,
+                    ignore_for_digits=TextOptimizerDefault.ignore_for_digits
+                ),
+                no_space_after=TextOptimizerDefault.no_space_after,
+                no_space_before=TextOptimizerDefault.no_space_before,
+            )
+            
+            self.assertEqual(TextHTMLOptimizer.optimize(html), chained)
+    
+    def test_html_optimizer_unwrap(self):
+        from django_common_utils.libraries.handlers.optimizers.backends import BeautifulSoupBackend
+        
+        # Nested and adjacent elements are unwrapped into the closest parent that stays, the triggers are checked
+        # before anything of the same stage is unwrapped
+        soup = BeautifulSoupBackend.parse(
+            "<div>a<p><img><p><img>b</p></p><p>c</p><p><img></p></div><span><p><img></p></span>"
+        )
+        BeautifulSoupBackend.unwrap(soup, {"p": "img", "span": "img"})
+        
+        self.assertEqual(str(soup), "<div>a<img/><img/>b<p>c</p><img/></div><img/>")
+        self.assertEqual([tag.name for tag in soup.find_all(True)], ["div", "img", "img", "p", "img", "img"])
+        self.assertEqual([str(child) for child in soup.div.children][-2:], ["<p>c</p>", "<img/>"])
+        self.assertIs(soup.div.contents[1].next_sibling, soup.div.contents[2])
+    
+    def test_html_optimizer_text_nodes(self):
+        from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer
+        
+        # Text of non-leaf elements is handled, whitespace-sensitive elements and comments are not
+        self.assertEqual(
+            TextHTMLOptimizer.html_space_after_text(
+                "<p>First,second<b>third,fourth</b></p><pre>a,b</pre><code>c,d</code><!-- e,f -->"
+            ),
+            "<p>First, second<b>third, fourth</b></p><pre>a,b</pre><code>c,d</code><!-- e,f -->"
+        )
+    
+    def test_html_optimizer_backends(self):
+        from django_common_utils.libraries.handlers.optimizers import HTML_BACKENDS, TextHTMLOptimizer
+        
+        # libxml2 repairs invalid html on its own (e.g. a table in a paragraph), so they aren't compared for lxml
+        invalid_samples = [
+            self.html_samples[3],
+            '<p>a &foo; b &amp c &#150;</p><!----><br/></br><p/>x',
+        ]
+        samples = self.html_samples + invalid_samples[1:] + [
+            '<div title=\'a"b\' class="  x   y "><p>Tom:Jerry<img></p><pre>  a,b </pre>  </div>',
+            '<script>if (a<b) {x,y}</script><p><b>x</b><br><img src="b.jpg"/></p>',
+            # Carriage returns and leading whitespace are kept
+            "<p>a\r\nb</p>",
+            " Hello",
+            "\n<p>x</p>",
+            '<!DOCTYPE html>\r\n<!-- a\r\nb --> <p title="a\r\nb">c\rd</p><pre>\r\n e</pre>',
+        ]
+        
+        for name in HTML_BACKENDS:
+            with self.subTest(backend=name):
+                for html in samples:
+                    if name == "lxml" and html in invalid_samples:
+                        continue
+                    
+                    self.assertEqual(
+                        TextHTMLOptimizer.optimize(html, backend=name),
+                        TextHTMLOptimizer.optimize(html, backend="html.parser"),
+                        html
+                    )
+    
+    def test_html_optimizer_lxml_backend(self):
+        from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer
+        
+        html = '<div><p>Hello,world  !<img src="a.jpg"></p><p>A <a href="/x">link</a> ,and <br>text.</p></div>'
+        
+        self.assertEqual(
+            TextHTMLOptimizer.optimize(html, backend="lxml"),
+            TextHTMLOptimizer.optimize(html, backend="html.parser")
+        )
+    
+    def test_compiled_text_optimizer(self):
+        import random
+        import re
+        
+        from django_common_utils.libraries.handlers.constants import TextOptimizerDefault
+        from django_common_utils.libraries.handlers.optimizers import TextOptimizer
+        
+        # Property based: the compiled optimizer must equal the methods run after each other for random input
+        randomizer = random.Random(0)
+        alphabet = "ab1 2\n\t.,!?:;()-#+*&%$|/\\`'x9  ٣]^["
+        # The sets are used unescaped like by the methods, so "-" can form ranges and "]" can end a set
+        punctuation = ".,!?:;()-#+*&%$|`'a1]^[\\/"
+        
+        def is_valid(parameters: Tuple[str, ...]) -> bool:
+            try:
+                for value in parameters:
+                    re.compile(f"[{value}]")
+                re.compile(rf"[\d{parameters[2]}]")
+            except re.error:
+                return False
+            return True
+        
+        parameters = [
+            (
+                TextOptimizerDefault.space_before, TextOptimizerDefault.space_after,
+                TextOptimizerDefault.ignore_for_digits,
+                TextOptimizerDefault.no_space_after, TextOptimizerDefault.no_space_before
+            ),
+            # Whitespace in a set falls back to running the methods after each other
+            (r"\s(", TextOptimizerDefault.space_after, "", "-", "."),
+            # Sets starting or ending with "-" are merged without forming a range
+            ("-#", "-/()#", ".,", "-#", "?!.,-"),
+            ("a-z", "!-", "", "-", r"\1"),
+            # An unescaped "]" ends the set early, which also falls back
+            ("(", "]", ".", "a]b", "."),
+        ]
+        
+        while len(parameters) < 100:
+            candidate = tuple(
+                "".join(randomizer.sample(punctuation, randomizer.randint(1, 6)))
+                for _ in range(5)
+            )
+            
+            if is_valid(candidate):
+                parameters.append(candidate)
+        
+        def outcome(func: Callable[[], str]) -> Union[str, type]:
+            # Sets that the methods can't compile must fail the same way
+            try:
+                return func()
+            except re.error:
+                return re.error
+        
+        for space_before, space_after, ignore_for_digits, no_space_after, no_space_before in parameters:
+            arguments = (space_before, space_after, ignore_for_digits, no_space_after, no_space_before)
+            
+            for _ in range(100):
+                text = "".join(randomizer.choice(alphabet) for _ in range(randomizer.randint(0, 30)))
+                
+                self.assertEqual(
+                    outcome(lambda: TextOptimizer.compile(*arguments).optimize(text)),
+                    outcome(lambda: TextOptimizer.space_before_text(
+                        TextOptimizer.space_after_text(
+                            TextOptimizer.remove_redundant_space(text, no_space_after, no_space_before),
+                            space_after, ignore_for_digits
+                        ),
+                        space_before
+                    )),
+                    (text, *arguments)
+                )
+                self.assertEqual(
+                    outcome(lambda: TextOptimizer.compile(*arguments, insert_spaces_first=True).optimize(text)),
+                    outcome(lambda: TextOptimizer.remove_redundant_space(
+                        TextOptimizer.space_after_text(
+                            TextOptimizer.space_before_text(text, space_before),
+                            space_after, ignore_for_digits
+                        ),
+                        no_space_after, no_space_before
+                    )),
+                    (text, *arguments)
+                )
+    
+    def test_handle_many(self):
+        from django_common_utils.libraries.handlers.mixins import (
+            HTMLOptimizerHandler, RegexHandler, TextOptimizerHandler, WhiteSpaceStripHandler
+        )
+        from django_common_utils.libraries.utils import iteration
+        
+        values = ["Hello,world  !", None, "  a  ( b )  ", "1,5 and 2.5", "\x00,x", ""] * 3
+        
+        for handler in (
+                RegexHandler(pattern=r"\d", replacement="#"), WhiteSpaceStripHandler(), TextOptimizerHandler(),
+                HTMLOptimizerHandler()
+        ):
+            with self.subTest(handler=handler.__class__.__name__):
+                self.assertEqual(handler.handle_many(iter(values)), [handler.handle(value) for value in values])
+        
+        self.assertEqual(list(iteration.chunked(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+    
+    def test_regex_set_handler(self):
+        import re
+        
+        from django_common_utils.libraries.handlers.mixins import RegexHandler, RegexSetHandler
+        
+        patterns = {
+            r"\s+([,.!?])": r"\1",
+            r"(?P<amount>\d+)\s*%": r"\g<amount> %",
+            r"\bteh\b": "the",
+            r"--": "\u2014",
+        }
+        handler = RegexSetHandler(patterns=patterns)
+        value = "Teh cat , teh dog -- 5%  !"
+        
+        # Without overlapping matches it equals the chain of `RegexHandler`s
+        expected = value
+        for pattern, replacement in patterns.items():
+            expected = RegexHandler(pattern=pattern, replacement=replacement).handle(expected)
+        
+        self.assertEqual(handler.handle(value), expected)
+        self.assertEqual(handler.handle_many([value, None]), [expected, ""])
+        self.assertEqual(RegexSetHandler(patterns=patterns, flags=re.IGNORECASE).handle("Teh cat"), "the cat")
+        
+        # The leftmost match wins, on the same position the first pattern. Replaced text isn't matched again
+        handler = RegexSetHandler(patterns={"ab": "x", "a": "y", "bc": "ab", "x": "z"})
+        self.assertEqual(handler.handle("abc a bc x"), "xc y ab z")
+        # Groups, that didn't participate in the match, are replaced with an empty string
+        self.assertEqual(RegexSetHandler(patterns={r"(o)(p)?": r"<\2\1>", r"\d": "#"}).handle("op o 1"), "<po> <o> #")
+        
+        with self.assertRaises(ValueError):
+            RegexSetHandler(patterns={r"(a)\1": "b"})
+        with self.assertRaises(ValueError):
+            RegexSetHandler(patterns={"a": "b", "(?i)c": "d"})
+        
+        # The compiled pattern is cached, until the pattern is changed
+        handler = RegexHandler(pattern=r"\d", replacement="#")
+        self.assertIs(handler.get_compiled_pattern(), handler.get_compiled_pattern())
+        handler.pattern = r"\s"
+        self.assertEqual(handler.handle("a 1"), "a#1")
+    
+    def test_fast_paths(self):
+        from django_common_utils.libraries.handlers.mixins import (
+            get_fast_path_stats, HTMLOptimizerHandler, reset_fast_path_stats, TextOptimizerHandler,
+            WhiteSpaceStripHandler
+        )
+        from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer
+        
+        reset_fast_path_stats()
+        
+        # Already handled values are returned as they are
+        for handler, value in (
+                (WhiteSpaceStripHandler(), "A normalized title"),
+                (TextOptimizerHandler(), "Hello, world! (A text)"),
+                (HTMLOptimizerHandler(), "Hello, world! (A text)"),
+        ):
+            with self.subTest(handler=handler.__class__.__name__):
+                self.assertIs(handler.handle(value), value)
+        
+        self.assertEqual(WhiteSpaceStripHandler().handle(" A\ttitle "), "A title")
+        self.assertEqual(WhiteSpaceStripHandler(replacement="-").handle("A title"), "A-title")
+        
+        # Text without markup isn't parsed, but the output is the same
+        handler = HTMLOptimizerHandler()
+        values = ["Hello,world  !", "a ( b )", " ", "\n", "1 < 2", "A &amp; B", "<p>Hello,world</p>", ""]
+        
+        for value in values:
+            with self.subTest(value=value):
+                self.assertEqual(handler.handle(value), TextHTMLOptimizer.optimize(value))
+        
+        stats = get_fast_path_stats()
+        self.assertEqual(stats["WhiteSpaceStripHandler"], {"hits": 1, "misses": 2, "hit_rate": 1 / 3})
+        self.assertEqual(stats["HTMLOptimizerHandler"]["hits"], 4)
+        self.assertEqual(stats["HTMLOptimizerHandler"]["misses"], 5)
+    
+    def test_incremental_html(self):
+        from unittest import mock
+        
+        from django.test import override_settings
+        
+        from django_common_utils.libraries.handlers.mixins import HTMLOptimizerHandler
+        from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer
+        from django_common_utils.libraries.handlers.optimizers.blocks import split_blocks
+        
+        paragraphs = [
+            f"\n<p>Paragraph {index} ,with<b>bold</b>text !<img src='{index}.jpg'></p>"
+            for index in range(40)
+        ]
+        html = "".join(paragraphs)
+        
+        self.assertEqual(split_blocks(html), paragraphs)
+        self.assertEqual("".join(split_blocks(html, 200)), html)
+        # Html the parser would have to repair is optimized as a whole
+        self.assertIsNone(split_blocks("<p>Unclosed<div>Text</p>"))
+        self.assertIsNone(split_blocks("1 < 2 <p>Text</p>"))
+        self.assertIsNone(split_blocks("<p>Ticket &#x see</p><p>b</p>"))
+        
+        optimized_blocks = []
+        optimize_many = TextHTMLOptimizer.optimize_many
+        
+        def spy(htmls, *args, **kwargs):
+            htmls = list(htmls)
+            optimized_blocks.extend(htmls)
+            return optimize_many(htmls, *args, **kwargs)
+        
+        with override_settings(COMMON_HTML_INCREMENTAL_MIN_LENGTH=1000, COMMON_HTML_INCREMENTAL_BLOCK_SIZE=0), \
+                mock.patch.object(TextHTMLOptimizer, "optimize_many", spy):
+            for backend in ("html.parser", "stream"):
+                with self.subTest(backend=backend):
+                    handler = HTMLOptimizerHandler(backend=backend, incremental=True)
+                    full_handler = HTMLOptimizerHandler(backend=backend)
+                    
+                    self.assertEqual(handler.handle(html), full_handler.handle(html))
+                    self.assertEqual(len(optimized_blocks), len(paragraphs))
+                    
+                    # Only the changed block is optimized again
+                    optimized_blocks.clear()
+                    changed = html.replace("Paragraph 7 ", "Paragraph 7 ,changed ")
+                    self.assertEqual(handler.handle_many([changed]), [full_handler.handle(changed)])
+                    self.assertEqual(optimized_blocks, [paragraphs[7].replace("Paragraph 7 ", "Paragraph 7 ,changed ")])
+                    optimized_blocks.clear()
+                    
+                    # The parser treats the rest of the document as text after an invalid character reference
+                    invalid = html.replace("Paragraph 7 ", "Ticket &#x see ")
+                    self.assertEqual(handler.handle(invalid), full_handler.handle(invalid))
+                    self.assertEqual(handler.handle(invalid), TextHTMLOptimizer.optimize(invalid, backend=backend))
+                    optimized_blocks.clear()
+    
+    @isolate_apps("django_common_utils")
+    def test_handler_plans(self):
+        from django.test import override_settings
+        
+        from django_common_utils.libraries.handlers.constants import HandleOn
+        from django_common_utils.libraries.handlers.mixins import WhiteSpaceStripHandler
+        from django_common_utils.libraries.handlers.plans import (
+            build_handler_plans, clear_handler_plans, get_handler_plan
+        )
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        class Article(TitleMixin):
+            @staticmethod
+            def handlers():
+                return {
+                    ("title", "missing"): WhiteSpaceStripHandler()
+                }
+        
+        # Warnings are only shown while building the plans
+        with self.assertLogs(level="WARNING") as logs:
+            build_handler_plans(Article)
+        self.assertEqual(len(logs.output), 3)
+        
+        plan = get_handler_plan(Article, HandleOn.SAVE)
+        self.assertEqual(list(plan.handlers), ["title"])
+        self.assertIs(get_handler_plan(Article, HandleOn.SAVE), plan)
+        self.assertFalse(get_handler_plan(Article, HandleOn.DELETION))
+        
+        article = Article(title="  A   title ")
+        article._apply_handlers(HandleOn.CREATION)
+        self.assertEqual(article.title, "A title")
+        
+        with override_settings(COMMON_HTML_OPTIMIZER_BACKEND="stream"), self.assertLogs(level="WARNING"):
+            self.assertIsNot(get_handler_plan(Article, HandleOn.SAVE), plan)
+        
+        clear_handler_plans(Article)
+    
+    @isolate_apps("django_common_utils")
+    def test_handler_signals(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, pre_save
+        
+        from django_common_utils.libraries.handlers.constants import HandleOn
+        from django_common_utils.libraries.handlers.mixins import RegexHandler
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        from django_common_utils.signals import connect_handlers, disconnect_handlers, registry
+        
+        class DeletionHandler(RegexHandler):
+            @staticmethod
+            def HANDLE_ON():
+                return {HandleOn.DELETION}
+        
+        class Article(TitleMixin):
+            pass
+        
+        class Comment(TitleMixin):
+            @staticmethod
+            def handlers():
+                return {
+                    "title": DeletionHandler(pattern="a", replacement="b")
+                }
+        
+        self.assertFalse(pre_save.has_listeners(User))
+        self.assertFalse(post_delete.has_listeners(User))
+        
+        try:
+            self.assertEqual(connect_handlers(Article), ("pre_save", "post_save"))
+            self.assertEqual(connect_handlers(Comment), ("post_delete",))
+            self.assertEqual(registry[Article], ("pre_save", "post_save"))
+            
+            article = Article(title="  A   title ")
+            pre_save.send(sender=Article, instance=article)
+            self.assertEqual(article.title, "A title")
+            self.assertFalse(post_delete.has_listeners(Article))
+            self.assertFalse(pre_save.has_listeners(Comment))
+        finally:
+            disconnect_handlers(Article)
+            disconnect_handlers(Comment)
+        
+        self.assertNotIn(Article, registry)
+        self.assertFalse(pre_save.has_listeners(Article))
+
+    
+    def test_cached_handler(self):
+        from django.core.cache import caches
+        
+        from django_common_utils.libraries.handlers.mixins import (
+            CachedHandler, HTMLOptimizerHandler, TextOptimizerHandler, get_cache_stats, reset_cache_stats
+        )
+        
+        caches["default"].clear()
+        reset_cache_stats()
+        
+        handler = TextOptimizerHandler().cached()
+        
+        self.assertEqual(handler.handle("Hello,world  !"), "Hello, world!")
+        self.assertEqual(handler.handle("Hello,world  !"), "Hello, world!")
+        self.assertEqual(
+            handler.handle_many(["Hello,world  !", "a ,b", None, "a ,b"]),
+            TextOptimizerHandler().handle_many(["Hello,world  !", "a ,b", None, "a ,b"])
+        )
+        self.assertEqual((handler.hits, handler.misses), (2, 3))
+        self.assertEqual(get_cache_stats(), {"TextOptimizerHandler": {"hits": 2, "misses": 3}})
+        
+        # The configuration is part of the key
+        self.assertEqual(TextOptimizerHandler(space_after="?").cached().handle("Hello,world"), "Hello,world")
+        self.assertEqual(
+            CachedHandler(HTMLOptimizerHandler(add_attributes={"a": {"rel": "x"}})).key_prefix,
+            CachedHandler(HTMLOptimizerHandler(add_attributes={"a": {"rel": "x"}})).key_prefix
+        )
+        self.assertNotEqual(
+            CachedHandler(HTMLOptimizerHandler(add_attributes={"a": {"rel": "x"}})).key_prefix,
+            CachedHandler(HTMLOptimizerHandler(add_attributes={"a": {"rel": "y"}})).key_prefix
+        )
+    
+    def test_apply_handler_map(self):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        from types import SimpleNamespace
+        
+        from django.test import override_settings
+        
+        from django_common_utils.libraries.handlers.executors import get_async_executor
+        from django_common_utils.libraries.handlers.handlers import ApplyHandler
+        from django_common_utils.libraries.handlers.instrumentation import get_handler_stats
+        from django_common_utils.libraries.handlers.mixins import (
+            HTMLOptimizerHandler, RegexHandler, TextOptimizerHandler, WhiteSpaceStripHandler
+        )
+        
+        # Local classes can't be pickled and are run in this process
+        class LocalHandler(RegexHandler):
+            pass
+        
+        handlers = {
+            "title": (WhiteSpaceStripHandler(), TextOptimizerHandler()),
+            "body": (HTMLOptimizerHandler(),),
+            "slug": (LocalHandler(pattern=r"\s", replacement="-"),),
+        }
+        instances = [
+            SimpleNamespace(title=f" Title,{index}  ", body=f"<p>Body,{index}</p>", slug=f"a slug {index}")
+            for index in range(25)
+        ]
+        expected = [ApplyHandler(instance, handlers).handle() for instance in instances]
+        
+        self.assertEqual(ApplyHandler.map(instances, handlers, chunk_size=4), expected)
+        
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(ApplyHandler.map(instances, handlers, executor=executor, chunk_size=4), expected)
+        
+        # The handlers are recorded like in `handle`
+        with override_settings(COMMON_HANDLER_INSTRUMENTATION=["memory"]):
+            ApplyHandler.map(instances, handlers, chunk_size=4)
+            self.assertEqual(get_handler_stats()["SimpleNamespace", "title", "TextOptimizerHandler"].calls, 25)
+        
+        # Whether a handler can be sent to the process pool is only checked once
+        pickled = []
+        
+        class PickledHandler(LocalHandler):
+            def __reduce__(self):
+                pickled.append(self)
+                return super().__reduce__()
+        
+        handler = PickledHandler(pattern=r"\s", replacement="-")
+        
+        with override_settings(COMMON_HANDLER_ASYNC_EXECUTOR="process"):
+            self.assertIsInstance(get_async_executor(handler), ThreadPoolExecutor)
+            self.assertIsInstance(get_async_executor(handler), ThreadPoolExecutor)
+        self.assertEqual(pickled, [handler])
+    
+    def test_instrumentation(self):
+        import socket
+        from types import SimpleNamespace
+        
+        from django.test import override_settings
+        
+        from django_common_utils.libraries.handlers.handlers import ApplyHandler
+        from django_common_utils.libraries.handlers.instrumentation import (
+            get_handler_stats, get_instrumentation, reset_handler_stats, StatsdSink
+        )
+        from django_common_utils.libraries.handlers.mixins import WhiteSpaceStripHandler
+        
+        handlers = {"title": (WhiteSpaceStripHandler(),)}
+        instance = SimpleNamespace(title="  A   title ")
+        
+        self.assertIsNone(get_instrumentation())
+        
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.settimeout(5)
+        self.addCleanup(listener.close)
+        statsd = StatsdSink(host="127.0.0.1", port=listener.getsockname()[1], prefix="test")
+        
+        with override_settings(COMMON_HANDLER_INSTRUMENTATION=["memory", statsd], COMMON_HANDLER_SLOW_THRESHOLD=0):
+            with self.assertLogs("django_common_utils.handlers", level="WARNING"):
+                self.assertEqual(ApplyHandler(instance, handlers).handle(), {"title": "A title"})
+                ApplyHandler(instance, handlers).handle()
+            
+            stats = get_handler_stats()["SimpleNamespace", "title", "WhiteSpaceStripHandler"]
+            self.assertEqual(stats.calls, 2)
+            self.assertEqual(stats.input_size, 24)
+            self.assertEqual(stats.output_size, 14)
+            self.assertGreaterEqual(stats.max_time, stats.average_time)
+            
+            packet = listener.recv(4096).decode("utf-8")
+            self.assertIn("test.SimpleNamespace.title.WhiteSpaceStripHandler.calls:1|c", packet.splitlines())
+            
+            reset_handler_stats()
+            self.assertEqual(get_handler_stats(), {})
+        
+        self.assertIsNone(get_instrumentation())
+
+
+class HandlerModelsTest(TransactionTestCase):
+    @staticmethod
+    @contextmanager
+    def create_tables(*models):
+        from django.db import connection
+        
+        from django_common_utils.signals import connect_handlers, disconnect_handlers
+        
+        with connection.schema_editor() as editor:
+            for model in models:
+                editor.create_model(model)
+                connect_handlers(model)
+        
+        try:
+            yield
+        finally:
+            with connection.schema_editor() as editor:
+                for model in models:
+                    disconnect_handlers(model)
+                    editor.delete_model(model)
+    
+    @isolate_apps("django_common_utils")
+    def test_dirty_fields(self):
+        from django.db import models
+        
+        from django_common_utils.libraries.handlers.mixins import WhiteSpaceStripHandler
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        calls = []
+        
+        class CountingHandler(WhiteSpaceStripHandler):
+            def handle(self, value: str) -> str:
+                calls.append(value)
+                return super().handle(value)
+        
+        class Article(TitleMixin):
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "title": CountingHandler()
+                }
+        
+        with self.create_tables(Article):
+            article = Article.objects.create(title="  A   title ")
+            self.assertEqual(article.title, "A title")
+            self.assertEqual(len(calls), 1)
+            
+            article = Article.objects.get(pk=article.pk)
+            self.assertEqual(article.get_dirty_fields(), [])
+            
+            # Unchanged fields are not handled again
+            article.body = "Body"
+            self.assertEqual(article.get_dirty_fields(), ["body"])
+            article.save(update_fields=article.get_dirty_fields())
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(article.get_dirty_fields(), [])
+            
+            article.title = " Another  title"
+            article.save()
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(Article.objects.get(pk=article.pk).title, "Another title")
+            
+            article.save(force_handlers=True)
+            self.assertEqual(len(calls), 3)
+            
+            # Deferred fields are clean once they are loaded
+            article = Article.objects.only("pk").get(pk=article.pk)
+            self.assertEqual(article.title, "Another title")
+            self.assertEqual(article.get_dirty_fields(), [])
+            article.save()
+            self.assertEqual(len(calls), 3)
+            
+            article.body = "Another body"
+            article.refresh_from_db()
+            self.assertEqual(article.get_dirty_fields(), [])
+    
+    @isolate_apps("django_common_utils", kwarg_name="isolated_apps")
+    def test_handler_base_order(self, isolated_apps):
+        from django.db import models
+        
+        from django_common_utils.libraries.handlers.models import HandlerMixin, check_handler_models
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        class Article(TitleMixin):
+            pass
+        
+        class Note(models.Model, HandlerMixin):
+            @staticmethod
+            def handlers():
+                return {}
+        
+        errors = check_handler_models([isolated_apps.get_app_config("django_common_utils")])
+        
+        self.assertEqual([error.obj for error in errors], [Note])
+        self.assertEqual(errors[0].id, "django_common_utils.E001")
+    
+    @isolate_apps("django_common_utils")
+    def test_async_handlers(self):
+        import asyncio
+        
+        from asgiref.sync import async_to_sync
+        from django.db import models
+        
+        from django_common_utils.libraries.handlers.mixins import WhiteSpaceStripHandler
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        calls = []
+        events = []
+        
+        class CountingHandler(WhiteSpaceStripHandler):
+            def handle(self, value: str) -> str:
+                calls.append(value)
+                return super().handle(value)
+        
+        class ConcurrentHandler(WhiteSpaceStripHandler):
+            async def ahandle(self, value: str) -> str:
+                events.append("start")
+                await asyncio.sleep(0)
+                events.append("end")
+                return self.handle(value)
+        
+        class Article(TitleMixin):
+            subtitle = models.CharField(max_length=60, default="")
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "title": CountingHandler(),
+                    ("subtitle", "body"): ConcurrentHandler(),
+                }
+        
+        with self.create_tables(Article):
+            article = Article(title="  An  async title ", subtitle=" Subtitle ", body=" Body  text ")
+            async_to_sync(article.asave)()
+            
+            self.assertEqual(Article.objects.get(pk=article.pk).title, "An async title")
+            self.assertEqual(article.body, "Body text")
+            # The `pre_save` receiver doesn't handle the values again
+            self.assertEqual(len(calls), 1)
+            # Both fields are handled concurrently
+            self.assertEqual(events, ["start", "start", "end", "end"])
+            
+            article.body = " Changed  "
+            async_to_sync(article.asave)()
+            self.assertEqual(article.body, "Changed")
+            # Only the changed field is handled
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(len(events), 6)
+    
+    @isolate_apps("django_common_utils")
+    def test_minified_html(self):
+        from unittest import mock
+        
+        from asgiref.sync import async_to_sync
+        from django.db import models
+        from django.template import Context, Template
+        from django.test import override_settings
+        
+        from django_common_utils.libraries.handlers.mixins import (
+            get_field_minified_html, get_minified_html, get_minify_stats, HTMLOptimizerHandler, reset_minify_stats
+        )
+        from django_common_utils.libraries.handlers.optimizers import TextHTMLOptimizer
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        html = "<div>\n  <!-- A comment -->\n  <p>Hello,world</p>\n  <pre>  keep  </pre>\n</div>"
+        optimized = HTMLOptimizerHandler().handle(html)
+        # Whitespace between tags is collapsed, not removed, as it matters between inline elements
+        minified = "<div> <p>Hello, world</p> <pre>  keep  </pre> </div>"
+        
+        class Article(TitleMixin):
+            content = models.TextField(default="")
+            content_minified = models.TextField(default="")
+            summary = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "content": HTMLOptimizerHandler(minify=True, minified_field="content_minified"),
+                    "summary": HTMLOptimizerHandler(minify=True),
+                }
+        
+        reset_minify_stats()
+        
+        with self.create_tables(Article):
+            article = Article.objects.create(title="Title", content=html, summary=html)
+            article.refresh_from_db()
+            
+            # The field keeps the optimized html, the minified html is stored in the companion field
+            self.assertEqual(article.content, optimized)
+            self.assertEqual(article.content_minified, minified)
+            self.assertEqual(article.summary, minified)
+            
+            article.content = "<p>Changed</p>\n\n<p>Text</p>"
+            article.save(update_fields=["content"])
+            self.assertEqual(
+                Article.objects.get(pk=article.pk).content_minified, "<p>Changed</p> <p>Text</p>"
+            )
+            
+            article.content = "<p>Async</p>  <p>Text</p>"
+            async_to_sync(article.asave)(update_fields=["content"])
+            self.assertEqual(Article.objects.get(pk=article.pk).content_minified, "<p>Async</p> <p>Text</p>")
+        
+        stats = get_minify_stats()
+        self.assertEqual(stats["content_minified"]["calls"], 3)
+        self.assertEqual(stats["summary"]["calls"], 1)
+        self.assertEqual(stats["summary"]["bytes_saved"], len(optimized) - len(minified))
+        
+        self.assertEqual(get_minified_html(optimized), minified)
+        self.assertEqual(Template("{{ html|safe|minified }}").render(Context({"html": optimized})), minified)
+        
+        # Only cached on save, read using `get_field_minified_html` or the `minified` filter with the field
+        minify_opts = {"remove_comments": False, "pre_tags": ("pre",)}
+        minified_with_comment = "<div> <!-- A comment --> <p>Hello, world</p> <pre>  keep  </pre> </div>"
+        
+        class Page(TitleMixin):
+            content = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "content": HTMLOptimizerHandler(minify=True, minified_cache="minified", minify_opts=minify_opts),
+                }
+        
+        caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+            "minified": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "minified"},
+        }
+        
+        with override_settings(CACHES=caches), self.create_tables(Page):
+            page = Page.objects.create(title="Title", content=html)
+            page.refresh_from_db()
+            # The field keeps the optimized html
+            self.assertEqual(page.content, optimized)
+            
+            # The minified html has been written on save, reading it doesn't minify again
+            with mock.patch.object(TextHTMLOptimizer, "minify_html", side_effect=AssertionError):
+                self.assertEqual(get_field_minified_html(page, "content"), minified_with_comment)
+                self.assertEqual(
+                    Template('{{ page|minified:"content"|safe }}').render(Context({"page": page})),
+                    minified_with_comment
+                )
+    
+    @isolate_apps("django_common_utils")
+    def test_handler_budgets(self):
+        import re
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        
+        from django.db import models
+        
+        from django_common_utils.libraries.handlers.constants import BudgetPolicy
+        from django_common_utils.libraries.handlers.executors import shutdown_async_executors
+        from django_common_utils.libraries.handlers.mixins import RegexHandler, WhiteSpaceStripHandler
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        class BacktrackingHandler(WhiteSpaceStripHandler):
+            def handle(self, value: str) -> str:
+                # Takes minutes without a budget
+                re.match(r"(a+)+$", "a" * 40 + "b")
+                return super().handle(value)
+        
+        class Article(TitleMixin):
+            summary = models.TextField(default="")
+            body = models.TextField(default="")
+            notes = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "title": BacktrackingHandler().with_budget(max_time=0.1),
+                    "summary": WhiteSpaceStripHandler().with_budget(max_length=12, policy=BudgetPolicy.TRUNCATE),
+                    "body": WhiteSpaceStripHandler().with_budget(max_length=12, policy=BudgetPolicy.DEFER),
+                    "notes": WhiteSpaceStripHandler().with_budget(max_length=12),
+                }
+        
+        with self.assertRaises(ValueError):
+            WhiteSpaceStripHandler().with_budget(policy=BudgetPolicy.TRUNCATE)
+        
+        with self.create_tables(Article):
+            started_at = time.monotonic()
+            
+            with self.assertLogs("django_common_utils.handlers", level="WARNING") as logs:
+                article = Article.objects.create(
+                    title=" A  title ",
+                    summary=" A  long  summary ",
+                    body=" A  long  body  text ",
+                    notes=" Long  notes  text ",
+                )
+            
+            self.assertLess(time.monotonic() - started_at, 10)
+            self.assertEqual(len(logs.output), 4)
+            self.assertTrue(all(f"{Article._meta.label}." in line for line in logs.output))
+            
+            self.assertEqual(article.title, " A  title ")
+            self.assertEqual(article.summary, "A long su")
+            self.assertEqual(article.notes, " Long  notes  text ")
+            # The deferred handler runs after the commit and updates the row
+            self.assertEqual(article.body, " A  long  body  text ")
+            shutdown_async_executors()
+            self.assertEqual(Article.objects.get(pk=article.pk).body, "A long body text")
+        
+        # Outside of the main thread the handler can't be interrupted, the budget is applied once it has finished
+        class BusyHandler(WhiteSpaceStripHandler):
+            def handle(self, value: str) -> str:
+                end = time.thread_time() + 0.2
+                
+                while time.thread_time() < end:
+                    pass
+                return super().handle(value)
+        
+        handler = BusyHandler().with_budget(max_time=0.05)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                self.assertLogs("django_common_utils.handlers", level="WARNING") as logs:
+            self.assertEqual(
+                executor.submit(handler.budget.handle, None, "title", handler, " A  title ").result(), " A  title "
+            )
+        self.assertIn("seconds of CPU time", logs.output[0])
+        
+        # The handlers following a deferred one run after the commit, too, together with the deferred handlers
+        class Page(TitleMixin):
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "body": (
+                        WhiteSpaceStripHandler().with_budget(max_length=12, policy=BudgetPolicy.DEFER),
+                        RegexHandler(pattern="long", replacement="short"),
+                        RegexHandler(pattern="body", replacement="text").deferred(),
+                    ),
+                }
+        
+        with self.create_tables(Page):
+            with self.assertLogs("django_common_utils.handlers", level="WARNING"):
+                page = Page.objects.create(title="Title", body=" A  long  body ")
+            
+            self.assertEqual(page.body, " A  long  body ")
+            shutdown_async_executors()
+            self.assertEqual(Page.objects.get(pk=page.pk).body, "A short text")
+    
+    @isolate_apps("django_common_utils")
+    def test_deferred_handlers(self):
+        from io import StringIO
+        
+        from django.core.management import call_command
+        from django.db import models
+        
+        from django.core.exceptions import ImproperlyConfigured
+        
+        from django_common_utils.libraries.handlers.background import get_pending_handlers, get_queue
+        from django_common_utils.libraries.handlers.executors import shutdown_async_executors
+        from django_common_utils.libraries.handlers.mixins import RegexHandler, WhiteSpaceStripHandler
+        from django_common_utils.libraries.handlers.models import HandlerMixin
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        from django_common_utils.management.commands.reapply_handlers import Command
+        
+        # `models.Model` listed before the mixin
+        class Note(models.Model, HandlerMixin):
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "body": WhiteSpaceStripHandler().deferred(),
+                }
+        
+        class Article(TitleMixin):
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "title": WhiteSpaceStripHandler(),
+                    # The handlers after a deferred handler are deferred, too
+                    "body": (
+                        RegexHandler(pattern="text", replacement="note"),
+                        WhiteSpaceStripHandler().deferred(),
+                        RegexHandler(pattern="l", replacement="L"),
+                    ),
+                }
+        
+        with self.create_tables(Article, Note):
+            article = Article.objects.create(title=" A  title ", body=" A  long  text ")
+            note = Note.objects.create(body=" A  note ")
+            
+            self.assertEqual(article.title, "A title")
+            # Only the handlers before the deferred one run in `save`
+            self.assertEqual(article.body, " A  long  note ")
+            self.assertEqual(note.body, " A  note ")
+            shutdown_async_executors()
+            self.assertEqual(Article.objects.get(pk=article.pk).body, "A Long note")
+            self.assertEqual(Note.objects.get(pk=note.pk).body, "A note")
+            self.assertEqual(get_pending_handlers(), [])
+            
+            with self.settings(COMMON_HANDLER_DEFER_QUEUE="database"):
+                article.body = " Another  long  text "
+                article.save()
+                Article.objects.create(title="Title", body=" Second  body ")
+                
+                self.assertEqual(
+                    sorted(pk for model, pk, field in get_pending_handlers(Article)),
+                    sorted(Article.objects.values_list("pk", flat=True))
+                )
+                
+                call_command("run_deferred_handlers", stdout=StringIO())
+                
+                self.assertEqual(get_pending_handlers(Article), [])
+                self.assertEqual(
+                    sorted(Article.objects.values_list("body", flat=True)), ["Another Long note", "Second body"]
+                )
+                
+                # `reapply_handlers` defers them, too
+                Article._base_manager.filter(pk=article.pk).update(body=" A  long  text ")
+                Command(stdout=StringIO()).reapply(Article, fields=["body"], pushdown=False)
+                
+                self.assertEqual(Article.objects.get(pk=article.pk).body, " A  long  note ")
+                self.assertEqual(
+                    sorted(pk for model, pk, field in get_pending_handlers(Article)),
+                    sorted(Article.objects.values_list("pk", flat=True))
+                )
+                
+                call_command("run_deferred_handlers", stdout=StringIO())
+                self.assertEqual(Article.objects.get(pk=article.pk).body, "A Long note")
+                
+                # The queue is an optional app
+                with self.modify_settings(INSTALLED_APPS={"remove": ["django_common_utils.queue.apps.Config"]}), \
+                        self.assertRaises(ImproperlyConfigured):
+                    get_queue()
+    
+    @isolate_apps("django_common_utils")
+    def test_deferred_fields(self):
+        from django.db import models
+        
+        from django_common_utils.libraries.handlers.mixins import WhiteSpaceStripHandler
+        from django_common_utils.libraries.models.mixins import SlugMixin, TitleMixin
+        
+        calls = []
+        
+        class CountingHandler(WhiteSpaceStripHandler):
+            def handle(self, value: str) -> str:
+                calls.append(value)
+                return super().handle(value)
+        
+        class Article(TitleMixin):
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    ("title", "body"): CountingHandler()
+                }
+        
+        class Page(SlugMixin, TitleMixin):
+            @staticmethod
+            def _COMMON_SLUG_TARGETED_FIELD() -> str:
+                return "title"
+        
+        with self.create_tables(Article, Page):
+            pk = Article.objects.create(title="A title", body="A body").pk
+            calls.clear()
+            
+            # The deferred body is neither loaded nor handled
+            article = Article.objects.only("title").get(pk=pk)
+            article.title = " Another  title "
+            
+            with self.assertNumQueries(1):
+                article.save(update_fields=["title"])
+            
+            self.assertEqual(calls, [" Another  title "])
+            
+            # Handled deferred fields are loaded using a single query
+            article = Article.objects.only("pk").get(pk=pk)
+            
+            with self.assertNumQueries(2):
+                article.save(force_handlers=True)
+            
+            self.assertEqual(len(calls), 3)
+            self.assertEqual(article.get_dirty_fields(), [])
+            
+            page = Page.objects.create(title="A page")
+            self.assertEqual(page.slug, "a-page")
+            
+            # Neither the title nor the used slugs are loaded for an existing slug
+            page = Page.objects.only("slug").get(pk=page.pk)
+            
+            with self.assertNumQueries(1):
+                page.save(update_fields=["slug"])
+            
+            # Only the targeted field is loaded to generate a slug
+            page = Page.objects.only("pk").get(pk=page.pk)
+            page.slug = ""
+            page.save(update_fields=["slug"])
+            
+            self.assertEqual(Page.objects.get(pk=page.pk).slug, "a-page")
+    
+    @isolate_apps("django_common_utils")
+    def test_suspend_handlers(self):
+        import threading
+        
+        from asgiref.sync import async_to_sync
+        from django.db import models
+        
+        from django_common_utils.libraries.handlers.constants import HandleOn
+        from django_common_utils.libraries.handlers.mixins import WhiteSpaceStripHandler
+        from django_common_utils.libraries.handlers.suspend import suspend_handlers
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        batches = []
+        
+        class PythonHandler(WhiteSpaceStripHandler):
+            def as_expression(self, expression, connection):
+                return None
+            
+            def handle_many(self, values: Iterable[str]) -> List[str]:
+                values = list(values)
+                batches.append(values)
+                return super().handle_many(values)
+        
+        class Article(TitleMixin):
+            body = models.TextField(default="")
+            
+            @staticmethod
+            def handlers():
+                return {
+                    "title": WhiteSpaceStripHandler(),
+                    "body": PythonHandler(),
+                }
+        
+        def get_rows() -> List[Tuple[str, str]]:
+            return list(Article.objects.order_by("pk").values_list("title", "body"))
+        
+        with self.create_tables(Article):
+            existing = Article.objects.create(title="Title", body="Body")
+            batches.clear()
+            
+            with suspend_handlers() as suspended:
+                for index in range(3):
+                    Article.objects.create(title=f" Title  {index} ", body=f" Body  {index} ")
+                
+                existing.body = " Changed  body "
+                existing.save()
+                async_to_sync(Article(title=" Async  title ").asave)()
+                
+                # Other threads aren't affected
+                thread = threading.Thread(target=lambda: Article.objects.create(title=" Thread  title "))
+                thread.start()
+                thread.join()
+                
+                self.assertEqual(get_rows()[1], (" Title  0 ", " Body  0 "))
+                self.assertEqual(len(suspended.get_pks(Article, HandleOn.CREATION)), 4)
+                self.assertEqual(suspended.get_pks(Article, HandleOn.SAVE), [existing.pk])
+            
+            # The handlers run once for all rows of each action
+            self.assertEqual(sorted(len(batch) for batch in batches), [1, 4])
+            self.assertEqual(get_rows(), [
+                ("Title", "Changed body"), ("Title 0", "Body 0"), ("Title 1", "Body 1"), ("Title 2", "Body 2"),
+                ("Async title", ""), ("Thread title", ""),
+            ])
+            
+            # Fixtures are saved as they are (`loaddata` saves them like this)
+            models.Model.save_base(Article(pk=100, title=" Raw "), raw=True)
+            
+            self.assertEqual(Article.objects.get(pk=100).title, " Raw ")
+            
+            with suspend_handlers(models=[Article], apply_on_exit=False) as suspended:
+                models.Model.save_base(Article(pk=100, title=" Raw "), raw=True)
+            
+            self.assertEqual(Article.objects.get(pk=100).title, " Raw ")
+            suspended.apply()
+            self.assertEqual(Article.objects.get(pk=100).title, "Raw")
+    
+    @isolate_apps("django_common_utils")
+    def test_bulk_handlers(self):
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        from django_common_utils.libraries.models.mixins.helpers import CustomQuerySet, CustomQuerySetManager
+        
+        class Article(TitleMixin):
+            objects = CustomQuerySetManager()
+            QuerySet = CustomQuerySet
+        
+        with self.create_tables(Article):
+            articles = Article.objects.bulk_create(
+                Article(title=title)
+                for title in ("  First   title", "Second title ", "Third")
+            )
+            self.assertEqual(
+                list(Article.objects.order_by("title").values_list("title", flat=True)),
+                ["First title", "Second title", "Third"]
+            )
+            
+            articles = list(Article.objects.order_by("title"))
+            articles[0].title = " New  first "
+            articles[1].title = " New  second "
+            Article.objects.bulk_update(articles, ["title"])
+            
+            self.assertEqual(
+                list(Article.objects.order_by("title").values_list("title", flat=True)),
+                ["New first", "New second", "Third"]
+            )
+            self.assertEqual(articles[0].get_dirty_fields(), [])
+    
+    @isolate_apps("django_common_utils")
+    def test_deletion_handlers(self):
+        from django.db import connection, transaction
+        from django.test.utils import CaptureQueriesContext
+        
+        from django_common_utils.libraries.handlers.constants import HandleOn
+        from django_common_utils.libraries.handlers.mixins import RegexHandler
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        batches = []
+        
+        class DeletionHandler(RegexHandler):
+            @staticmethod
+            def HANDLE_ON():
+                return {HandleOn.DELETION}
+            
+            def handle_deleted(self, values: list) -> list:
+                batches.append(values)
+                return values
+        
+        class Article(TitleMixin):
+            pass
+        
+        class Comment(TitleMixin):
+            @staticmethod
+            def handlers():
+                return {
+                    "title": DeletionHandler()
+                }
+        
+        with self.create_tables(Article, Comment):
+            Article.objects.bulk_create([Article(title=str(index)) for index in range(5)])
+            Comment.objects.bulk_create([Comment(title=str(index)) for index in range(5)])
+            
+            # Models without deletion handlers are deleted without fetching the rows
+            with CaptureQueriesContext(connection) as context:
+                Article.objects.all().delete()
+            
+            self.assertFalse([query for query in context.captured_queries if query["sql"].startswith("SELECT")])
+            
+            # The handlers run once for all deleted instances, after the commit
+            with transaction.atomic():
+                Comment.objects.filter(title__in=["0", "1"]).delete()
+                Comment.objects.filter(title="2").delete()
+                self.assertEqual(batches, [])
+            
+            self.assertEqual([sorted(values) for values in batches], [["0", "1", "2"]])
+            
+            # Rolled back deletions aren't handled, also if only a savepoint is rolled back
+            with self.assertRaises(ValueError), transaction.atomic():
+                Comment.objects.filter(title="3").delete()
+                raise ValueError()
+            
+            with transaction.atomic():
+                with self.assertRaises(ValueError), transaction.atomic():
+                    Comment.objects.filter(title="3").delete()
+                    raise ValueError()
+                
+                Comment.objects.filter(title="3").delete()
+            
+            self.assertEqual(batches[1:], [["3"]])
+            
+            Comment.objects.get(title="4").delete()
+            self.assertEqual(batches[2:], [["4"]])
+            
+            # `transaction.atomic` reuses the same atomic block on every call of a decorated function
+            @transaction.atomic
+            def delete_comments(titles: List[str], fail: bool = False) -> None:
+                Comment.objects.filter(title__in=titles).delete()
+                
+                if fail:
+                    raise ValueError()
+            
+            Comment.objects.bulk_create([Comment(title=str(index)) for index in range(5, 8)])
+            
+            with self.assertRaises(ValueError):
+                delete_comments(["5"], fail=True)
+            
+            delete_comments(["5", "6"])
+            delete_comments(["7"])
+            
+            self.assertEqual([sorted(values) for values in batches[3:]], [["5", "6"], ["7"]])
+    
+    @isolate_apps("django_common_utils")
+    def test_handler_expressions(self):
+        from types import SimpleNamespace
+        
+        from django.db import connection, models
+        
+        from django_common_utils.libraries.handlers.handlers import ApplyHandler
+        from django_common_utils.libraries.handlers.mixins import (
+            HTMLOptimizerHandler, RegexHandler, WhiteSpaceStripHandler
+        )
+        from django_common_utils.libraries.handlers.pushdown import get_handler_expression, push_down_handlers
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        class Article(TitleMixin):
+            body = models.TextField(null=True)
+        
+        handlers = {
+            "title": (RegexHandler(pattern=r"(\d+)\s*%", replacement=r"\1 %"), WhiteSpaceStripHandler()),
+            "body": (WhiteSpaceStripHandler(), RegexHandler(pattern=r"\bteh\b", replacement="the")),
+        }
+        values = [
+            (" 5%  of\tteh\n rows ", "  teh   body\n"),
+            ("Normalized", None),
+            ("", "A teh-like tehx"),
+        ]
+        expected = [
+            tuple(ApplyHandler(SimpleNamespace(title=title, body=body), handlers).handle().values())
+            for title, body in values
+        ]
+        
+        # Handlers without an expression (or with companion fields) run in Python
+        self.assertIsNone(get_handler_expression("body", [HTMLOptimizerHandler()], connection))
+        # The regex dialects of other databases differ from `re`
+        self.assertIsNone(get_handler_expression("title", handlers["title"], SimpleNamespace(vendor="postgresql")))
+        
+        with self.create_tables(Article):
+            # The base manager doesn't run the handlers
+            Article._base_manager.bulk_create(Article(title=title, body=body) for title, body in values)
+            
+            changed, remaining = push_down_handlers(Article._base_manager.all(), handlers)
+            
+            self.assertEqual(changed, {"title": 1, "body": 3})
+            self.assertEqual(remaining, {})
+            # SQLite uses the registered REGEXP_REPLACE, so the results equal the ones in Python
+            self.assertEqual(list(Article.objects.order_by("pk").values_list("title", "body")), expected)
+    
+    @isolate_apps("django_common_utils")
+    def test_reapply_handlers_command(self):
+        import json
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from io import StringIO
+        from pathlib import Path
+        from unittest import mock
+        
+        from django.core.management import CommandError, call_command
+        
+        from django_common_utils.management.commands.reapply_handlers import Command
+        from django_common_utils.libraries.models.mixins import TitleMixin
+        
+        class Article(TitleMixin):
+            pass
+        
+        def get_titles() -> List[str]:
+            return list(Article.objects.order_by("pk").values_list("title", flat=True))
+        
+        with self.create_tables(Article), tempfile.TemporaryDirectory() as directory:
+            checkpoint = Path(directory) / "checkpoint.json"
+            # The base manager doesn't run the handlers
+            Article._base_manager.bulk_create(
+                Article(title=title)
+                for title in (" First  ", "Second", " Third  title", "  Fourth")
+            )
+            
+            output = StringIO()
+            Command(stdout=output).reapply(
+                Article, chunk_size=2, dry_run=True, checkpoint=str(checkpoint), pushdown=False
+            )
+            self.assertIn("4 rows processed, 3 would change", output.getvalue())
+            self.assertEqual(get_titles(), [" First  ", "Second", " Third  title", "  Fourth"])
+            self.assertFalse(checkpoint.exists())
+            
+            # The handlers, that run in the database, are counted in the dry run, too
+            output = StringIO()
+            Command(stdout=output).reapply(Article, chunk_size=2, dry_run=True, checkpoint=str(checkpoint))
+            self.assertIn("title: 3 rows would change in the database", output.getvalue())
+            self.assertEqual(get_titles(), [" First  ", "Second", " Third  title", "  Fourth"])
+            
+            # Continue after the second row
+            checkpoint.write_text(json.dumps({
+                "last_pk": Article.objects.order_by("pk")[1].pk, "processed": 2, "changed": 1
+            }))
+            output = StringIO()
+            Command(stdout=output).reapply(
+                Article, chunk_size=1, checkpoint=str(checkpoint), resume=True, pushdown=False
+            )
+            self.assertIn("2 rows processed, 2 changed", output.getvalue())
+            self.assertEqual(get_titles(), [" First  ", "Second", "Third title", "Fourth"])
+            self.assertFalse(checkpoint.exists())
+            
+            # The rows before the checkpoint aren't updated in the database again
+            checkpoint.write_text(json.dumps({
+                "last_pk": Article.objects.order_by("pk")[0].pk, "processed": 1, "changed": 0
+            }))
+            output = StringIO()
+            Command(stdout=output).reapply(Article, chunk_size=2, checkpoint=str(checkpoint), resume=True)
+            self.assertIn("title: 0 rows changed in the database", output.getvalue())
+            self.assertEqual(get_titles(), [" First  ", "Second", "Third title", "Fourth"])
+            
+            # The remaining row is updated using a single query
+            output = StringIO()
+            Command(stdout=output).reapply(Article)
+            self.assertIn("title: 1 rows changed in the database", output.getvalue())
+            self.assertEqual(get_titles(), ["First", "Second", "Third title", "Fourth"])
+            
+            # Each chunk is split across the processes
+            submitted = []
+            
+            class Executor(ThreadPoolExecutor):
+                def submit(self, *args, **kwargs):
+                    submitted.append(args)
+                    return super().submit(*args, **kwargs)
+            
+            Article._base_manager.bulk_create(Article(title=f" Fifth {index} ") for index in range(3))
+            
+            with mock.patch("django_common_utils.management.commands.reapply_handlers.ProcessPoolExecutor", Executor):
+                Command(stdout=StringIO()).reapply(
+                    Article, chunk_size=10, processes=3, checkpoint=str(checkpoint), pushdown=False
+                )
+            
+            self.assertEqual(len(submitted), 3)
+            self.assertEqual(get_titles()[4:], ["Fifth 0", "Fifth 1", "Fifth 2"])
+            
+            with self.assertRaises(CommandError):
+                Command(stdout=StringIO()).reapply(Article, fields=["missing"])
+        
+        with self.assertRaises(CommandError):
+            call_command("reapply_handlers", "django_common_utils.Missing", stdout=StringIO())